@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# Computes the centerline network and the difficulty metrics of many airway models without the Slicer GUI.
+# Needs the vmtk python modules, so run it with Slicer's python, e.g.
+#   PythonSlicer BronchusDifficultyBatch.py models/ results/ --workers 4
+
+MODEL_EXTENSIONS = ('.vtp', '.vtk', '.stl', '.ply', '.obj')
+
+
+def get_program_parameters():
+  import argparse
+  description = 'Compute the bronchus difficulty metrics of a set of airway models.'
+  epilogue = '''
+The input is either a directory or a CSV manifest.
+
+A directory is searched for models (.vtp, .vtk, .stl, .ply, .obj), each with a sidecar <model name>.json:
+  {"seed": [x, y, z], "roi": [x, y, z]}
+where the roi (the end point of a single path) is optional.
+
+A manifest has the columns model,seed_x,seed_y,seed_z,roi_x,roi_y,roi_z with model paths relative to the manifest
+and empty roi columns for a full airway tree.
+
+Every case is written to <output>/<model name>/: centerline.vtp, raw_data.txt, raw_data.bdm (the metric store
+for CenterlineSlider) and min_max.txt. Cases that finished earlier with the same model, seed, ROI, options and
+network decimation (as saved in their done.json) are skipped, so an interrupted run can simply be started again.
+'''
+  parser = argparse.ArgumentParser(description=description, epilog=epilogue,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('input', help='Directory of models or CSV manifest')
+  parser.add_argument('output', help='Output directory')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+  parser.add_argument('--resampling-step', type=float, default=0.0, help='Centerline resampling step length in mm, 0 to disable')
+  parser.add_argument('--local-curvature-range', type=float, default=3.0, help='Local curvature range in mm')
+  parser.add_argument('--curvature-rate-range', type=float, default=20.0, help='Curvature rate range in mm')
+  parser.add_argument('--network-triangles', type=int, default=20000, help='Triangle budget of the surface used for the network extraction')
+  parser.add_argument('--network-time-budget', type=float, default=0.0, help='Time budget of the network extraction in seconds, replaces the triangle budget if larger than 0')
+  parser.add_argument('--centerline-workers', type=int, default=1, help='Number of processes computing the centerlines of each case')
+  parser.add_argument('--profile', action='store_true', help='Write the time and memory of every stage to profile.json and profile.trace.json')
+  parser.add_argument('--force', action='store_true', help='Recompute finished cases')
+  args = parser.parse_args()
+  return args
+
+
+def readCoordinates(values):
+  if not values or all(value in ('', None) for value in values):
+    return None
+  return [float(value) for value in values]
+
+
+def findCases(inputPath):
+  """List of (name, modelFileName, seed, roi)."""
+  cases = []
+  if os.path.isdir(inputPath):
+    for fileName in sorted(os.listdir(inputPath)):
+      name, extension = os.path.splitext(fileName)
+      if extension.lower() not in MODEL_EXTENSIONS:
+        continue
+      sidecarFileName = os.path.join(inputPath, name + '.json')
+      if not os.path.isfile(sidecarFileName):
+        print("Skipping " + fileName + ": no " + name + ".json with the seed")
+        continue
+      with open(sidecarFileName) as f:
+        sidecar = json.load(f)
+      cases.append((name, os.path.join(inputPath, fileName), readCoordinates(sidecar['seed']), readCoordinates(sidecar.get('roi'))))
+  else:
+    manifestDirectory = os.path.dirname(os.path.abspath(inputPath))
+    with open(inputPath, newline='') as f:
+      for row in csv.DictReader(f):
+        modelFileName = os.path.join(manifestDirectory, row['model'])
+        name = os.path.splitext(os.path.basename(row['model']))[0]
+        seed = readCoordinates([row['seed_x'], row['seed_y'], row['seed_z']])
+        roi = readCoordinates([row.get('roi_x'), row.get('roi_y'), row.get('roi_z')])
+        cases.append((name, modelFileName, seed, roi))
+
+  names = [case[0] for case in cases]
+  duplicates = set(name for name in names if names.count(name) > 1)
+  if duplicates:
+    raise ValueError("Model names must be unique, found " + ", ".join(sorted(duplicates)))
+  return cases
+
+
+def caseSettings(case, options, decimation):
+  """Everything the results of a case depend on, as saved in its done.json."""
+  name, modelFileName, seed, roi = case
+  settings = {'model': os.path.abspath(modelFileName), 'seed': seed, 'roi': roi, 'options': options, 'decimation': decimation}
+  # as read back from done.json, with lists for tuples
+  return json.loads(json.dumps(settings))
+
+
+def isFinished(case, outputDirectory, options, decimation):
+  """True if done.json of the case exists and was written with the same settings."""
+  doneFileName = os.path.join(outputDirectory, case[0], 'done.json')
+  if not os.path.isfile(doneFileName):
+    return False
+  try:
+    with open(doneFileName) as f:
+      done = json.load(f)
+  except ValueError:
+    return False
+  settings = caseSettings(case, options, decimation)
+  return all(done.get(key) == value for key, value in settings.items())
+
+
+def runCase(case, outputDirectory, options, centerlineWorkers=1, profile=False, decimation=None):
+  """Computes one case in a worker process. Returns (name, seconds, error message or None)."""
+  from BronchusDifficultyLib.logic import CenterlineComputationLogic
+  from BronchusDifficultyLib.profiling import StageProfiler
+  from BronchusDifficultyLib.pipeline import DifficultyOptions, computeCenterlineNetwork, computeDifficultyMetrics, readPolyData, writeMetricStore, writeMinMax, writePolyData, writeRawData
+
+  name, modelFileName, seed, roi = case
+  caseDirectory = os.path.join(outputDirectory, name)
+  if not os.path.isdir(caseDirectory):
+    os.makedirs(caseDirectory)
+  startTime = time.time()
+
+  try:
+    difficultyOptions = DifficultyOptions(**options)
+    logic = CenterlineComputationLogic()
+    logic.numberOfWorkers = centerlineWorkers
+    if profile:
+      logic.profiler = StageProfiler()
+    surface = readPolyData(modelFileName)
+    centerlines, voronoi = computeCenterlineNetwork(logic, surface, seed, roi, difficultyOptions.resamplingStepLength, decimation=decimation)
+
+    metrics = computeDifficultyMetrics(centerlines, difficultyOptions, profiler=logic.profiler)
+    metrics.addToPolyData(centerlines)
+
+    writePolyData(os.path.join(caseDirectory, 'centerline.vtp'), centerlines)
+    writeRawData(os.path.join(caseDirectory, 'raw_data.txt'), metrics)
+    writeMetricStore(os.path.join(caseDirectory, 'raw_data.bdm'), metrics)
+    writeMinMax(os.path.join(caseDirectory, 'min_max.txt'), metrics)
+    if logic.profiler is not None:
+      logic.profiler.writeJson(os.path.join(caseDirectory, 'profile.json'))
+      logic.profiler.writeChromeTrace(os.path.join(caseDirectory, 'profile.trace.json'))
+
+    # the marker is written last, a case without it is computed again on the next run
+    seconds = time.time() - startTime
+    done = caseSettings(case, options, decimation)
+    done.update({'seconds': seconds, 'numberOfPoints': centerlines.GetNumberOfPoints(), 'numberOfLines': centerlines.GetNumberOfCells(),
+                 'numberOfBranches': metrics.tree.numberOfBranches})
+    with open(os.path.join(caseDirectory, 'done.json.partial'), 'w') as f:
+      json.dump(done, f, indent=2)
+    os.replace(os.path.join(caseDirectory, 'done.json.partial'), os.path.join(caseDirectory, 'done.json'))
+    errorFileName = os.path.join(caseDirectory, 'error.txt')
+    if os.path.isfile(errorFileName):
+      os.remove(errorFileName)
+    return (name, seconds, None)
+
+  except Exception as e:
+    with open(os.path.join(caseDirectory, 'error.txt'), 'w') as f:
+      f.write(traceback.format_exc())
+    return (name, time.time() - startTime, str(e))
+
+
+def runCaseInProcess(context, case, outputDirectory, *arguments):
+  """Runs runCase in a new process of its own, so no VTK state or memory is carried over from other cases
+  and a crash of the process (e.g. in vmtk) only fails this case. Returns the result of runCase."""
+  name = case[0]
+  startTime = time.time()
+  try:
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+      return executor.submit(runCase, case, outputDirectory, *arguments).result()
+  except Exception as e:
+    # BrokenProcessPool if the process died, runCase could not write error.txt then
+    caseDirectory = os.path.join(outputDirectory, name)
+    if not os.path.isdir(caseDirectory):
+      os.makedirs(caseDirectory)
+    with open(os.path.join(caseDirectory, 'error.txt'), 'w') as f:
+      f.write("The worker process of this case failed:\n" + traceback.format_exc())
+    return (name, time.time() - startTime, str(e) or e.__class__.__name__)
+
+
+def main():
+  import multiprocessing
+  from BronchusDifficultyLib.parallel import workerExecutable
+
+  args = get_program_parameters()
+
+  cases = findCases(args.input)
+  if not os.path.isdir(args.output):
+    os.makedirs(args.output)
+
+  options = {'resamplingStepLength': args.resampling_step, 'localCurvatureRange': args.local_curvature_range,
+             'curvatureRateRange': args.curvature_rate_range}
+  decimation = {'targetTriangles': args.network_triangles, 'timeBudget': args.network_time_budget}
+
+  if not args.force:
+    # cases finished with other options, decimation, seed or ROI are computed again
+    remaining = [case for case in cases if not isFinished(case, args.output, options, decimation)]
+    if len(remaining) < len(cases):
+      print("Skipping " + str(len(cases) - len(remaining)) + " finished cases")
+    cases = remaining
+  if not cases:
+    print("Nothing to do")
+    return 0
+
+  workers = max(1, min(args.workers or 1, len(cases)))
+  print("Computing " + str(len(cases)) + " cases with " + str(workers) + " workers")
+
+  context = multiprocessing.get_context('spawn')
+  executable = workerExecutable()
+  if executable is not None:
+    context.set_executable(executable)
+
+  # every case runs in a process of its own, the threads only start them and wait for them
+  failed = []
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(runCaseInProcess, context, case, args.output, options, args.centerline_workers, args.profile, decimation) for case in cases]
+    for future in as_completed(futures):
+      name, seconds, error = future.result()
+      if error is None:
+        print("%s: done in %.1f s" % (name, seconds))
+      else:
+        print("%s: failed after %.1f s: %s" % (name, seconds, error))
+        failed.append(name)
+
+  print(str(len(cases) - len(failed)) + " of " + str(len(cases)) + " cases done")
+  if failed:
+    print("Failed: " + ", ".join(sorted(failed)) + " (see error.txt in their output directories)")
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+import json
+import sys
+import time
+
+import numpy as np
+
+# Times the difficulty pipeline on synthetic airway trees of growing size and checks the metrics
+# against the analytic curvature and angles of the trees, e.g.
+#   python BronchusDifficultyBenchmark.py --generations 3 5 7 --output benchmark.json
+# With --surface the surface stages (vmtk) are timed as well, so run it with Slicer's python; --centerline-workers
+# compares the serial centerlines with the backtracing split across processes:
+#   PythonSlicer BronchusDifficultyBenchmark.py --surface --centerline-workers 2 4 8
+
+
+def get_program_parameters():
+  import argparse
+  description = 'Benchmark the bronchus difficulty metrics on synthetic airway trees.'
+  epilogue = '''
+Every tree is a binary tree of tubes with a straight 100 mm trachea. Below it, the branches follow helices
+of the given curvature and torsion, so the local curvature away from the bifurcations is 2550 * curvature.
+The global relative angle is checked on a second tree of straight branches, where it is the angle between
+each branch and the trachea.
+
+The exit code is 1 if a check exceeds its tolerance.
+'''
+  parser = argparse.ArgumentParser(description=description, epilog=epilogue,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--generations', type=int, nargs='+', default=[3, 5, 7], help='Tree sizes, in generations including the trachea')
+  parser.add_argument('--point-spacing', type=float, nargs='+', default=[0.5], help='Centerline point spacings in mm')
+  parser.add_argument('--curvature', type=float, default=0.05, help='Branch curvature in 1/mm')
+  parser.add_argument('--torsion', type=float, default=0.01, help='Branch torsion in 1/mm')
+  parser.add_argument('--branch-angle', type=float, default=35.0, help='Angle between a child and its parent in degrees')
+  parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the fastest one is reported')
+  parser.add_argument('--tolerance', type=float, default=0.02, help='Largest relative error of the local curvature and the angles')
+  parser.add_argument('--surface', action='store_true', help='Also time the centerline extraction from the surface (needs vmtk)')
+  parser.add_argument('--voxel-size', type=float, default=0.5, help='Voxel size of the synthetic surfaces in mm')
+  parser.add_argument('--centerline-workers', type=int, nargs='+', default=[], help='With --surface, also time the centerlines with the backtracing split across these numbers of processes')
+  parser.add_argument('--output', help='JSON file for the timings and check results')
+  args = parser.parse_args()
+  return args
+
+
+def timeMetrics(centerlines, repeat):
+  """Fastest wall time of every metric stage over `repeat` runs."""
+  from BronchusDifficultyLib.pipeline import computeDifficultyMetrics
+  from BronchusDifficultyLib.profiling import StageProfiler
+
+  times = {}
+  for i in range(repeat):
+    profiler = StageProfiler()
+    startTime = time.perf_counter()
+    computeDifficultyMetrics(centerlines, profiler=profiler)
+    total = time.perf_counter() - startTime
+    for record in profiler.records:
+      times[record.name] = min(times.get(record.name, float('inf')), record.wallTime)
+    times['Total'] = min(times.get('Total', float('inf')), total)
+  return times
+
+
+def timeSurfaceStages(surface, seed, numberOfWorkers=1):
+  """Wall time of every stage of the centerline extraction with the backtracing split across
+  numberOfWorkers processes, and the number of centerlines."""
+  from BronchusDifficultyLib.logic import CenterlineComputationLogic
+  from BronchusDifficultyLib.pipeline import computeCenterlineNetwork
+  from BronchusDifficultyLib.profiling import StageProfiler
+
+  logic = CenterlineComputationLogic()
+  logic.profiler = StageProfiler()
+  logic.numberOfWorkers = numberOfWorkers
+  centerlines, voronoi = computeCenterlineNetwork(logic, surface, seed)
+  times = {}
+  for record in logic.profiler.records:
+    times[record.name] = times.get(record.name, 0.0) + record.wallTime
+  return times, centerlines.GetNumberOfCells()
+
+
+def timeCenterlineWorkers(tree, voxelSize, workerCounts):
+  """Times the surface stages once per number of centerline workers. Every run has to give as many
+  centerlines as the serial one; returns (times by number of workers, numberOfTriangles, passed)."""
+  startTime = time.perf_counter()
+  surface = tree.surfacePolyData(voxelSize)
+  surfaceTime = time.perf_counter() - startTime
+  # the seed is inside the top of the trachea
+  seed = (tree.branches[0].points[0] + 2.0 * tree.branches[0].tangents[0]).tolist()
+
+  times = {}
+  numberOfLines = {}
+  for numberOfWorkers in [1] + [n for n in workerCounts if n > 1]:
+    times[numberOfWorkers], numberOfLines[numberOfWorkers] = timeSurfaceStages(surface, seed, numberOfWorkers)
+  times[1]['Synthetic surface'] = surfaceTime
+  passed = all(lines == numberOfLines[1] for lines in numberOfLines.values())
+  return times, surface.GetNumberOfCells(), passed
+
+
+def pointIdsWithin(branchIds, offsets):
+  """Point ids whose neighbours at all offsets (in samples along the line) are on the same branch."""
+  ids = np.arange(branchIds.size)
+  mask = np.ones(branchIds.size, dtype=bool)
+  for offset in offsets:
+    shifted = ids + offset
+    inside = (shifted >= 0) & (shifted < branchIds.size)
+    mask &= inside
+    mask[inside] &= branchIds[shifted[inside]] == branchIds[inside]
+  return ids[mask]
+
+
+def checkLocalCurvature(tree):
+  """Largest relative error of the local curvature against 2550 * curvature, away from bifurcations and line ends."""
+  from vtk.util.numpy_support import vtk_to_numpy
+  from BronchusDifficultyLib.metrics import CURVATURE_SCALE
+  from BronchusDifficultyLib.pipeline import DifficultyOptions, computeDifficultyMetrics
+
+  centerlines = tree.centerlinePolyData()
+  options = DifficultyOptions()
+  metrics = computeDifficultyMetrics(centerlines, options, metrics=("Local Curvature",))
+  window = metrics.arcLengthIndex.pointsForLength(options.localCurvatureRange)
+
+  branchIds = vtk_to_numpy(centerlines.GetPointData().GetArray('BranchId'))
+  analytic = CURVATURE_SCALE * vtk_to_numpy(centerlines.GetPointData().GetArray('AnalyticCurvature'))
+  values = metrics.values["Local Curvature"]
+  pointIds = pointIdsWithin(branchIds, [-window, window])
+  pointIds = pointIds[(pointIds < values.size) & (analytic[pointIds] > 0) & (values[pointIds] > 0)]
+  if not pointIds.size:
+    return None
+  return float(np.max(np.abs(values[pointIds] - analytic[pointIds]) / analytic[pointIds]))
+
+
+def checkGlobalRelativeAngle(tree):
+  """Largest relative error of the global relative angle against the angle between each straight branch and the trachea."""
+  from vtk.util.numpy_support import vtk_to_numpy
+  from BronchusDifficultyLib.pipeline import computeDifficultyMetrics
+
+  centerlines = tree.centerlinePolyData()
+  metrics = computeDifficultyMetrics(centerlines, metrics=("GlobalRelativeAngle",))
+  step = metrics.arcLengthIndex.pointsForLength(1.0)
+
+  branchIds = vtk_to_numpy(centerlines.GetPointData().GetArray('BranchId'))
+  tangents = vtk_to_numpy(centerlines.GetPointData().GetArray('AnalyticTangent'))
+  analytic = np.arccos(np.clip(tangents.dot(metrics.tracheaVector), -1.0, 1.0))
+  values = metrics.values["GlobalRelativeAngle"]
+  # right after a bifurcation the shared points take the value of the line that owns them, so skip 2 steps there
+  pointIds = pointIdsWithin(branchIds, [-2 * step, step])
+  pointIds = pointIds[(pointIds < values.size) & (branchIds[pointIds] > 0) & (values[pointIds] > 0)]
+  if not pointIds.size:
+    return None
+  return float(np.max(np.abs(values[pointIds] - analytic[pointIds]) / analytic[pointIds]))
+
+
+def main():
+  from BronchusDifficultyLib.synthetic import SyntheticAirwayTree
+
+  args = get_program_parameters()
+  if args.surface:
+    from BronchusDifficultyLib.vmtkmodules import vmtkAvailable
+    if not vmtkAvailable():
+      print("The surface stages need vmtk, run the benchmark with Slicer's python or install the vmtk package")
+      return 1
+
+  results = []
+  failed = False
+  for pointSpacing in args.point_spacing:
+    for generations in args.generations:
+      tree = SyntheticAirwayTree(generations, branchAngle=args.branch_angle, curvature=args.curvature,
+                                 torsion=args.torsion, pointSpacing=pointSpacing)
+      straightTree = SyntheticAirwayTree(generations, branchAngle=args.branch_angle, pointSpacing=pointSpacing)
+      centerlines = tree.centerlinePolyData()
+      result = {'generations': generations, 'pointSpacing': pointSpacing,
+                'numberOfLines': centerlines.GetNumberOfCells(), 'numberOfPoints': centerlines.GetNumberOfPoints(),
+                'metricTimes': timeMetrics(centerlines, args.repeat),
+                'localCurvatureError': checkLocalCurvature(tree),
+                'globalRelativeAngleError': checkGlobalRelativeAngle(straightTree)}
+      if args.surface:
+        surfaceTimes, result['numberOfTriangles'], result['centerlineWorkersPassed'] = timeCenterlineWorkers(tree, args.voxel_size, args.centerline_workers)
+        result['surfaceTimes'] = surfaceTimes[1]
+        result['centerlineTimes'] = dict((numberOfWorkers, times.get('computeCenterlines')) for numberOfWorkers, times in surfaceTimes.items())
+      results.append(result)
+
+      print("%d generations, %.2f mm spacing: %d lines, %d points" % (generations, pointSpacing, result['numberOfLines'], result['numberOfPoints']))
+      for times in [result['metricTimes'], result.get('surfaceTimes', {})]:
+        for name, seconds in times.items():
+          print("  %-40s %8.4f s" % (name, seconds))
+      if len(result.get('centerlineTimes', {})) > 1:
+        serialTime = result['centerlineTimes'][1]
+        for numberOfWorkers, seconds in sorted(result['centerlineTimes'].items()):
+          print("  %-40s %8.4f s (%.2fx)" % ("computeCenterlines, %d workers" % numberOfWorkers, seconds, serialTime / seconds))
+        failed = failed or not result['centerlineWorkersPassed']
+        print("  %-40s %s" % ("centerlines of all worker counts", "ok" if result['centerlineWorkersPassed'] else "FAILED"))
+      for name in ['localCurvatureError', 'globalRelativeAngleError']:
+        error = result[name]
+        passed = error is not None and error <= args.tolerance
+        failed = failed or not passed
+        print("  %-40s %s %s" % (name, "n/a" if error is None else "%.4f" % error, "ok" if passed else "FAILED"))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
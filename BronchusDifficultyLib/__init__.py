@@ -0,0 +1,8 @@
+"""Slicer-independent helpers shared by the centerline modules."""
+
+from .pointview import CenterlinePointView
+from .locator import CenterlineLocator
+from .arclength import CenterlineArcLengthIndex, cumulativeArcLength, cumulativeMetricIntegral
+from .airwaytree import AirwayBranch, AirwayTree
+from .stagecache import StageCache
+from .metrics import CenterlineMetricEngine, PlaneRotationState, circumradiusCurvature, planeRotationKernel, trackMinMax
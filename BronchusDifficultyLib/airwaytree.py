@@ -0,0 +1,198 @@
+import numpy as np
+
+from .arclength import cumulativeArcLength
+
+#
+# Airway tree built from the overlapping lines of a vmtk centerline network
+#
+
+class AirwayBranch(object):
+  """A segment of the airway tree between two bifurcations (or a bifurcation and an end point).
+
+  cellId: the network line the branch is taken from
+  start, stop: positions of the branch within that line
+  pointIds: ids of the branch points in the network polydata
+  parent: id of the parent branch, -1 for the root
+  children: ids of the child branches
+  generation: 0 for the root, parent generation + 1 otherwise
+  """
+
+  def __init__(self, branchId, cellId, start, stop, pointIds):
+    self.branchId = branchId
+    self.cellId = cellId
+    self.start = start
+    self.stop = stop
+    self.pointIds = pointIds
+    self.parent = -1
+    self.children = []
+    self.generation = 0
+
+  def __repr__(self):
+    return "AirwayBranch(%d, cell %d, points %d-%d, parent %d, generation %d)" % (
+      self.branchId, self.cellId, self.start, self.stop, self.parent, self.generation)
+
+
+class AirwayTree(object):
+  """Splits the lines of a vtkvmtkPolyDataCenterlines output into unique branches.
+
+  Every vmtk line runs from the source to one target, so the lines share their proximal points
+  (as separate, nearly identical copies). A line follows an earlier line until the distance
+  between the points at equal arc length exceeds tolerance * radius; from that point on it owns
+  its points. The owned part of each line is cut into branches wherever other lines leave it.
+
+  view: CenterlinePointView of the network
+  radius: the 'Radius' point data array
+  cellIds: lines to include in the tree, in order (all lines by default)
+
+  canonicalPointIds maps every point id to the id of the owned copy of that point, branchOfPoint
+  maps it to its branch (-1 for points of lines that are not in the tree).
+  """
+
+  def __init__(self, view, radius, cellIds=None, tolerance=0.5):
+    self.view = view
+    self.radius = np.asarray(radius, dtype=np.float64)
+    self.cellIds = list(range(view.numberOfCells)) if cellIds is None else [int(cellId) for cellId in cellIds]
+    self.tolerance = tolerance
+
+    numberOfLines = len(self.cellIds)
+    self._lineOfCell = dict((cellId, line) for line, cellId in enumerate(self.cellIds))
+    self._ids = [view.cellPointIds(cellId) for cellId in self.cellIds]
+    self._pts = [view.cellPoints(cellId) for cellId in self.cellIds]
+    self._arcLengths = [cumulativeArcLength(pts) for pts in self._pts]
+
+    # parent line and divergence position of each line
+    self.lineParents = np.full(numberOfLines, -1, dtype=np.int64)
+    self.lineStarts = np.zeros(numberOfLines, dtype=np.int64)
+    for line in range(1, numberOfLines):
+      sharedCounts = [self._sharedCount(line, other) for other in range(line)]
+      parent = int(np.argmax(sharedCounts))
+      if sharedCounts[parent] > 0:
+        self.lineParents[line] = parent
+        self.lineStarts[line] = sharedCounts[parent]
+
+    self._buildPointMap()
+    self._buildBranches()
+
+  def _sharedCount(self, line, other):
+    """Number of leading points of `line` that lie on `other` within the radius-relative tolerance."""
+    arcLength, otherArcLength = self._arcLengths[line], self._arcLengths[other]
+    if arcLength.size == 0 or otherArcLength.size == 0:
+      return 0
+    comparable = int(np.searchsorted(arcLength, otherArcLength[-1], side='right'))
+    pts = self._pts[line][:comparable]
+    otherPts = self._pts[other]
+
+    # points of the other line at the same arc length
+    aligned = np.empty_like(pts)
+    for axis in range(3):
+      aligned[:, axis] = np.interp(arcLength[:comparable], otherArcLength, otherPts[:, axis])
+    distance = np.sqrt(np.sum((pts - aligned)**2, axis=1))
+
+    diverged = distance > self.tolerance * self.radius[self._ids[line][:comparable]]
+    return int(np.argmax(diverged)) if diverged.any() else comparable
+
+  def _positionOnLine(self, line, arcLength):
+    """Position of the point of `line` closest to the given arc length."""
+    lineArcLength = self._arcLengths[line]
+    return int(np.clip(np.round(np.interp(arcLength, lineArcLength, np.arange(lineArcLength.size))), 0, lineArcLength.size - 1))
+
+  def _ownerOf(self, line, position):
+    """(line, position) of the owned copy of a point of `line`, following the shared parts up the tree."""
+    while self.lineParents[line] >= 0 and position < self.lineStarts[line]:
+      parent = self.lineParents[line]
+      position = self._positionOnLine(parent, self._arcLengths[line][position])
+      line = parent
+    return (line, position)
+
+  def _buildPointMap(self):
+    self.canonicalPointIds = np.arange(self.view.numberOfPoints, dtype=np.int64)
+    # lines are processed in order, so the parent points are already mapped to their owners
+    for line in range(len(self.cellIds)):
+      parent, start = self.lineParents[line], self.lineStarts[line]
+      if parent < 0 or start == 0:
+        continue
+      parentArcLength = self._arcLengths[parent]
+      positions = np.round(np.interp(self._arcLengths[line][:start], parentArcLength, np.arange(parentArcLength.size))).astype(np.int64)
+      self.canonicalPointIds[self._ids[line][:start]] = self.canonicalPointIds[self._ids[parent][positions]]
+
+  def _buildBranches(self):
+    numberOfLines = len(self.cellIds)
+
+    # cut every line where it starts to be owned and where other lines leave it
+    cuts = [set([int(self.lineStarts[line]), self._ids[line].size]) for line in range(numberOfLines)]
+    branchPoints = [None] * numberOfLines
+    for line in range(numberOfLines):
+      parent, start = self.lineParents[line], self.lineStarts[line]
+      if parent < 0:
+        continue
+      # the bifurcation is the first owned point, found on the line that owns the point before it
+      owner, position = self._ownerOf(line, start - 1)
+      branchPoints[line] = (owner, position + 1)
+      cuts[owner].add(position + 1)
+
+    self.branches = []
+    self.branchOfPoint = np.full(self.view.numberOfPoints, -1, dtype=np.int64)
+    lineBranches = []
+    for line in range(numberOfLines):
+      ids = self._ids[line]
+      positions = sorted(cut for cut in cuts[line] if self.lineStarts[line] <= cut <= ids.size)
+      branchIds = []
+      for start, stop in zip(positions[:-1], positions[1:]):
+        if stop <= start:
+          continue
+        branch = AirwayBranch(len(self.branches), self.cellIds[line], start, stop, ids[start:stop])
+        self.branchOfPoint[branch.pointIds] = branch.branchId
+        self.branches.append(branch)
+        branchIds.append(branch.branchId)
+      lineBranches.append(branchIds)
+
+    # link the branches of each line to each other and to the branch they leave from
+    for line in range(numberOfLines):
+      branchIds = lineBranches[line]
+      if not branchIds:
+        continue
+      for previous, branchId in zip(branchIds[:-1], branchIds[1:]):
+        self._link(previous, branchId)
+      if branchPoints[line] is not None:
+        owner, position = branchPoints[line]
+        for branchId in lineBranches[owner]:
+          if self.branches[branchId].stop == position:
+            self._link(branchId, branchIds[0])
+            break
+
+    # generations, parents always come before their children in a depth-first order from the roots
+    stack = [branch.branchId for branch in self.branches if branch.parent < 0]
+    while stack:
+      branch = self.branches[stack.pop()]
+      for child in branch.children:
+        self.branches[child].generation = branch.generation + 1
+        stack.append(child)
+
+    # shared point copies belong to the branch of their owned copy
+    shared = self.canonicalPointIds != np.arange(self.canonicalPointIds.size)
+    self.branchOfPoint[shared] = self.branchOfPoint[self.canonicalPointIds[shared]]
+
+  def _link(self, parentId, childId):
+    self.branches[childId].parent = parentId
+    self.branches[parentId].children.append(childId)
+
+  @property
+  def numberOfBranches(self):
+    return len(self.branches)
+
+  def ownedStart(self, cellId):
+    """Position within a line from which on the line owns its points (0 for lines not in the tree)."""
+    line = self._lineOfCell.get(cellId)
+    return 0 if line is None else int(self.lineStarts[line])
+
+  def sharedPointIds(self):
+    """Ids of all point copies whose values are taken from another line."""
+    return np.flatnonzero(self.canonicalPointIds != np.arange(self.canonicalPointIds.size))
+
+  def scatter(self, values):
+    """Copies the values of owned points to all of their shared copies, in place.
+    Point ids beyond the length of values are left out."""
+    shared = self.sharedPointIds()
+    shared = shared[(shared < len(values)) & (self.canonicalPointIds[shared] < len(values))]
+    values[shared] = values[self.canonicalPointIds[shared]]
+    return values
@@ -0,0 +1,76 @@
+import numpy as np
+
+#
+# Arc-length indexing of the lines of a centerline network
+#
+
+def cumulativeArcLength(points):
+  """Distance (mm) along a polyline from its first point to each of its (n, 3) points."""
+  points = np.asarray(points, dtype=np.float64)
+  if points.shape[0] == 0:
+    return np.zeros(0)
+  steps = np.sqrt(np.sum(np.diff(points, axis=0)**2, axis=1))
+  return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def cumulativeMetricIntegral(points, values):
+  """Trapezoidal integral (metric * mm) of per-point values along a polyline, from its first point
+  to each of its (n, 3) points. Differences give the integral between any two points."""
+  values = np.asarray(values, dtype=np.float64)
+  if values.shape[0] == 0:
+    return np.zeros(0)
+  steps = np.diff(cumulativeArcLength(points))
+  return np.concatenate(([0.0], np.cumsum(steps * 0.5 * (values[:-1] + values[1:]))))
+
+
+def closestPositions(arcLength, lengths):
+  """Positions of the values of an increasing arcLength array closest to each of the given lengths."""
+  after = np.clip(np.searchsorted(arcLength, lengths), 1, arcLength.size - 1)
+  return np.where(lengths - arcLength[after - 1] <= arcLength[after] - lengths, after - 1, after)
+
+
+class CenterlineArcLengthIndex(object):
+  """Cumulative arc length of every line of a CenterlinePointView.
+
+  Lets metric windows be given in millimetres: neighbourPositions() finds the points closest to a
+  given arc length before and after every point of a line, which holds on unevenly spaced lines too.
+  pointsForLength() converts a length to a point count with the median point spacing of the network
+  (the step length if the centerline was resampled), for margins that are counted in point ids.
+  """
+
+  def __init__(self, view):
+    self.view = view
+    self.arcLengths = [cumulativeArcLength(view.cellPoints(i)) for i in range(view.numberOfCells)]
+
+    steps = np.concatenate([np.diff(arcLength) for arcLength in self.arcLengths]) if self.arcLengths else np.zeros(0)
+    steps = steps[steps > 0]
+    self.spacing = float(np.median(steps)) if steps.size else 1.0
+
+  def cellLength(self, cellId):
+    arcLength = self.arcLengths[cellId]
+    return float(arcLength[-1]) if arcLength.size else 0.0
+
+  def pointsForLength(self, length):
+    """Number of point steps (at least 1) covering the given length in mm."""
+    return max(1, int(round(length / self.spacing)))
+
+  def neighbourPositions(self, cellId, length):
+    """Positions within a line of the points closest to `length` mm of arc length before and after
+    each of its points, at least one point away: (before, after), with -1 and the number of points
+    of the line where the line ends first."""
+    arcLength = self.arcLengths[cellId]
+    n = arcLength.size
+    if n < 2:
+      return (np.full(n, -1), np.full(n, n))
+    # one more point at each end, spaced like the last one, stands for the points past the end of the line
+    extended = np.concatenate(([2*arcLength[0] - arcLength[1]], arcLength, [2*arcLength[-1] - arcLength[-2]]))
+    positions = np.arange(n)
+    before = np.minimum(closestPositions(extended, arcLength - length) - 1, positions - 1)
+    after = np.maximum(closestPositions(extended, arcLength + length) - 1, positions + 1)
+    return (before, np.minimum(after, n))
+
+  def indexAtLength(self, cellId, length):
+    """Position within a line of the first point at least `length` mm from its start
+    (the last point if the line is shorter)."""
+    arcLength = self.arcLengths[cellId]
+    return min(int(np.searchsorted(arcLength, length)), arcLength.size - 1)
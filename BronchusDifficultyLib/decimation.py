@@ -0,0 +1,80 @@
+import json
+import math
+import os
+
+import numpy as np
+
+#
+# Decimation targets from a triangle budget or a time budget for the network extraction
+#
+
+class NetworkCostModel(object):
+  """Calibration of the network extraction time against the number of triangles of its input,
+  seconds = scale * triangles**exponent.
+
+  The default is a rough prior, every recorded run refits the model in log space: the exponent
+  once the runs span at least a factor of 2 in triangles, only the scale before.
+  """
+
+  maximumSamples = 50
+
+  def __init__(self, scale=1e-4, exponent=1.0):
+    self.scale = scale
+    self.exponent = exponent
+    self.samples = []
+
+  def record(self, triangles, seconds):
+    if triangles <= 0 or seconds <= 0:
+      return
+    self.samples = (self.samples + [(int(triangles), float(seconds))])[-self.maximumSamples:]
+    self.fit()
+
+  def fit(self):
+    if not self.samples:
+      return
+    logTriangles = np.log([sample[0] for sample in self.samples])
+    logSeconds = np.log([sample[1] for sample in self.samples])
+    if np.ptp(logTriangles) >= math.log(2.0):
+      exponent, logScale = np.polyfit(logTriangles, logSeconds, 1)
+      # a few noisy runs must not turn the model upside down
+      self.exponent = float(np.clip(exponent, 0.5, 3.0))
+    self.scale = float(np.exp(np.mean(logSeconds - self.exponent * logTriangles)))
+
+  def seconds(self, triangles):
+    return self.scale * triangles**self.exponent
+
+  def triangles(self, seconds):
+    """Number of triangles the network extraction is expected to handle in the given time."""
+    return int((seconds / self.scale)**(1.0 / self.exponent))
+
+  def save(self, fileName):
+    with open(fileName, 'w') as f:
+      json.dump({'scale': self.scale, 'exponent': self.exponent, 'samples': self.samples}, f)
+
+  @classmethod
+  def load(cls, fileName):
+    """The model saved in fileName, the default model if there is none or it cannot be read."""
+    model = cls()
+    if not os.path.isfile(fileName):
+      return model
+    try:
+      with open(fileName) as f:
+        saved = json.load(f)
+      model.scale = float(saved['scale'])
+      model.exponent = float(saved['exponent'])
+      model.samples = [(int(triangles), float(seconds)) for triangles, seconds in saved['samples']]
+    except (ValueError, KeyError, TypeError):
+      return cls()
+    return model
+
+
+def decimationReduction(numberOfTriangles, targetTriangles=20000, minimumTriangles=2000):
+  """Target reduction (0 to 1) that leaves about targetTriangles of numberOfTriangles.
+
+  Models are never decimated below minimumTriangles, fewer triangles break the network extraction.
+  A time budget is turned into a triangle target by CenterlineComputationLogic.decimationTarget.
+  """
+  targetTriangles = max(targetTriangles, minimumTriangles)
+  if numberOfTriangles <= targetTriangles:
+    return 0.0
+  return 1.0 - float(targetTriangles) / numberOfTriangles
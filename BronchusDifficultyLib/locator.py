@@ -0,0 +1,71 @@
+import numpy as np
+
+try:
+  from scipy.spatial import cKDTree
+except ImportError:
+  # Slicer does not always ship scipy, vtkKdTreePointLocator is used then (the slow path, see closestPointIds)
+  cKDTree = None
+
+#
+# Nearest point queries on the points of a centerline
+#
+
+class CenterlineLocator(object):
+  """KD-tree over a (n, 3) point array, built once, answering nearest point queries in O(log n).
+
+  Every line of a vmtk centerline has its own copy of the points it shares with other lines; equal
+  points are indexed once and always reported as their first occurrence. A query point equally far
+  from two different points may get either of them, not necessarily the one a linear scan with
+  argmin would return.
+
+  locator = CenterlineLocator(view.points)
+  locator.closestPointId([x, y, z]), locator.closestPointIds(points)
+  """
+
+  def __init__(self, points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    self.numberOfPoints = points.shape[0]
+    if self.numberOfPoints == 0:
+      self._ids = np.zeros(0, dtype=np.int64)
+      self._tree = None
+      return
+    uniquePoints, self._ids = np.unique(points, axis=0, return_index=True)
+    if cKDTree is not None:
+      self._tree = cKDTree(uniquePoints)
+    else:
+      self._tree = self._vtkLocator(uniquePoints)
+
+  @staticmethod
+  def _vtkLocator(points):
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk
+
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_to_vtk(np.ascontiguousarray(points), deep=1))
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(vtkPoints)
+    locator = vtk.vtkKdTreePointLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+    # the locator does not keep a reference to its data set in Python
+    locator.polyData = polyData
+    return locator
+
+  def closestPointIds(self, points):
+    """Ids of the points closest to each of the given (m, 3) coordinates.
+
+    Without scipy this is the slow path: VTK has no batched nearest point query, so the points are
+    looked up one by one from Python and large batches take much longer than with scipy.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if self._tree is None:
+      raise ValueError("The locator has no points")
+    if cKDTree is not None:
+      distances, uniqueIds = self._tree.query(points)
+    else:
+      uniqueIds = np.array([self._tree.FindClosestPoint(point) for point in points.tolist()], dtype=np.int64)
+    return self._ids[uniqueIds]
+
+  def closestPointId(self, point):
+    """Id of the point closest to the given [x, y, z] coordinates."""
+    return int(self.closestPointIds(point)[0])
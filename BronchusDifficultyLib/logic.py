@@ -0,0 +1,491 @@
+import contextlib
+import logging
+import time
+
+import vtk
+
+from .decimation import NetworkCostModel, decimationReduction
+from .profiling import profiledStage
+from .vmtkmodules import computationalGeometry, misc
+
+#
+# Centerline computation using vmtk, independent of the Slicer scene
+#
+
+class CenterlineComputationLogic(object):
+    '''
+    classdocs
+    '''
+
+
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        # optional StageCache for the outputs of prepareModel, decimateSurface, openSurfaceAtPoint, extractNetwork and computeCenterlines
+        self.stageCache = None
+        # number of worker processes the centerline targets are split across, 1 computes all centerlines in this process
+        self.numberOfWorkers = 1
+        # optional observer added to the ProgressEvent of the last filter of every stage
+        self.progressObserver = None
+        # optional StageProfiler recording the time and memory of every stage
+        self.profiler = None
+        # network extraction time against triangle count, for the time budget of decimateSurface
+        self.networkCostModel = NetworkCostModel()
+
+    def stageParameters(self, stage, *args, **parameters):
+        '''
+        Returns the parameters the method called stage runs with for the given arguments, including all default values.
+        The triangle target of decimateSurface is the one its time budget resolves to with the current networkCostModel.
+        '''
+        import inspect
+
+        boundArguments = inspect.signature(getattr(self, stage)).bind_partial(None, *args, **parameters)
+        boundArguments.apply_defaults()
+        stageParameters = dict(boundArguments.arguments)
+        del stageParameters['polyData']
+        if stage == 'decimateSurface':
+            stageParameters['targetTriangles'] = self.decimationTarget(stageParameters['targetTriangles'], stageParameters['timeBudget'])
+        return stageParameters
+
+    def profilerStage(self, name, inputs=None):
+        '''
+        Context manager recording a stage with the profiler, does nothing without one.
+        '''
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name, inputs)
+
+    def cachedStage(self, inputKey, stage, polyData, *args, **parameters):
+        '''
+        Runs the method called stage on polyData (and any further arguments), or loads its output from the stage cache.
+        inputKey is the cache key of polyData, None if it is not known.
+
+        Returns a tupel of the form [outputs, outputKey] where outputs is a list of vtkPolyData.
+        '''
+        method = getattr(self, stage)
+        if self.stageCache is None or inputKey is None:
+            outputs = method(polyData, *args, **parameters)
+            return [list(outputs) if isinstance(outputs, list) else [outputs], None]
+
+        # the key includes the default values of all parameters that were not given
+        outputKey = self.stageCache.key(inputKey, stage, **self.stageParameters(stage, *args, **parameters))
+
+        numberOfOutputs = 2 if stage == 'computeCenterlines' else 1
+        with self.profilerStage(stage + " (cache load)"):
+            outputs = self.stageCache.load(outputKey, numberOfOutputs)
+        if outputs is None:
+            outputs = method(polyData, *args, **parameters)
+            outputs = list(outputs) if isinstance(outputs, list) else [outputs]
+            with self.profilerStage(stage + " (cache store)"):
+                self.stageCache.store(outputKey, outputs)
+        else:
+            logging.debug("Loaded " + stage + " output from the stage cache")
+
+        return [outputs, outputKey]
+
+    def inputProducer(self, polyData):
+        '''
+        Returns an algorithm providing polyData, to start a pipeline on data that is already in memory.
+        '''
+        producer = vtk.vtkTrivialProducer()
+        producer.SetOutput(polyData)
+        return producer
+
+    def observeProgress(self, algorithm):
+        '''
+        Forwards the ProgressEvent of algorithm to progressObserver, if there is one.
+        '''
+        if self.progressObserver is not None:
+            algorithm.AddObserver(vtk.vtkCommand.ProgressEvent, self.progressObserver)
+
+    def pipelineOutput(self, algorithm, port=0):
+        '''
+        Runs the pipeline ending in algorithm and returns its output as a new vtkPolyData.
+        The output shares its arrays with the pipeline (shallow copy), so nothing is copied.
+        '''
+        self.observeProgress(algorithm)
+        algorithm.Update()
+        outPolyData = vtk.vtkPolyData()
+        outPolyData.ShallowCopy(algorithm.GetOutputDataObject(port))
+        return outPolyData
+
+    def algorithmData(self, algorithm):
+        '''
+        Updates algorithm and returns its output data.
+        '''
+        self.observeProgress(algorithm)
+        algorithm.Update()
+        return algorithm.GetOutputDataObject(0)
+
+    def prepareModelPipeline(self, inputAlgorithm, numberOfSubdivisions=1, smoothingIterations=20, passBand=0.1, capDisplacement=0.0):
+        '''
+        Connects the preparation filters to the output of inputAlgorithm and returns the last one.
+        Intermediate outputs are released as soon as the next filter has consumed them.
+        '''
+        surfaceCleaner = vtk.vtkCleanPolyData()
+        surfaceCleaner.SetInputConnection(inputAlgorithm.GetOutputPort())
+        surfaceCleaner.ReleaseDataFlagOn()
+
+        surfaceTriangulator = vtk.vtkTriangleFilter()
+        surfaceTriangulator.SetInputConnection(surfaceCleaner.GetOutputPort())
+        surfaceTriangulator.PassLinesOff()
+        surfaceTriangulator.PassVertsOff()
+        surfaceTriangulator.ReleaseDataFlagOn()
+
+        # new steps for preparation to avoid problems because of slim models (f.e. at stenosis)
+        subdiv = vtk.vtkLinearSubdivisionFilter()
+        subdiv.SetInputConnection(surfaceTriangulator.GetOutputPort())
+        subdiv.SetNumberOfSubdivisions(numberOfSubdivisions)
+        subdiv.ReleaseDataFlagOn()
+
+        smooth = vtk.vtkWindowedSincPolyDataFilter()
+        smooth.SetInputConnection(subdiv.GetOutputPort())
+        smooth.SetNumberOfIterations(smoothingIterations)
+        smooth.SetPassBand(passBand)
+        smooth.SetBoundarySmoothing(1)
+        smooth.ReleaseDataFlagOn()
+
+        normals = vtk.vtkPolyDataNormals()
+        normals.SetInputConnection(smooth.GetOutputPort())
+        normals.SetAutoOrientNormals(1)
+        normals.SetFlipNormals(0)
+        normals.SetConsistency(1)
+        normals.SplittingOff()
+        normals.ReleaseDataFlagOn()
+
+        surfaceCapper = computationalGeometry().vtkvmtkCapPolyData()
+        surfaceCapper.SetInputConnection(normals.GetOutputPort())
+        surfaceCapper.SetDisplacement(capDisplacement)
+        surfaceCapper.SetInPlaneDisplacement(capDisplacement)
+
+        return surfaceCapper
+
+    @profiledStage
+    def prepareModel(self, polyData, numberOfSubdivisions=1, smoothingIterations=20, passBand=0.1, capDisplacement=0.0):
+        '''
+        '''
+        return self.pipelineOutput(self.prepareModelPipeline(self.inputProducer(polyData), numberOfSubdivisions, smoothingIterations, passBand, capDisplacement))
+
+    def decimationTarget(self, targetTriangles=20000, timeBudget=0.0):
+        '''
+        Returns the number of triangles decimateSurface aims for: targetTriangles or, with a time budget (s),
+        the number of triangles networkCostModel expects the network extraction to handle in that time.
+        '''
+        if timeBudget > 0 and self.networkCostModel is not None:
+            return self.networkCostModel.triangles(timeBudget)
+        return targetTriangles
+
+    def decimateSurfacePipeline(self, inputAlgorithm, targetTriangles=20000, timeBudget=0.0, quadricTriangles=500000, targetReduction=None):
+        '''
+        Connects the decimation filters to the output of inputAlgorithm and returns the last one.
+        The surface is decimated to about targetTriangles triangles or, with a time budget (s), to the number of
+        triangles the network extraction is expected to handle in that time (see networkCostModel).
+        A given targetReduction overrides both. Surfaces with more than quadricTriangles triangles are decimated
+        with the much faster vtkQuadricDecimation instead of the topology preserving vtkDecimatePro.
+        The input is updated here, since the reduction depends on its size.
+        '''
+        numberOfTriangles = self.algorithmData(inputAlgorithm).GetNumberOfPolys()
+        if targetReduction is None:
+            targetReduction = decimationReduction(numberOfTriangles, self.decimationTarget(targetTriangles, timeBudget))
+        logging.debug("Decimating %d triangles by %.3f" % (numberOfTriangles, targetReduction))
+
+        if numberOfTriangles > quadricTriangles:
+            decimationFilter = vtk.vtkQuadricDecimation()
+            decimationFilter.SetInputConnection(inputAlgorithm.GetOutputPort())
+            decimationFilter.SetTargetReduction(targetReduction)
+            decimationFilter.VolumePreservationOn()
+            decimationFilter.ReleaseDataFlagOn()
+        else:
+            decimationFilter = vtk.vtkDecimatePro()
+            decimationFilter.SetInputConnection(inputAlgorithm.GetOutputPort())
+            decimationFilter.SetTargetReduction(targetReduction)
+            decimationFilter.SetBoundaryVertexDeletion(0)
+            decimationFilter.PreserveTopologyOn()
+            decimationFilter.ReleaseDataFlagOn()
+
+        cleaner = vtk.vtkCleanPolyData()
+        cleaner.SetInputConnection(decimationFilter.GetOutputPort())
+        cleaner.ReleaseDataFlagOn()
+
+        triangleFilter = vtk.vtkTriangleFilter()
+        triangleFilter.SetInputConnection(cleaner.GetOutputPort())
+
+        return triangleFilter
+
+    @profiledStage
+    def decimateSurface(self, polyData, targetTriangles=20000, timeBudget=0.0, quadricTriangles=500000, targetReduction=None):
+        '''
+        Returns the surface decimated for the network extraction, see decimateSurfacePipeline.
+        '''
+        return self.pipelineOutput(self.decimateSurfacePipeline(self.inputProducer(polyData), targetTriangles, timeBudget, quadricTriangles, targetReduction))
+
+    def openSurfaceAtPointPipeline(self, inputAlgorithm, seed, someradius=1.0):
+        '''
+        Connects a clip filter opening the surface at the given seed to the output of inputAlgorithm and returns it.
+        The input is updated here, since the opening is placed on its closest point to the seed.
+        '''
+        polyData = self.algorithmData(inputAlgorithm)
+
+        pointLocator = vtk.vtkPointLocator()
+        pointLocator.SetDataSet(polyData)
+        pointLocator.BuildLocator()
+
+        # find the closest point next to the seed on the surface
+        # id = pointLocator.FindClosestPoint(int(seed[0]),int(seed[1]),int(seed[2]))
+        id = pointLocator.FindClosestPoint(seed)
+
+        # the seed is now guaranteed on the surface
+        seed = polyData.GetPoint(id)
+
+        sphere = vtk.vtkSphere()
+        sphere.SetCenter(seed[0], seed[1], seed[2])
+        sphere.SetRadius(someradius)
+
+        clip = vtk.vtkClipPolyData()
+        clip.SetInputConnection(inputAlgorithm.GetOutputPort())
+        clip.SetClipFunction(sphere)
+
+        return clip
+
+    @profiledStage
+    def openSurfaceAtPoint(self, polyData, seed, someradius=1.0):
+        '''
+        Returns a new surface with an opening at the given seed.
+        '''
+        return self.pipelineOutput(self.openSurfaceAtPointPipeline(self.inputProducer(polyData), seed, someradius))
+
+    def extractNetworkPipeline(self, inputAlgorithm, advancementRatio=1.05):
+        '''
+        Connects the network extraction to the output of inputAlgorithm and returns it.
+        '''
+        radiusArrayName = 'Radius'
+        topologyArrayName = 'Topology'
+        marksArrayName = 'Marks'
+
+        networkExtraction = misc().vtkvmtkPolyDataNetworkExtraction()
+        networkExtraction.SetInputConnection(inputAlgorithm.GetOutputPort())
+        networkExtraction.SetAdvancementRatio(advancementRatio)
+        networkExtraction.SetRadiusArrayName(radiusArrayName)
+        networkExtraction.SetTopologyArrayName(topologyArrayName)
+        networkExtraction.SetMarksArrayName(marksArrayName)
+
+        if self.networkCostModel is not None:
+            # calibrate the time budget of the decimation with every run
+            run = {}
+            def onStart(caller, event):
+                run['triangles'] = caller.GetInput().GetNumberOfPolys()
+                run['start'] = time.perf_counter()
+            def onEnd(caller, event):
+                self.networkCostModel.record(run['triangles'], time.perf_counter() - run['start'])
+            networkExtraction.AddObserver(vtk.vtkCommand.StartEvent, onStart)
+            networkExtraction.AddObserver(vtk.vtkCommand.EndEvent, onEnd)
+
+        return networkExtraction
+
+    @profiledStage
+    def extractNetwork(self, polyData, advancementRatio=1.05):
+        '''
+        Returns the network of the given surface.
+        '''
+        return self.pipelineOutput(self.extractNetworkPipeline(self.inputProducer(polyData), advancementRatio))
+
+    def networkPipeline(self, preparedAlgorithm, seed, **decimationParameters):
+        '''
+        Connects decimation, opening at the seed and network extraction to the prepared surface in one pipeline.
+        The decimated and opened surfaces are released once the next filter has used them.
+        decimationParameters are passed on to decimateSurfacePipeline.
+        '''
+        decimation = self.decimateSurfacePipeline(preparedAlgorithm, **decimationParameters)
+        decimation.ReleaseDataFlagOn()
+        opening = self.openSurfaceAtPointPipeline(decimation, seed)
+        opening.ReleaseDataFlagOn()
+        return self.extractNetworkPipeline(opening)
+
+
+    @profiledStage
+    def clipSurfaceAtEndPoints(self, networkPolyData, surfacePolyData):
+        '''
+        Clips the surfacePolyData on the endpoints identified using the networkPolyData.
+
+        Returns a tupel of the form [clippedPolyData, endpointsPoints]
+        '''
+        cleaner = vtk.vtkCleanPolyData()
+        cleaner.SetInputData(networkPolyData)
+        cleaner.Update()
+        network = cleaner.GetOutput()
+        network.BuildCells()
+        network.BuildLinks(0)
+        endpointIds = vtk.vtkIdList()
+
+        radiusArray = network.GetPointData().GetArray('Radius')
+
+        endpoints = vtk.vtkPolyData()
+        endpointsPoints = vtk.vtkPoints()
+        endpointsRadius = vtk.vtkDoubleArray()
+        endpointsRadius.SetName('Radius')
+        endpoints.SetPoints(endpointsPoints)
+        endpoints.GetPointData().AddArray(endpointsRadius)
+
+        radiusFactor = 1.2
+        minRadius = 0.01
+
+        for i in range(network.GetNumberOfCells()):
+            numberOfCellPoints = network.GetCell(i).GetNumberOfPoints()
+            pointId0 = network.GetCell(i).GetPointId(0)
+            pointId1 = network.GetCell(i).GetPointId(numberOfCellPoints - 1)
+
+            pointCells = vtk.vtkIdList()
+            network.GetPointCells(pointId0, pointCells)
+            numberOfEndpoints = endpointIds.GetNumberOfIds()
+            if pointCells.GetNumberOfIds() == 1:
+                pointId = endpointIds.InsertUniqueId(pointId0)
+                if pointId == numberOfEndpoints:
+                    point = network.GetPoint(pointId0)
+                    radius = radiusArray.GetValue(pointId0)
+                    radius = max(radius, minRadius)
+                    endpointsPoints.InsertNextPoint(point)
+                    endpointsRadius.InsertNextValue(radiusFactor * radius)
+
+            pointCells = vtk.vtkIdList()
+            network.GetPointCells(pointId1, pointCells)
+            numberOfEndpoints = endpointIds.GetNumberOfIds()
+            if pointCells.GetNumberOfIds() == 1:
+                pointId = endpointIds.InsertUniqueId(pointId1)
+                if pointId == numberOfEndpoints:
+                    point = network.GetPoint(pointId1)
+                    radius = radiusArray.GetValue(pointId1)
+                    radius = max(radius, minRadius)
+                    endpointsPoints.InsertNextPoint(point)
+                    endpointsRadius.InsertNextValue(radiusFactor * radius)
+
+        polyBall = computationalGeometry().vtkvmtkPolyBall()
+        #polyBall.SetInputData(endpoints)
+        polyBall.SetInput(endpoints)
+        polyBall.SetPolyBallRadiusArrayName('Radius')
+
+        clipper = vtk.vtkClipPolyData()
+        clipper.SetInputData(surfacePolyData)
+        clipper.SetClipFunction(polyBall)
+        clipper.ReleaseDataFlagOn()
+
+        connectivityFilter = vtk.vtkPolyDataConnectivityFilter()
+        connectivityFilter.SetInputConnection(clipper.GetOutputPort())
+        connectivityFilter.ColorRegionsOff()
+        connectivityFilter.SetExtractionModeToLargestRegion()
+
+        return [self.pipelineOutput(connectivityFilter), endpointsPoints]
+
+
+    @profiledStage
+    def cropSurfaceToRoute(self, polyData, networkPolyData, startPoint, endPoint, radiusFactor=2.0, margin=5.0):
+        '''
+        Crops the surface to a tube around the route through the network from startPoint to endPoint.
+        The tube is a ball of radiusFactor times the network radius plus margin (mm) at every route point.
+        The cut ends are capped, so the cropped surface can be used for the centerline computation.
+
+        Returns the cropped surface, or polyData itself if the two points are not connected in the network.
+        '''
+        from vtk.util.numpy_support import vtk_to_numpy
+        from .pointview import CenterlinePointView
+        from .route import routePointIds
+
+        # merge the coincident end points of the network segments, so the route can pass from one segment to the next
+        cleaner = vtk.vtkCleanPolyData()
+        cleaner.SetInputData(networkPolyData)
+        cleaner.Update()
+        network = cleaner.GetOutput()
+
+        view = CenterlinePointView.fromPolyData(network)
+        routeIds = routePointIds(view, startPoint, endPoint)
+        if routeIds.size == 0:
+            logging.warning("No route from the seed to the ROI in the network, the surface is not cropped")
+            return polyData
+        radius = vtk_to_numpy(network.GetPointData().GetArray('Radius'))[routeIds]
+
+        # one ball per route point, and one at the seed and the ROI themselves in case they lie beyond the network
+        route = vtk.vtkPolyData()
+        routePoints = vtk.vtkPoints()
+        routeRadius = vtk.vtkDoubleArray()
+        routeRadius.SetName('Radius')
+        route.SetPoints(routePoints)
+        route.GetPointData().AddArray(routeRadius)
+        for point, pointRadius in [(startPoint, radius[0])] + list(zip(view.points[routeIds], radius)) + [(endPoint, radius[-1])]:
+            routePoints.InsertNextPoint(point[0], point[1], point[2])
+            routeRadius.InsertNextValue(radiusFactor * pointRadius + margin)
+
+        polyBall = computationalGeometry().vtkvmtkPolyBall()
+        polyBall.SetInput(route)
+        polyBall.SetPolyBallRadiusArrayName('Radius')
+
+        # keep the inside of the balls
+        clipper = vtk.vtkClipPolyData()
+        clipper.SetInputData(polyData)
+        clipper.SetClipFunction(polyBall)
+        clipper.InsideOutOn()
+        clipper.ReleaseDataFlagOn()
+
+        connectivityFilter = vtk.vtkPolyDataConnectivityFilter()
+        connectivityFilter.SetInputConnection(clipper.GetOutputPort())
+        connectivityFilter.ColorRegionsOff()
+        connectivityFilter.SetExtractionModeToClosestPointRegion()
+        connectivityFilter.SetClosestPoint(startPoint[0], startPoint[1], startPoint[2])
+        connectivityFilter.ReleaseDataFlagOn()
+
+        cleanFilter = vtk.vtkCleanPolyData()
+        cleanFilter.SetInputConnection(connectivityFilter.GetOutputPort())
+        cleanFilter.ReleaseDataFlagOn()
+
+        surfaceCapper = computationalGeometry().vtkvmtkCapPolyData()
+        surfaceCapper.SetInputConnection(cleanFilter.GetOutputPort())
+        surfaceCapper.SetDisplacement(0.0)
+        surfaceCapper.SetInPlaneDisplacement(0.0)
+
+        return self.pipelineOutput(surfaceCapper)
+
+
+    def centerlineFilter(self, polyData, inletSeedIds, outletSeedIds, resamplingStepLength=0.0):
+        '''
+        Returns the vtkvmtkPolyDataCenterlines filter computing the centerlines from the inlet to the outlet seeds (surface point ids).
+        '''
+        flipNormals = 0
+        radiusArrayName = 'Radius'
+        costFunction = '1/R'
+
+        centerlineFilter = computationalGeometry().vtkvmtkPolyDataCenterlines()
+        centerlineFilter.SetInputData(polyData)
+        centerlineFilter.SetSourceSeedIds(inletSeedIds)
+        centerlineFilter.SetTargetSeedIds(outletSeedIds)
+        centerlineFilter.SetRadiusArrayName(radiusArrayName)
+        centerlineFilter.SetCostFunction(costFunction)
+        centerlineFilter.SetFlipNormals(flipNormals)
+        centerlineFilter.SetAppendEndPointsToCenterlines(0)
+        centerlineFilter.SetSimplifyVoronoi(0)
+        if resamplingStepLength > 0:
+            centerlineFilter.SetCenterlineResampling(1)
+            centerlineFilter.SetResamplingStepLength(resamplingStepLength)
+        else:
+            centerlineFilter.SetCenterlineResampling(0)
+            centerlineFilter.SetResamplingStepLength(1.0)
+        return centerlineFilter
+
+    @profiledStage
+    def computeCenterlines(self, polyData, inletSeedIds, outletSeedIds, resamplingStepLength=0.0):
+        '''
+        Returns a tupel of two vtkPolyData objects.
+        The first are the centerlines, the second is the corresponding Voronoi diagram.
+        If resamplingStepLength (mm) is larger than 0, the centerlines are resampled to that step.
+        With more than one worker (numberOfWorkers) and outlet seed, the backtracing to the outlet seeds is split across worker processes.
+        '''
+        if self.numberOfWorkers > 1 and outletSeedIds.GetNumberOfIds() > 1:
+            from .parallel import computeCenterlinesInParallel
+            return computeCenterlinesInParallel(self, polyData, inletSeedIds, outletSeedIds, resamplingStepLength, self.numberOfWorkers)
+
+        centerlineFilter = self.centerlineFilter(polyData, inletSeedIds, outletSeedIds, resamplingStepLength)
+
+        outPolyData = self.pipelineOutput(centerlineFilter)
+
+        outPolyData2 = vtk.vtkPolyData()
+        outPolyData2.ShallowCopy(centerlineFilter.GetVoronoiDiagram())
+
+        return [outPolyData, outPolyData2]
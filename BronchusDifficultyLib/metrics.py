@@ -0,0 +1,410 @@
+import numpy as np
+
+#
+# Headless metric engine for the bronchus difficulty index
+#
+
+# Scalar applied to the inverse circumradius so that curvature values are in the range of the other metrics
+CURVATURE_SCALE = 2550
+
+
+def trackMinMax(values, minValue=float("inf"), maxValue=0.0, maxMask=None, minMask=None):
+  """Replays the running `if value > max: ... elif value < min: ...` update of the metric loop
+  over a whole array of values (in loop order) and returns the resulting (minValue, maxValue).
+  maxMask / minMask restrict which values may update the maximum / minimum.
+  """
+  values = np.asarray(values, dtype=np.float64)
+  if values.size == 0:
+    return (minValue, maxValue)
+
+  notNan = ~np.isnan(values)
+  canUpdateMax = notNan if maxMask is None else (notNan & maxMask)
+  canUpdateMin = notNan if minMask is None else (notNan & minMask)
+
+  # a value only becomes the new maximum if it is larger than every allowed value before it
+  runningMax = np.maximum.accumulate(np.where(canUpdateMax, values, -np.inf))
+  previousMax = np.maximum(np.concatenate(([maxValue], runningMax[:-1])), maxValue)
+  isMaxUpdate = canUpdateMax & (values > previousMax)
+  if isMaxUpdate.any():
+    maxValue = values[isMaxUpdate][-1]
+
+  # everything that did not update the maximum falls through to the minimum check
+  minCandidates = values[canUpdateMin & ~isMaxUpdate]
+  if minCandidates.size and minCandidates.min() < minValue:
+    minValue = minCandidates.min()
+
+  return (minValue, maxValue)
+
+
+def vectorNorm(vectors):
+  """Euclidean norm of each row of an (n, 3) array."""
+  return np.sqrt(np.sum(vectors * vectors, axis=-1))
+
+
+def circumradiusCurvature(prevPts, currPts, nextPts):
+  """Scaled inverse circumradius (Heron's formula) of the triangles prev/curr/next, row by row."""
+  # Triangle lengths
+  a = vectorNorm(nextPts - prevPts)
+  b = vectorNorm(nextPts - currPts)
+  c = vectorNorm(prevPts - currPts)
+  s = (a + b + c)/2.0
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    R = a*b*c / 4 / np.sqrt(s * (s - a) * (s - b) * (s - c))
+    return 1.0/R * CURVATURE_SCALE
+
+
+class PlaneRotationState(object):
+  """State that the plane rotation carries from sample to sample (and from cell to cell)."""
+
+  def __init__(self, tracheaVector, referenceVector):
+    self.tracheaVector = np.asarray(tracheaVector, dtype=np.float64)
+    self.referenceVector = np.asarray(referenceVector, dtype=np.float64)
+    self.normalVector = None
+    self.firstPlane = True
+    self.newPlane = False
+    self.thresholdPassCount = 0
+
+
+def planeRotationKernel(branchPoints, state, halfWindow=15, angleThreshold=0.75, resetCount=100):
+  """Angle (rad) between the local direction of a branch and the current reference plane.
+
+  branchPoints: (n, 3) points of the branch
+  state: PlaneRotationState, updated in place
+
+  The direction at sample j runs from point j-halfWindow to point j+halfWindow. Once the angle
+  exceeds angleThreshold for resetCount samples in a row the reference vector is reset to the
+  current direction and a new plane starts at the next sample.
+
+  Returns (sampleIndices, angles, planeResets) where planeResets lists the
+  (sampleIndex, normalVector) of every new plane.
+  """
+  branchPoints = np.asarray(branchPoints, dtype=np.float64)
+  n = branchPoints.shape[0]
+  sampleIndices = np.arange(halfWindow, max(n - halfWindow, halfWindow))
+  angles = np.zeros(sampleIndices.size)
+  planeResets = []
+  if sampleIndices.size == 0:
+    return (sampleIndices, angles, planeResets)
+
+  # per-sample direction vectors, computed in bulk
+  delta = branchPoints[sampleIndices + halfWindow] - branchPoints[sampleIndices - halfWindow]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    currentVectors = delta / vectorNorm(delta)[:, np.newaxis]
+  currentNorms = vectorNorm(currentVectors)
+
+  # only the resets are sequential, every stretch between two resets shares one normal vector
+  start = 0
+  while start < sampleIndices.size:
+    if state.firstPlane:
+      state.normalVector = 100*np.cross(state.tracheaVector, state.referenceVector)
+      state.firstPlane = False
+    elif state.newPlane:
+      # Not first plane -- recalculate the normal vector
+      state.normalVector = 100*np.cross(currentVectors[start], state.referenceVector)
+      planeResets.append((int(sampleIndices[start]), state.normalVector))
+      state.newPlane = False
+
+    normalVector = state.normalVector
+    with np.errstate(invalid='ignore'):
+      stretch = np.arcsin(np.sum(currentVectors[start:] * normalVector, axis=1) / (vectorNorm(normalVector) * currentNorms[start:]))
+    # number of consecutive over-threshold samples up to and including each sample
+    overThreshold = (stretch >= angleThreshold) | (stretch <= -angleThreshold)
+    positions = np.arange(stretch.size)
+    lastBelow = np.maximum.accumulate(np.where(overThreshold, -1 - state.thresholdPassCount, positions))
+    passCount = np.where(overThreshold, positions - lastBelow, 0)
+
+    resets = np.flatnonzero(passCount >= resetCount)
+    if resets.size == 0:
+      angles[start:] = stretch
+      state.thresholdPassCount = int(passCount[-1])
+      state.newPlane = False
+      break
+
+    # Once the threshold has been passed resetCount times in a row, update reference vector
+    reset = resets[0]
+    angles[start:start + reset + 1] = stretch[:reset + 1]
+    state.referenceVector = currentVectors[start + reset]
+    state.thresholdPassCount = 0
+    state.newPlane = True
+    start += reset + 1
+
+  return (sampleIndices, angles, planeResets)
+
+
+class CenterlineMetricEngine(object):
+  """Computes the difficulty metrics of a centerline network as whole-array operations per cell.
+
+  view: CenterlinePointView of the network, giving the point ids and points of each cell (line)
+  radius: the 'Radius' point data array
+
+  Output arrays have radius.size - 1 values and follow the indexing rules of the original
+  per-point loop in ModifiedCenterlineComputationWidget.start(): values are addressed by point id,
+  samples close to the first and last point ids are zeroed and cells with minimumCellPoints
+  points or fewer are skipped. Neighbours that fall outside of a cell are never read.
+
+  With an AirwayTree, the points a cell shares with an earlier cell are not evaluated again:
+  each cell is only evaluated from its owned start on (still reading the shared points as
+  neighbours) and the values are then copied to the shared point copies.
+
+  With a CenterlineArcLengthIndex, the local curvature and curvature rate can take the distance
+  to the neighbours of their triangles in mm of arc length of each cell instead of in samples.
+  """
+
+  def __init__(self, view, radius, minimumCellPoints=100, tree=None, arcLengthIndex=None):
+    self.view = view
+    self.radius = np.asarray(radius, dtype=np.float64)
+    self.minimumCellPoints = minimumCellPoints
+    self.tree = tree
+    self.arcLengthIndex = arcLengthIndex
+    # the metric arrays are one value shorter than the radius array
+    self.numberOfValues = max(self.radius.size - 1, 0)
+
+  def cellIds(self):
+    """Ids of the cells that are long enough to be evaluated."""
+    return [cellId for cellId in range(self.view.numberOfCells) if self.view.cellSize(cellId) > self.minimumCellPoints]
+
+  def cells(self):
+    """Point ids and points of every cell that is long enough to be evaluated."""
+    for cellId in self.cellIds():
+      yield self.view.cellPointIds(cellId), self.view.cellPoints(cellId)
+
+  def _ownedCells(self):
+    """Like cells(), also giving the position from which on each cell is evaluated."""
+    for cellId in self.cellIds():
+      ownedStart = 0 if self.tree is None else self.tree.ownedStart(cellId)
+      yield self.view.cellPointIds(cellId), self.view.cellPoints(cellId), ownedStart
+
+  def _neighbourPositions(self, cellId, n, offsets, lengths):
+    """Positions of the previous and next triangle point of every sample of a cell, one row per offset:
+    offsets[k] samples away, or lengths[k] mm of arc length away when lengths are given."""
+    j = np.arange(n)
+    if lengths is None:
+      offsets = np.asarray(offsets)[:, np.newaxis]
+      return (j - offsets, j + offsets)
+    if self.arcLengthIndex is None:
+      raise ValueError("Windows in mm need a CenterlineArcLengthIndex")
+    positions = [self.arcLengthIndex.neighbourPositions(cellId, length) for length in lengths]
+    return (np.array([before for before, after in positions]).reshape(-1, n), np.array([after for before, after in positions]).reshape(-1, n))
+
+  def _scatterShared(self, values):
+    if self.tree is not None:
+      self.tree.scatter(values)
+    return values
+
+  def radiusRange(self):
+    """(min, max) of the radius array, using the same running update as the other metrics."""
+    return trackMinMax(self.radius[:self.numberOfValues])
+
+  def localCurvature(self, window=30):
+    """Scaled inverse circumradius of the points +/- window samples around each point.
+
+    Returns (values, minValue, maxValue).
+    """
+    values, minValues, maxValues = self.localCurvatureScales([window])
+    return (values[:, 0], minValues[0], maxValues[0])
+
+  def localCurvatureScales(self, windows, lengths=None):
+    """Local curvature for several window sizes, evaluated in one batched pass over each cell.
+
+    lengths: optional window sizes in mm, one per window. The triangle of each sample then reaches
+    lengths[k] mm of arc length along the cell to either side, and windows[k] (samples) only sets
+    the margins at both ends of the point ids. Needs an arcLengthIndex.
+
+    Returns (values, minValues, maxValues) where column k of the (numberOfValues, len(windows))
+    values array, minValues[k] and maxValues[k] match localCurvature(windows[k]).
+    """
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1)
+    maxId = self.numberOfValues - 1
+    values = np.zeros((self.numberOfValues, windows.size))
+    computed = [[] for window in windows]
+
+    for cellId, (ids, pts, ownedStart) in zip(self.cellIds(), self._ownedCells()):
+      n = ids.size
+      j = np.arange(n)
+      w = windows[:, np.newaxis]
+      before, after = self._neighbourPositions(cellId, n, windows, lengths)
+      mask = (ids >= w) & (ids < maxId - w) & (before >= 0) & (after < n) & (j >= ownedStart)
+      # one (scale, sample) pair per triangle, in cell order within each scale
+      scales, sampleIndices = np.nonzero(mask)
+      curvature = circumradiusCurvature(pts[before[scales, sampleIndices]], pts[sampleIndices], pts[after[scales, sampleIndices]])
+
+      valid = ~np.isnan(curvature)
+      values[ids[sampleIndices[valid]], scales[valid]] = curvature[valid]
+
+      for k, window in enumerate(windows):
+        computed[k].append(curvature[scales == k])
+        edges = ((ids >= 0) & (ids <= window + 1)) | ((ids >= maxId - window) & (ids <= maxId))
+        values[ids[edges], k] = 0.0
+
+    self._scatterShared(values)
+    minValues = []
+    maxValues = []
+    for scaleComputed in computed:
+      scaleComputed = np.concatenate(scaleComputed) if scaleComputed else np.zeros(0)
+      minValue, maxValue = trackMinMax(scaleComputed, maxMask=~(scaleComputed > 10000), minMask=~(scaleComputed < -10000))
+      minValues.append(minValue)
+      maxValues.append(maxValue)
+    return (values, minValues, maxValues)
+
+  def globalRelativeAngle(self, tracheaVector, step=10):
+    """Angle (rad) between the direction to the point `step` samples ahead and the trachea vector.
+
+    The last `step` samples of a cell reuse the last direction that could be computed.
+    Returns (values, minValue, maxValue).
+    """
+    maxId = self.numberOfValues - 1
+    tracheaVector = np.asarray(tracheaVector, dtype=np.float64)
+    values = np.zeros(self.numberOfValues)
+    computed = []
+    lastDirection = None
+
+    for ids, pts, ownedStart in self._ownedCells():
+      n = ids.size
+      first = max(1, ownedStart)
+      if n <= first:
+        continue
+
+      # directions for the points that have a point `step` samples ahead (skipping the first point)
+      sampleIndices = np.arange(first, max(n - step, first))
+      delta = pts[sampleIndices + step] - pts[sampleIndices]
+      with np.errstate(divide='ignore', invalid='ignore'):
+        directions = delta / vectorNorm(delta)[:, np.newaxis]
+      if directions.shape[0] > 0:
+        lastDirection = directions[-1]
+      if lastDirection is None:
+        continue
+      # the remaining points keep the last direction
+      tail = np.repeat(lastDirection[np.newaxis, :], (n - first) - directions.shape[0], axis=0)
+      directions = np.concatenate((directions, tail))
+
+      with np.errstate(invalid='ignore'):
+        angles = np.arccos(np.sum(directions * tracheaVector, axis=1))
+      computed.append(angles)
+
+      cellIds = ids[first:]
+      inRange = cellIds <= maxId
+      values[cellIds[inRange]] = np.where(np.isnan(angles[inRange]), 0.0, angles[inRange])
+
+      edges = ((ids >= 0) & (ids <= step + 1)) | ((ids >= maxId - step) & (ids <= maxId))
+      values[ids[edges]] = 0.0
+
+    self._scatterShared(values)
+    computed = np.concatenate(computed) if computed else np.zeros(0)
+    minValue, maxValue = trackMinMax(computed)
+    return (values, minValue, maxValue)
+
+  def curvatureRate(self, window=200, offset=150, offsetLength=None):
+    """Scaled inverse circumradius of the points +/- offset samples around each point,
+    zeroed within `window` point ids of both ends. With offsetLength, the neighbours are
+    offsetLength mm of arc length away along the cell instead (needs an arcLengthIndex).
+
+    Points whose neighbours fall outside of their cell keep the last computed rate.
+    Returns (values, minValue, maxValue).
+    """
+    maxId = self.numberOfValues - 1
+    values = np.zeros(self.numberOfValues)
+    computed = []
+    savedRate = 0.0
+
+    for cellId, (ids, pts, ownedStart) in zip(self.cellIds(), self._ownedCells()):
+      n = ids.size
+      j = np.arange(n)
+      before, after = self._neighbourPositions(cellId, n, [offset], None if offsetLength is None else [offsetLength])
+      before, after = before[0], after[0]
+      mask = (ids >= window) & (ids < maxId - window) & (before >= 0) & (after < n) & (j >= ownedStart)
+      sampleIndices = j[mask]
+      rates = circumradiusCurvature(pts[before[mask]], pts[sampleIndices], pts[after[mask]])
+      computed.append(rates)
+
+      # carry the last computed rate forward to the points that could not be computed
+      rateAtPoint = np.full(n, np.nan)
+      rateAtPoint[mask] = rates
+      lastComputed = np.maximum.accumulate(np.where(mask, j, -1))
+      carried = np.where(lastComputed >= 0, rateAtPoint[np.maximum(lastComputed, 0)], savedRate)
+      fill = ~mask & (ids < maxId) & (j >= ownedStart)
+      values[ids[fill]] = carried[fill]
+      if rates.size:
+        savedRate = rates[-1]
+
+      valid = ~np.isnan(rates)
+      values[ids[mask][valid]] = rates[valid]
+
+      edges = ((ids >= 0) & (ids <= window)) | ((ids >= maxId - window) & (ids <= maxId))
+      values[ids[edges]] = 0.0
+
+    self._scatterShared(values)
+    computed = np.concatenate(computed) if computed else np.zeros(0)
+    minValue, maxValue = trackMinMax(computed)
+    return (values, minValue, maxValue)
+
+  def totalIndex(self, localCurvature, globalRelativeAngle, planeRotation, curvatureRate):
+    """Total Difficulty Index, a weighted sum of the radius and all other metrics at each point."""
+    length = min(self.radius.size, len(localCurvature), len(globalRelativeAngle), len(planeRotation), len(curvatureRate))
+    radius = self.radius[:length]
+    localCurvature = np.asarray(localCurvature, dtype=np.float64)[:length]
+    globalRelativeAngle = np.asarray(globalRelativeAngle, dtype=np.float64)[:length]
+    planeRotation = np.asarray(planeRotation, dtype=np.float64)[:length]
+    curvatureRate = np.asarray(curvatureRate, dtype=np.float64)[:length]
+
+    # Tuning of curvature parameters occurs here -- modify the scalar multiplier to affect the weight of each parameter
+    index = np.arange(length, dtype=np.float64)
+    return 0.01*index + 0.25*(11-radius) + 0.04*(11-radius)*localCurvature + 2.5*(1-globalRelativeAngle) + 0.04*curvatureRate + 10*np.abs(planeRotation)
+
+  def cumulativeIndex(self, totalIndex, threshold=0.0, out=None):
+    """Cumulative Difficulty Index: running sum of the total index down each cell,
+    only counting values above threshold. The sum restarts at the first point of every cell and
+    runs over the cell's own copies of the points it shares with other cells, also with an
+    AirwayTree: the total index of those copies differs from cell to cell (it grows with the
+    point id, and the plane rotation is evaluated per cell), so along every cell the difference
+    of consecutive values is the total index written beside it.
+
+    Writes into `out` (for example a numpy view of a vtkDoubleArray) when given,
+    which also limits the point ids that are evaluated to its length.
+    """
+    totalIndex = np.asarray(totalIndex, dtype=np.float64)
+    if out is None:
+      out = np.zeros(max(totalIndex.size - 1, 0))
+    numberOfValues = min(len(out), totalIndex.size)
+
+    # Define a threshold value that the Total Difficulty Index must meet in order to be included in the Cumulative Difficulty Index
+    with np.errstate(invalid='ignore'):
+      included = np.where(totalIndex > threshold, totalIndex, 0.0)
+
+    # segmented prefix sum, one segment per cell
+    for ids, pts in self.cells():
+      ids = ids[(ids >= 0) & (ids < numberOfValues)]
+      out[ids] = np.cumsum(included[ids])
+
+    return out
+
+  def planeRotation(self, tracheaVector, referenceVector, halfWindow=15):
+    """Absolute plane rotation angle (rad) at each point, see planeRotationKernel.
+
+    The reference plane depends on every sample before it, so whole cells are evaluated
+    even with an AirwayTree.
+
+    Returns (values, minValue, maxValue, planes) where planes lists the
+    (position, normalVector) of each new reference plane.
+    """
+    maxId = self.numberOfValues - 1
+    values = np.zeros(self.numberOfValues)
+    computed = []
+    planes = []
+    state = PlaneRotationState(tracheaVector, referenceVector)
+
+    for ids, pts in self.cells():
+      sampleIndices, angles, planeResets = planeRotationKernel(pts, state, halfWindow)
+      computed.append(angles)
+      planes.extend([(pts[j], normalVector) for j, normalVector in planeResets])
+
+      sampleIds = ids[sampleIndices]
+      inRange = sampleIds <= maxId
+      values[sampleIds[inRange]] = np.where((angles[inRange] > 1.58) | (angles[inRange] < -1.58), 0.0, np.abs(angles[inRange]))
+
+      edges = ((ids >= 0) & (ids <= halfWindow)) | ((ids >= maxId - halfWindow) & (ids <= maxId))
+      values[ids[edges]] = 0.0
+
+    computed = np.concatenate(computed) if computed else np.zeros(0)
+    minValue, maxValue = trackMinMax(computed)
+    return (values, minValue, maxValue, planes)
@@ -0,0 +1,149 @@
+import json
+import os
+
+import numpy as np
+
+#
+# Binary columnar store of the metrics of one case, opened memory-mapped
+#
+
+# file layout: MAGIC, the length of the JSON header as little-endian uint32, the JSON header, then
+# every column at an offset aligned to ALIGNMENT bytes. The header lists the columns with their
+# name, dtype, shape, offset, and min/max (finite values only, null for an all-nan column).
+MAGIC = b'BDMSTORE'
+VERSION = 1
+ALIGNMENT = 64
+METRIC_STORE_EXTENSION = '.bdm'
+
+
+def _aligned(offset):
+  return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _range(values):
+  finite = values[np.isfinite(values)] if values.dtype.kind == 'f' else values
+  if finite.size == 0:
+    return None, None
+  return float(finite.min()), float(finite.max())
+
+
+def writeColumns(fileName, columns, attributes=None):
+  """Writes the named arrays (all with the same first dimension) as a metric store.
+  attributes: further JSON values kept in the header."""
+  columns = [(name, np.ascontiguousarray(values)) for name, values in columns]
+  numberOfPoints = columns[0][1].shape[0] if columns else 0
+  for name, values in columns:
+    if values.shape[0] != numberOfPoints:
+      raise ValueError("Column " + name + " has " + str(values.shape[0]) + " rows, expected " + str(numberOfPoints))
+
+  # the header size depends on the offsets, which depend on the header size: reserve enough room first
+  entries = []
+  for name, values in columns:
+    minValue, maxValue = _range(values)
+    entries.append({'name': name, 'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': 0, 'min': minValue, 'max': maxValue})
+  header = {'version': VERSION, 'numberOfPoints': numberOfPoints, 'attributes': attributes or {}, 'columns': entries}
+  headerSize = len(json.dumps(header).encode('utf-8')) + 32 * len(entries) + 16
+
+  offset = _aligned(len(MAGIC) + 4 + headerSize)
+  for entry, (name, values) in zip(entries, columns):
+    entry['offset'] = offset
+    offset = _aligned(offset + values.nbytes)
+  headerBytes = json.dumps(header).encode('utf-8')
+  if len(headerBytes) > headerSize:
+    raise ValueError("The metric store header does not fit into its reserved size")
+  headerBytes = headerBytes.ljust(headerSize)
+
+  with open(fileName, 'wb') as f:
+    f.write(MAGIC)
+    f.write(np.array(headerSize, dtype='<u4').tobytes())
+    f.write(headerBytes)
+    for entry, (name, values) in zip(entries, columns):
+      f.seek(entry['offset'])
+      f.write(values.tobytes())
+    f.truncate(offset)
+
+
+def difficultyMetricColumns(metrics, names):
+  """Columns of a DifficultyMetrics by point id: points, branch id, arc length along the line,
+  radius and the named metrics. Metric values (one fewer than the points) are padded with nan."""
+  view = metrics.view
+  numberOfPoints = view.numberOfPoints
+
+  arcLength = np.full(numberOfPoints, np.nan)
+  for cellId in range(view.numberOfCells):
+    arcLength[view.cellPointIds(cellId)] = metrics.arcLengthIndex.arcLengths[cellId]
+  branchId = np.full(numberOfPoints, -1, dtype=np.int32)
+  if metrics.tree is not None:
+    branchId[:] = metrics.tree.branchOfPoint
+
+  columns = [('Points', view.points.astype(np.float64)), ('BranchId', branchId), ('ArcLength', arcLength)]
+  for name in ['Radius'] + [name for name in names if name in metrics.values]:
+    values = metrics.radius if name == 'Radius' else metrics.values[name]
+    column = np.full(numberOfPoints, np.nan, dtype=np.float32)
+    column[:len(values)] = values[:numberOfPoints]
+    columns.append((name, column))
+  return columns
+
+
+class MetricStore(object):
+  """A metric store opened with numpy.memmap: columns are read from disk on access, nothing is
+  loaded up front.
+
+  store = MetricStore(fileName)
+  store.column('Local Curvature')[pointId], store.points, store.range('Radius')
+  """
+
+  def __init__(self, fileName):
+    self.fileName = fileName
+    with open(fileName, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(fileName + " is not a metric store")
+      headerSize = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+      self.header = json.loads(f.read(headerSize).decode('utf-8'))
+    if self.header['version'] > VERSION:
+      raise ValueError(fileName + " was written by a newer version (" + str(self.header['version']) + ")")
+    self.numberOfPoints = self.header['numberOfPoints']
+    self.attributes = self.header['attributes']
+    self._entries = dict((entry['name'], entry) for entry in self.header['columns'])
+    self._columns = {}
+
+  @property
+  def names(self):
+    return [entry['name'] for entry in self.header['columns']]
+
+  @property
+  def metricNames(self):
+    """Names of the value columns (all but the points, branch ids and arc length)."""
+    return [name for name in self.names if name not in ('Points', 'BranchId', 'ArcLength')]
+
+  def column(self, name):
+    if name not in self._columns:
+      entry = self._entries[name]
+      shape = tuple(entry['shape'])
+      if shape[0] == 0:
+        self._columns[name] = np.zeros(shape, dtype=np.dtype(entry['dtype']))
+      else:
+        self._columns[name] = np.memmap(self.fileName, dtype=np.dtype(entry['dtype']), mode='r', offset=entry['offset'], shape=shape)
+    return self._columns[name]
+
+  def range(self, name):
+    """(min, max) of the finite values of a column, from the header."""
+    entry = self._entries[name]
+    return (entry['min'], entry['max'])
+
+  @property
+  def points(self):
+    return self.column('Points')
+
+  @property
+  def branchIds(self):
+    return self.column('BranchId')
+
+  @property
+  def arcLength(self):
+    return self.column('ArcLength')
+
+
+def metricStoreFileName(rawDataFileName):
+  """The metric store written next to a raw data text file."""
+  return os.path.splitext(rawDataFileName)[0] + METRIC_STORE_EXTENSION
@@ -0,0 +1,143 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import vtk
+
+from .pipeline import readPolyData, writePolyData
+
+#
+# Centerline extraction with the backtracing to the target seeds split across worker processes
+#
+
+def workerExecutable():
+  """Python interpreter for the worker processes.
+
+  Inside Slicer sys.executable is the application itself, the workers then run with the PythonSlicer
+  launcher next to it, which sets up the same paths (and the vmtk libraries). None if sys.executable can be used.
+  """
+  name = os.path.basename(sys.executable).lower()
+  if not name.startswith('slicer'):
+    return None
+  directory = os.path.dirname(sys.executable)
+  for candidate in ['PythonSlicer', 'PythonSlicer.exe', os.path.join('..', 'bin', 'PythonSlicer'), os.path.join('..', 'bin', 'PythonSlicer.exe')]:
+    path = os.path.normpath(os.path.join(directory, candidate))
+    if os.path.isfile(path):
+      return path
+  return None
+
+
+def splitIds(ids, numberOfChunks):
+  """Splits a list of ids into at most numberOfChunks contiguous, nearly equal parts (order is kept)."""
+  numberOfChunks = max(1, min(numberOfChunks, len(ids)))
+  chunkSize, remainder = divmod(len(ids), numberOfChunks)
+  chunks = []
+  start = 0
+  for i in range(numberOfChunks):
+    stop = start + chunkSize + (1 if i < remainder else 0)
+    chunks.append(list(ids[start:stop]))
+    start = stop
+  return chunks
+
+
+def idList(ids):
+  result = vtk.vtkIdList()
+  for id in ids:
+    result.InsertNextId(int(id))
+  return result
+
+
+def backtraceChunk(arrivalTimesFileName, sourceSeedIds, targetSeedIds, resamplingStepLength, centerlinesFileName):
+  """Worker: traces the centerlines from the source to one chunk of targets (Voronoi point ids) down the
+  arrival times in arrivalTimesFileName and writes them to centerlinesFileName."""
+  from .retarget import backtraceCenterlines
+
+  centerlines = backtraceCenterlines(readPolyData(arrivalTimesFileName), idList(sourceSeedIds), idList(targetSeedIds),
+                                     resamplingStepLength=resamplingStepLength)
+  writePolyData(centerlinesFileName, centerlines)
+  return centerlinesFileName
+
+
+def mergeCenterlines(chunks, radiusArrayName='Radius'):
+  """Appends the lines of the chunks, in order, into one network.
+
+  Only point data arrays present in every chunk are kept and radiusArrayName stays the first array,
+  the metrics read the radius as array 0. The lines keep their own copies of the shared proximal
+  segments, exactly like the lines of a single vtkvmtkPolyDataCenterlines run; AirwayTree maps
+  these copies to one owned segment.
+  """
+  append = vtk.vtkAppendPolyData()
+  for chunk in chunks:
+    append.AddInputData(chunk)
+  append.Update()
+
+  merged = vtk.vtkPolyData()
+  merged.ShallowCopy(append.GetOutput())
+
+  pointData = merged.GetPointData()
+  radiusArray = pointData.GetArray(radiusArrayName)
+  if radiusArray is not None and pointData.GetArray(0) is not radiusArray:
+    arrays = [pointData.GetArray(i) for i in range(pointData.GetNumberOfArrays())]
+    for array in arrays:
+      pointData.RemoveArray(array.GetName())
+    pointData.AddArray(radiusArray)
+    for array in arrays:
+      if array.GetName() != radiusArrayName:
+        pointData.AddArray(array)
+  return merged
+
+
+def computeCenterlinesInParallel(logic, polyData, inletSeedIds, outletSeedIds, resamplingStepLength=0.0, numberOfWorkers=None):
+  """Computes the centerlines with the backtracing to the outlet seeds split into one chunk per worker process.
+
+  The Delaunay tessellation, the Voronoi diagram and the fast marching from the inlet run once, in this
+  process: vtkvmtkPolyDataCenterlines (set up by logic.centerlineFilter) to the first outlet gives the
+  Voronoi diagram and the poles of the seeds, retarget.arrivalTimes the arrival times. The workers read
+  the Voronoi diagram with the arrival times from a .vtp file and only trace their lines, so the part
+  that grows with the number of outlets is the part that is split.
+  The lines keep their own copies of the shared proximal segments, exactly like the lines of a single
+  vtkvmtkPolyDataCenterlines run; AirwayTree maps these copies to one owned segment.
+  Returns a tupel of the form [centerlines, voronoiDiagram].
+  """
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor
+  from .retarget import arrivalTimes
+
+  if numberOfWorkers is None:
+    numberOfWorkers = os.cpu_count() or 1
+  sourceIds = [inletSeedIds.GetId(i) for i in range(inletSeedIds.GetNumberOfIds())]
+  targetIds = [outletSeedIds.GetId(i) for i in range(outletSeedIds.GetNumberOfIds())]
+
+  centerlineFilter = logic.centerlineFilter(polyData, inletSeedIds, idList(targetIds[:1]), resamplingStepLength)
+  logic.pipelineOutput(centerlineFilter)
+  voronoi = vtk.vtkPolyData()
+  voronoi.ShallowCopy(centerlineFilter.GetVoronoiDiagram())
+  # the seeds are surface point ids, the fast marching and the backtracing start at their poles
+  poleIds = centerlineFilter.GetPoleIds()
+  sourceSeedIds = [poleIds.GetId(id) for id in sourceIds]
+  chunks = splitIds([poleIds.GetId(id) for id in targetIds], numberOfWorkers)
+
+  context = multiprocessing.get_context('spawn')
+  executable = workerExecutable()
+  if executable is not None:
+    context.set_executable(executable)
+
+  directory = tempfile.mkdtemp(prefix='BronchusDifficultyCenterlines')
+  try:
+    arrivalTimesFileName = os.path.join(directory, 'arrivaltimes.vtp')
+    writePolyData(arrivalTimesFileName, arrivalTimes(voronoi, idList(sourceSeedIds)))
+
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=context) as executor:
+      futures = []
+      for i, chunk in enumerate(chunks):
+        futures.append(executor.submit(backtraceChunk, arrivalTimesFileName, sourceSeedIds, chunk, resamplingStepLength,
+                                       os.path.join(directory, 'centerlines-%d.vtp' % i)))
+      # results are collected in chunk order, so the lines keep the order of the outlet seeds
+      centerlinesFileNames = [future.result() for future in futures]
+
+    centerlines = mergeCenterlines([readPolyData(fileName) for fileName in centerlinesFileNames])
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+  return [centerlines, voronoi]
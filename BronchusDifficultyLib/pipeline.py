@@ -0,0 +1,452 @@
+import logging
+import math
+import os
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
+from .pointview import CenterlinePointView
+from .arclength import CenterlineArcLengthIndex
+from .airwaytree import AirwayTree
+from .metrics import CenterlineMetricEngine
+from .profiling import StageProfiler
+from .stagecache import StageCache
+from .metricstore import difficultyMetricColumns, writeColumns
+
+#
+# Headless difficulty pipeline: centerline extraction and metrics without the Slicer scene
+#
+
+# debug output of the computation, the widget's "Verbose output" sets its level
+log = logging.getLogger("BronchusDifficulty")
+
+# names of the metric point data arrays, in the column order of the raw data table
+METRIC_NAMES = ("Local Curvature", "GlobalRelativeAngle", "PlaneRotation", "Curvature Rate", "Total Difficulty Index", "Cumulative Difficulty Index")
+
+# columns of the raw data table
+RAW_DATA_COLUMNS = ("point id", "x", "y", "z", "radius", "local curvature", "global angle", "plane rotation", "curvature rate",
+                    "total index", "cumulative index", "branch id")
+
+
+class DifficultyOptions(object):
+  """Parameters of the difficulty pipeline, lengths in mm."""
+
+  def __init__(self, **options):
+    self.resamplingStepLength = 0.0
+    self.localCurvatureRange = 3.0
+    self.localCurvatureScales = ()
+    self.curvatureRateRange = 20.0
+    self.minimumBranchLength = 10.0
+    # points with a radius below the bronchoscope radius are zeroed in all metrics
+    self.bronchoscopeRadius = 0.0
+    # radius at which the "Bronchoscope Limit" is placed
+    self.radiusLimit = 4.0
+    self.cumulativeThreshold = 0.0
+    for name, value in options.items():
+      if not hasattr(self, name):
+        raise ValueError("Unknown difficulty option: " + name)
+      setattr(self, name, value)
+
+
+class DifficultyMetrics(object):
+  """Metric values of a centerline network.
+
+  values: metric name -> array of values by point id
+  ranges: metric name -> (minValue, maxValue), including 'Radius'
+  localCurvatureScales: (range in mm, values, minValue, maxValue) of every extra local curvature range
+  planes: (position, normalVector) of each new plane rotation reference plane
+  radiusLimitPoint: first point where the radius falls below options.radiusLimit, or None
+  """
+
+  def __init__(self):
+    self.view = None
+    self.arcLengthIndex = None
+    self.engine = None
+    self.tree = None
+    self.radius = None
+    self.values = {}
+    self.ranges = {}
+    self.localCurvatureScales = []
+    self.planes = []
+    self.radiusLimitPoint = None
+    self.tracheaVector = None
+    self.referenceVector = None
+
+  def vtkArray(self, name):
+    """A new vtkDoubleArray with the values of the named metric."""
+    array = numpy_to_vtk(np.ascontiguousarray(self.values[name]), deep=1)
+    array.SetName(name)
+    return array
+
+  def localCurvatureScaleArrays(self):
+    arrays = []
+    for scale, values, minValue, maxValue in self.localCurvatureScales:
+      array = numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+      array.SetName("Local Curvature (+/-" + str(scale) + " mm)")
+      arrays.append(array)
+    return arrays
+
+  def addToPolyData(self, polyData, names=METRIC_NAMES):
+    """Adds the named metrics and all local curvature scales as point data arrays."""
+    for name in names:
+      if name in self.values:
+        polyData.GetPointData().AddArray(self.vtkArray(name))
+    for array in self.localCurvatureScaleArrays():
+      polyData.GetPointData().AddArray(array)
+
+
+def unitVector(start, end):
+  return (end - start)/np.linalg.norm(end - start)
+
+
+def computeDifficultyMetrics(network, options=None, metrics=METRIC_NAMES, profiler=None):
+  """Computes the requested metrics of a vtkvmtkPolyDataCenterlines network.
+
+  The total and cumulative difficulty indices need all other metrics, which are then computed as
+  well. Metrics that are not computed are all zeros. With a StageProfiler, every metric is recorded as a stage.
+  Returns a DifficultyMetrics.
+  """
+  if options is None:
+    options = DifficultyOptions()
+  if profiler is None:
+    profiler = StageProfiler(enabled=False)
+  result = DifficultyMetrics()
+
+  # Cell-aware view on the network points, every branch is read through it as an (n, 3) array
+  with profiler.stage("Airway tree", network):
+    view = CenterlinePointView.fromPolyData(network)
+    arcLengthIndex = CenterlineArcLengthIndex(view)
+    engine = CenterlineMetricEngine(view, vtk_to_numpy(network.GetPointData().GetArray(0)), arcLengthIndex.pointsForLength(options.minimumBranchLength), arcLengthIndex=arcLengthIndex)
+    tree = AirwayTree(view, engine.radius, engine.cellIds())
+    engine.tree = tree
+  result.view, result.arcLengthIndex, result.engine, result.tree = view, arcLengthIndex, engine, tree
+
+  # Trachea reference vector (for GlobalRelativeAngle and PlaneRotation) and the initial PlaneRotation reference vector
+  tracheaPoints = view.cellPoints(0)
+  result.tracheaVector = unitVector(tracheaPoints[arcLengthIndex.indexAtLength(0, 40.0)], tracheaPoints[arcLengthIndex.indexAtLength(0, 50.0)])
+  result.referenceVector = unitVector(tracheaPoints[arcLengthIndex.indexAtLength(0, 60.0)], tracheaPoints[arcLengthIndex.indexAtLength(0, 70.0)])
+
+  result.ranges["Radius"] = engine.radiusRange()
+  indexNeeded = "Total Difficulty Index" in metrics or "Cumulative Difficulty Index" in metrics
+  for name in METRIC_NAMES[:4]:
+    result.values[name] = np.zeros(engine.numberOfValues)
+    result.ranges[name] = (float("inf"), 0.0)
+
+  scales = list(options.localCurvatureScales)
+  if "Local Curvature" in metrics or indexNeeded or scales:
+    # the triangles reach the given mm along each line, the point counts only set the margins at the ends
+    lengths = [options.localCurvatureRange] + scales
+    windows = [arcLengthIndex.pointsForLength(length) for length in lengths]
+    with profiler.stage("Local Curvature", network):
+      values, minValues, maxValues = engine.localCurvatureScales(windows, lengths)
+    result.values["Local Curvature"] = values[:, 0]
+    result.ranges["Local Curvature"] = (minValues[0], maxValues[0])
+    for k, scale in enumerate(scales):
+      result.localCurvatureScales.append((scale, values[:, k+1], minValues[k+1], maxValues[k+1]))
+
+  if "GlobalRelativeAngle" in metrics or indexNeeded:
+    with profiler.stage("GlobalRelativeAngle", network):
+      values, minValue, maxValue = engine.globalRelativeAngle(result.tracheaVector, arcLengthIndex.pointsForLength(1.0))
+    result.values["GlobalRelativeAngle"] = values
+    result.ranges["GlobalRelativeAngle"] = (minValue, maxValue)
+
+  if "PlaneRotation" in metrics or indexNeeded:
+    with profiler.stage("PlaneRotation", network):
+      values, minValue, maxValue, result.planes = engine.planeRotation(result.tracheaVector, result.referenceVector, arcLengthIndex.pointsForLength(1.5))
+    result.values["PlaneRotation"] = values
+    result.ranges["PlaneRotation"] = (minValue, maxValue)
+
+  if "Curvature Rate" in metrics or indexNeeded:
+    with profiler.stage("Curvature Rate", network):
+      values, minValue, maxValue = engine.curvatureRate(arcLengthIndex.pointsForLength(options.curvatureRateRange), arcLengthIndex.pointsForLength(15.0), 15.0)
+    result.values["Curvature Rate"] = values
+    result.ranges["Curvature Rate"] = (minValue, maxValue)
+
+  # Where the radius first falls below the radius of the bronchoscope, the limit of the bronchoscope's path
+  for ids, pts in engine.cells():
+    limit = np.flatnonzero((engine.radius[ids] < options.radiusLimit) & (ids > engine.minimumCellPoints))
+    if limit.size:
+      result.radiusLimitPoint = pts[limit[0]]
+      break
+
+  result.radius = engine.radius.copy()
+  if indexNeeded:
+    with profiler.stage("Total Difficulty Index", network):
+      totalIndex = engine.totalIndex(*[result.values[name] for name in METRIC_NAMES[:4]])
+    result.values["Total Difficulty Index"] = totalIndex
+    result.radius = engine.radius[:len(totalIndex)].copy()
+
+  if "Cumulative Difficulty Index" in metrics:
+    with profiler.stage("Cumulative Difficulty Index", network):
+      result.values["Cumulative Difficulty Index"] = engine.cumulativeIndex(totalIndex, options.cumulativeThreshold, out=np.zeros(max(len(totalIndex) - 1, 0)))
+
+  # Set all values to 0.0 where the radius is smaller than the radius of the bronchoscope
+  pointIds = np.unique(view.connectivity)
+  pointIds = pointIds[(pointIds >= 0) & (pointIds < result.radius.size - 1)]
+  narrowPointIds = pointIds[result.radius[pointIds] < options.bronchoscopeRadius]
+  if narrowPointIds.size:
+    for values in [result.radius] + list(result.values.values()) + [scale[1] for scale in result.localCurvatureScales]:
+      values[narrowPointIds[narrowPointIds < len(values)]] = 0.0
+
+  return result
+
+
+def selectCenterlineSeeds(preparedModel, endpoints, seedCoordinates, roiCoordinates=None):
+  """Picks the source and target surface points for the centerline computation.
+
+  The endpoint closest to the seed is the source, every other endpoint is a target. With an ROI
+  the only target is the ROI. Targets are moved 1 mm towards the centroid of the model, so that
+  they are located inside of the opened ends.
+  Returns a tupel of the form [sourceIdList, targetIdList, sourcePoint, targetPoints].
+  """
+  if roiCoordinates is not None:
+    # Write over endpoints array with ONLY the starting point and the indicated ROI point
+    endpoints = vtk.vtkPoints()
+    endpoints.InsertPoint(0, seedCoordinates) # Seed point
+    endpoints.InsertPoint(1, roiCoordinates) # Endpoint (ROIs)
+
+  # now find the one endpoint which is closest to the seed and use it as the source point for centerline computation
+  # all other endpoints are the target points
+  distancesToSeed = []
+  targetPoints = []
+  for i in range(endpoints.GetNumberOfPoints()):
+    currentPoint = endpoints.GetPoint(i)
+    targetPoints.append(currentPoint)
+    distancesToSeed.append(math.sqrt(sum((currentPoint[k] - seedCoordinates[k])**2 for k in range(3))))
+
+  sourcePointIndex = distancesToSeed.index(min(distancesToSeed))
+  sourcePoint = targetPoints.pop(sourcePointIndex)
+
+  pointLocator = vtk.vtkPointLocator()
+  pointLocator.SetDataSet(preparedModel)
+  pointLocator.BuildLocator()
+
+  # locate the source on the surface
+  sourceIdList = vtk.vtkIdList()
+  sourceIdList.InsertNextId(pointLocator.FindClosestPoint(sourcePoint))
+
+  # locate the endpoints on the surface, moved towards the centroid of the model
+  centroid = np.average(vtk_to_numpy(preparedModel.GetPoints().GetData()), axis=0)
+  targetIdList = vtk.vtkIdList()
+  movedTargetPoints = []
+  for p in targetPoints:
+    pNew = p + unitVector(np.asarray(p), centroid)
+    movedTargetPoints.append(pNew)
+    targetIdList.InsertNextId(pointLocator.FindClosestPoint(pNew))
+
+  return [sourceIdList, targetIdList, sourcePoint, movedTargetPoints]
+
+
+def computeCenterlineNetwork(logic, surfacePolyData, seedCoordinates, roiCoordinates=None, resamplingStepLength=0.0, cropToRoute=True, decimation=None):
+  """Runs the centerline extraction of the widget's Start button on a surface.
+  With an ROI and cropToRoute, the centerline is computed on the surface around the network route to the ROI only.
+  decimation: parameters of CenterlineComputationLogic.decimateSurface for the network extraction, e.g. {'timeBudget': 10.0}
+
+  Returns a tupel of the form [centerlines, voronoiDiagram].
+  """
+  with logic.profilerStage("prepareModel", surfacePolyData):
+    preparedModel = logic.pipelineOutput(logic.prepareModelPipeline(logic.inputProducer(surfacePolyData)))
+  with logic.profilerStage("networkPipeline", preparedModel):
+    network = logic.pipelineOutput(logic.networkPipeline(logic.inputProducer(preparedModel), seedCoordinates, **(decimation or {})))
+  if roiCoordinates is not None and cropToRoute:
+    preparedModel = logic.cropSurfaceToRoute(preparedModel, network, seedCoordinates, roiCoordinates)
+
+  clippedSurface, endpoints = logic.clipSurfaceAtEndPoints(network, surfacePolyData)
+  sourceIdList, targetIdList, sourcePoint, targetPoints = selectCenterlineSeeds(preparedModel, endpoints, seedCoordinates, roiCoordinates)
+  logging.debug("Computing centerlines to %d targets" % targetIdList.GetNumberOfIds())
+
+  return logic.computeCenterlines(preparedModel, sourceIdList, targetIdList, resamplingStepLength)
+
+
+def runCenterlineJob(logic, job, task=None):
+  """Runs the centerline computation of the module's Preview and Start buttons, without touching the scene.
+
+  job holds the inputs read from the GUI (see ModifiedCenterlineComputationWidget.start), task is the
+  BackgroundTask it runs in, if any, for the progress reports and cancellation between stages.
+  Returns a dict with the network (centerlines), the Voronoi diagram and, depending on the job,
+  previewState, sourcePoint, targetPoints, difficulty (DifficultyMetrics) and retargeter.
+  """
+  from .retarget import CenterlineRetargeter
+
+  setStage = task.setStage if task is not None else (lambda stage: None)
+  preview = job['preview']
+  pathfindingMode = job['pathfindingMode']
+  currentCoordinatesRAS = job['seedCoordinates']
+  currentCoordinatesROI = job['roiCoordinates']
+  resamplingStepLength = job['resamplingStepLength']
+  decimation = job.get('decimation') or {}
+  result = {}
+
+  # the output models
+  preparedModel = vtk.vtkPolyData()
+  model = vtk.vtkPolyData()
+  network = vtk.vtkPolyData()
+  voronoi = vtk.vtkPolyData()
+
+  previewStateKey = job['previewStateKey']
+  previewState = job['previewState']
+  if previewState is not None and previewState['key'] == previewStateKey:
+    # nothing changed since the last run: continue from its prepared model and network
+    log.debug("Reusing the prepared model and network of the previous run")
+    preparedModel.ShallowCopy(previewState['preparedModel'])
+    network.DeepCopy(previewState['network'])
+    preparedKey = previewState['preparedKey']
+
+  else:
+    # the stage cache is keyed by the content of the input model, every following stage adds its parameters to the key
+    inputKey = None
+    if logic.stageCache is not None:
+      setStage("Hashing model")
+      inputKey = StageCache.polyDataHash(job['inputPolyData'])
+
+    # prepare the model
+    setStage("Preparing model")
+    outputs, preparedKey = logic.cachedStage(inputKey, 'prepareModel', job['inputPolyData'])
+    preparedModel.ShallowCopy(outputs[0])
+
+    if inputKey is None:
+      # without the cache the intermediate models are not kept, decimation, opening and network extraction run as one pipeline
+      setStage("Extracting network")
+      with logic.profilerStage("networkPipeline", preparedModel):
+        network.ShallowCopy(logic.pipelineOutput(logic.networkPipeline(logic.inputProducer(preparedModel), currentCoordinatesRAS, **decimation)))
+
+    else:
+      # decimate the model (only for network extraction)
+      setStage("Decimating model")
+      outputs, modelKey = logic.cachedStage(preparedKey, 'decimateSurface', preparedModel, **decimation)
+      model.ShallowCopy(outputs[0])
+
+      # open the model at the seed (only for network extraction)
+      setStage("Opening model")
+      outputs, modelKey = logic.cachedStage(modelKey, 'openSurfaceAtPoint', model, currentCoordinatesRAS)
+      model.ShallowCopy(outputs[0])
+
+      # extract Network
+      setStage("Extracting network")
+      outputs, networkKey = logic.cachedStage(modelKey, 'extractNetwork', model)
+      network.ShallowCopy(outputs[0])
+
+    # keep the result in memory, so that Start can continue from the preview
+    previewNetwork = vtk.vtkPolyData()
+    previewNetwork.DeepCopy(network)
+    result['previewState'] = {'key': previewStateKey, 'preparedModel': preparedModel, 'network': previewNetwork, 'preparedKey': preparedKey}
+
+  if not preview:
+    # here we start the actual centerline computation which is mathematically more robust and accurate but takes longer than the network extraction
+
+    if pathfindingMode and job['cropToRoute'] and not job['followRoi']:
+      # a single path only needs the surface around its route through the network, which keeps the Voronoi diagram small;
+      # not when the ROI is followed, the retargeter needs the Voronoi diagram of the whole airway to reach a moved ROI
+      setStage("Cropping model to route")
+      outputs, preparedKey = logic.cachedStage(preparedKey, 'cropSurfaceToRoute', preparedModel, network, currentCoordinatesRAS, currentCoordinatesROI)
+      preparedModel = outputs[0]
+
+    # clip surface at endpoints identified by the network extraction
+    setStage("Clipping model")
+    tupel = logic.clipSurfaceAtEndPoints(network, job['inputPolyData'])
+    clippedSurface = tupel[0]
+    endpoints = tupel[1]
+
+    # the endpoint closest to the seed is the source point for centerline computation, all other endpoints are the target points
+    with logic.profilerStage("selectCenterlineSeeds", preparedModel):
+      sourceIdList, targetIdList, sourcePoint, targetPoints = selectCenterlineSeeds(preparedModel, endpoints, currentCoordinatesRAS, currentCoordinatesROI)
+    log.debug("%d source and %d target points", sourceIdList.GetNumberOfIds(), targetIdList.GetNumberOfIds())
+    result['sourcePoint'] = sourcePoint
+    result['targetPoints'] = targetPoints
+
+    setStage("Computing centerlines")
+    tupel, centerlinesKey = logic.cachedStage(preparedKey, 'computeCenterlines', preparedModel, sourceIdList, targetIdList, resamplingStepLength)
+    network.ShallowCopy(tupel[0])
+    log.debug("centerlines: %d points, %d lines", network.GetNumberOfPoints(), network.GetNumberOfCells())
+    voronoi.ShallowCopy(tupel[1])
+
+    setStage("Computing metrics")
+    result['difficulty'] = computeDifficultyMetrics(network, job['difficultyOptions'], job['requestedMetrics'], logic.profiler)
+
+    if pathfindingMode and job['followRoi']:
+      # keep the Voronoi diagram with the arrival times from the seed, moving the ROI then only traces the new path
+      setStage("Computing arrival times")
+      with logic.profilerStage("CenterlineRetargeter", voronoi):
+        result['retargeter'] = CenterlineRetargeter(voronoi, currentCoordinatesRAS, resamplingStepLength=resamplingStepLength)
+
+  result['network'] = network
+  result['voronoi'] = voronoi
+  return result
+
+
+def rawDataTable(metrics):
+  """One row of RAW_DATA_COLUMNS per point of every evaluated cell, in cell order.
+
+  Shared points appear once for every line they are on. Zero values of the radius and the four
+  base metrics (points that were not evaluated) are nan, as are metrics that were not computed.
+  The last point of a cell, which has no metric value, is left out.
+  """
+  numberOfValues = metrics.radius.size - 1
+  pointIds = [ids[(ids >= 0) & (ids < numberOfValues)] for ids, pts in metrics.engine.cells()]
+  pointIds = np.concatenate(pointIds) if pointIds else np.zeros(0, dtype=np.int64)
+
+  table = np.full((pointIds.size, len(RAW_DATA_COLUMNS)), np.nan)
+  table[:, 0] = pointIds
+  table[:, 1:4] = metrics.view.points[pointIds]
+  for k, column in enumerate([metrics.radius] + [metrics.values[name] for name in METRIC_NAMES[:4]]):
+    values = column[pointIds]
+    table[:, 4 + k] = np.where(values != 0.0, values, np.nan)
+  for k, name in enumerate(METRIC_NAMES[4:]):
+    if name in metrics.values:
+      column = metrics.values[name]
+      # the cumulative index is one value shorter, its missing last value is 0
+      inRange = pointIds < len(column)
+      table[:, 9 + k] = 0.0
+      table[inRange, 9 + k] = column[pointIds[inRange]]
+  if metrics.tree is not None:
+    table[:, 11] = metrics.tree.branchOfPoint[pointIds]
+  return table
+
+
+def writeRawData(fileName, metrics):
+  """Writes the rawDataTable as comma separated text with a header line naming the columns."""
+  formats = ['%d'] + ['%.10g'] * (len(RAW_DATA_COLUMNS) - 2) + ['%d']
+  np.savetxt(fileName, rawDataTable(metrics), fmt=formats, delimiter=',', header=','.join(RAW_DATA_COLUMNS), comments='')
+
+
+def writeMinMax(fileName, metrics):
+  """Writes the minimum and maximum of the radius and the four base metrics."""
+  labels = [("radius", "Radius"), ("local curvature", "Local Curvature"), ("global relative angle", "GlobalRelativeAngle"),
+            ("plane rotation", "PlaneRotation"), ("curvature rate", "Curvature Rate")]
+  with open(fileName, "w") as f:
+    for label, name in labels:
+      minValue, maxValue = metrics.ranges[name]
+      f.write("max " + label + ',' + str(maxValue) + '\n')
+      f.write("min " + label + ',' + str(minValue) + '\n')
+
+
+def writeMetricStore(fileName, metrics):
+  """Writes points, branch ids, arc length, radius and all computed metrics as a binary metric store
+  (see metricstore.MetricStore), with the point spacing and the trachea vector as attributes."""
+  attributes = {'spacing': metrics.arcLengthIndex.spacing,
+                'tracheaVector': None if metrics.tracheaVector is None else [float(value) for value in metrics.tracheaVector]}
+  writeColumns(fileName, difficultyMetricColumns(metrics, METRIC_NAMES), attributes)
+
+
+def writePolyData(fileName, polyData):
+  writer = vtk.vtkXMLPolyDataWriter()
+  writer.SetFileName(fileName)
+  writer.SetInputData(polyData)
+  writer.SetDataModeToBinary()
+  writer.Write()
+
+
+def readPolyData(fileName):
+  """Reads a surface model (.vtp, .vtk, .stl, .ply or .obj)."""
+  readers = {'.vtp': vtk.vtkXMLPolyDataReader, '.vtk': vtk.vtkPolyDataReader, '.stl': vtk.vtkSTLReader,
+             '.ply': vtk.vtkPLYReader, '.obj': vtk.vtkOBJReader}
+  extension = os.path.splitext(fileName)[1].lower()
+  if extension not in readers:
+    raise ValueError("Unsupported model file: " + fileName)
+  reader = readers[extension]()
+  reader.SetFileName(fileName)
+  reader.Update()
+  polyData = vtk.vtkPolyData()
+  polyData.ShallowCopy(reader.GetOutput())
+  return polyData
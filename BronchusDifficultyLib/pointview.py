@@ -0,0 +1,99 @@
+import numpy as np
+
+from .locator import CenterlineLocator
+
+#
+# Cell-aware, zero-copy access to the points of a centerline network
+#
+
+class CenterlinePointView(object):
+  """Gives access to the points of each line of a polydata as (n, 3) arrays.
+
+  points: (numberOfPoints, 3) array of all points
+  offsets: numberOfCells + 1 offsets into connectivity
+  connectivity: the point ids of all lines, concatenated
+
+  Lines whose point ids are consecutive (as in the vmtk centerline output) are returned as
+  slices of the point array, so no per-point Python objects are created.
+  """
+
+  def __init__(self, points, offsets, connectivity):
+    self.points = np.asarray(points, dtype=np.float64)
+    self.offsets = np.asarray(offsets, dtype=np.int64)
+    self.connectivity = np.asarray(connectivity, dtype=np.int64)
+    self._locator = None
+
+    # a line can be sliced directly out of the point array if its ids are consecutive
+    consecutive = np.diff(self.connectivity) == 1
+    self._firstIds = [None] * self.numberOfCells
+    for i in range(self.numberOfCells):
+      start, stop = self.offsets[i], self.offsets[i+1]
+      if stop > start and consecutive[start:stop-1].all():
+        self._firstIds[i] = self.connectivity[start]
+
+  @classmethod
+  def fromPolyData(cls, polyData):
+    """Builds the view from the points and lines of a vtkPolyData without copying the points."""
+    from vtk.util.numpy_support import vtk_to_numpy
+
+    if polyData.GetPoints() is None:
+      points = np.zeros((0, 3))
+    else:
+      points = vtk_to_numpy(polyData.GetPoints().GetData())
+
+    lines = polyData.GetLines()
+    if hasattr(lines, 'GetOffsetsArray'):
+      # VTK 9 stores offsets and connectivity separately
+      offsets = vtk_to_numpy(lines.GetOffsetsArray())
+      connectivity = vtk_to_numpy(lines.GetConnectivityArray())
+    else:
+      # legacy layout [n, id_0, ..., id_n-1, n, ...]
+      legacy = vtk_to_numpy(lines.GetData())
+      offsets = [0]
+      connectivity = []
+      position = 0
+      for i in range(lines.GetNumberOfCells()):
+        numberOfCellPoints = legacy[position]
+        connectivity.append(legacy[position+1:position+1+numberOfCellPoints])
+        offsets.append(offsets[-1] + numberOfCellPoints)
+        position += numberOfCellPoints + 1
+      connectivity = np.concatenate(connectivity) if connectivity else np.zeros(0, dtype=np.int64)
+
+    return cls(points, offsets, connectivity)
+
+  @property
+  def numberOfPoints(self):
+    return self.points.shape[0]
+
+  @property
+  def numberOfCells(self):
+    return max(self.offsets.size - 1, 0)
+
+  def cellSize(self, cellId):
+    return int(self.offsets[cellId+1] - self.offsets[cellId])
+
+  def cellPointIds(self, cellId):
+    """Point ids of a line, as a view into the connectivity array."""
+    return self.connectivity[self.offsets[cellId]:self.offsets[cellId+1]]
+
+  def cellPoints(self, cellId):
+    """(n, 3) points of a line, as a slice of the point array when its ids are consecutive."""
+    firstId = self._firstIds[cellId]
+    if firstId is not None:
+      return self.points[firstId:firstId + self.cellSize(cellId)]
+    return self.points[self.cellPointIds(cellId)]
+
+  @property
+  def locator(self):
+    """CenterlineLocator of the points, built on first use."""
+    if self._locator is None:
+      self._locator = CenterlineLocator(self.points)
+    return self._locator
+
+  def closestPointId(self, point):
+    """Id of the point closest to the given [x, y, z] coordinates."""
+    return self.locator.closestPointId(point)
+
+  def closestPointIds(self, points):
+    """Ids of the points closest to each of the given (m, 3) coordinates."""
+    return self.locator.closestPointIds(points)
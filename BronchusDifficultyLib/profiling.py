@@ -0,0 +1,150 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+  import resource
+except ImportError:
+  # not available on Windows, the memory columns are left empty there
+  resource = None
+
+#
+# Per-stage timing and memory records of a pipeline run
+#
+
+def peakResidentBytes():
+  """Peak resident set size of this process in bytes, None if unknown."""
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def dataCounts(value):
+  """Number of points and cells of a vtkDataSet (or of each one in a list), None for anything else."""
+  if isinstance(value, (list, tuple)):
+    counts = [dataCounts(item) for item in value]
+    counts = [count for count in counts if count is not None]
+    return counts or None
+  if hasattr(value, 'GetNumberOfPoints') and hasattr(value, 'GetNumberOfCells'):
+    return {'points': value.GetNumberOfPoints(), 'cells': value.GetNumberOfCells()}
+  return None
+
+
+class StageRecord(object):
+  """Timing of one stage. Times in seconds, start relative to the start of the profiler."""
+
+  def __init__(self, name, start, depth, inputs=None):
+    self.name = name
+    self.start = start
+    self.depth = depth
+    self.threadId = threading.current_thread().ident
+    self.wallTime = 0.0
+    self.cpuTime = 0.0
+    self.peakResidentDelta = None
+    self.inputs = dataCounts(inputs)
+    self.outputs = None
+
+  def setOutputs(self, outputs):
+    self.outputs = dataCounts(outputs)
+
+  def toDict(self):
+    return {'name': self.name, 'start': self.start, 'depth': self.depth, 'thread': self.threadId,
+            'wallTime': self.wallTime, 'cpuTime': self.cpuTime, 'peakResidentDelta': self.peakResidentDelta,
+            'inputs': self.inputs, 'outputs': self.outputs}
+
+
+class StageProfiler(object):
+  """Collects a StageRecord for every stage of a run.
+
+  with profiler.stage("Local Curvature", network) as record:
+    ...
+    record.setOutputs(result)
+
+  CPU time is the process time, so it includes all threads. The peak resident delta is how much
+  the peak memory of the process grew during the stage, 0 if the stage stayed below an earlier peak.
+  A disabled profiler records nothing and costs next to nothing.
+  """
+
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.records = []
+    self._origin = time.perf_counter()
+    self._depth = threading.local()
+
+  def clear(self):
+    self.records = []
+    self._origin = time.perf_counter()
+
+  @contextlib.contextmanager
+  def stage(self, name, inputs=None):
+    if not self.enabled:
+      yield StageRecord(name, 0.0, 0)
+      return
+
+    depth = getattr(self._depth, 'value', 0)
+    record = StageRecord(name, time.perf_counter() - self._origin, depth, inputs)
+    self._depth.value = depth + 1
+    peakBefore = peakResidentBytes()
+    cpuStart = time.process_time()
+    wallStart = time.perf_counter()
+    try:
+      yield record
+    finally:
+      record.wallTime = time.perf_counter() - wallStart
+      record.cpuTime = time.process_time() - cpuStart
+      peakAfter = peakResidentBytes()
+      if peakBefore is not None and peakAfter is not None:
+        record.peakResidentDelta = peakAfter - peakBefore
+      self._depth.value = depth
+      self.records.append(record)
+
+  def summary(self):
+    """One line per stage, in the order the stages started."""
+    lines = []
+    for record in sorted(self.records, key=lambda record: record.start):
+      line = "%s%-40s wall %8.3f s  cpu %8.3f s" % ("  " * record.depth, record.name, record.wallTime, record.cpuTime)
+      if record.peakResidentDelta is not None:
+        line += "  peak +%7.1f MB" % (record.peakResidentDelta / 1024.0**2)
+      lines.append(line)
+    return "\n".join(lines)
+
+  def writeJson(self, fileName):
+    with open(fileName, 'w') as f:
+      json.dump({'stages': [record.toDict() for record in sorted(self.records, key=lambda record: record.start)]}, f, indent=2)
+
+  def writeChromeTrace(self, fileName):
+    """Writes the stages as complete events of the Chrome trace format (chrome://tracing, Perfetto)."""
+    events = []
+    for record in self.records:
+      args = {'cpuTime': record.cpuTime}
+      if record.peakResidentDelta is not None:
+        args['peakResidentDelta'] = record.peakResidentDelta
+      if record.inputs is not None:
+        args['inputs'] = record.inputs
+      if record.outputs is not None:
+        args['outputs'] = record.outputs
+      events.append({'name': record.name, 'ph': 'X', 'ts': record.start * 1e6, 'dur': record.wallTime * 1e6,
+                     'pid': os.getpid(), 'tid': record.threadId, 'args': args})
+    with open(fileName, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def profiledStage(method):
+  """Decorator for methods of objects with a `profiler` attribute: records the call as a stage
+  named after the method, with the counts of its first argument and of its result."""
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    profiler = getattr(self, 'profiler', None)
+    if profiler is None or not profiler.enabled:
+      return method(self, *args, **kwargs)
+    with profiler.stage(method.__name__, args[0] if args else None) as record:
+      result = method(self, *args, **kwargs)
+      record.setOutputs(result)
+    return result
+  return wrapper
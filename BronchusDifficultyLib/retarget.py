@@ -0,0 +1,129 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+from .parallel import idList, mergeCenterlines
+from .pointview import CenterlinePointView
+from .vmtkmodules import computationalGeometry
+
+#
+# Centerlines to new targets from a stored Voronoi diagram and arrival time field
+#
+
+# point data arrays of the fast marching and the backtracing, named as in vtkvmtkPolyDataCenterlines
+COST_FUNCTION_ARRAY_NAME = 'CostFunctionArray'
+EIKONAL_SOLUTION_ARRAY_NAME = 'EikonalSolutionArray'
+EDGE_ARRAY_NAME = 'EdgeArray'
+EDGE_PCOORD_ARRAY_NAME = 'EdgePCoordArray'
+
+
+def reversedLines(polyData):
+  """Copy of the lines of polyData with the points of every line in reverse order, numbered along the lines."""
+  view = CenterlinePointView.fromPolyData(polyData)
+  order = np.concatenate([view.cellPointIds(i)[::-1] for i in range(view.numberOfCells)]) if view.numberOfCells else np.zeros(0, dtype=np.int64)
+
+  lines = vtk.vtkPolyData()
+  points = vtk.vtkPoints()
+  points.SetData(numpy_to_vtk(np.ascontiguousarray(view.points[order]), deep=1))
+  lines.SetPoints(points)
+
+  # legacy cell layout [n, id_0, ..., id_n-1, n, ...], the new ids simply count along the lines
+  sizes = np.diff(view.offsets)
+  cells = np.insert(np.arange(order.size), view.offsets[:-1], sizes)
+  cellArray = vtk.vtkCellArray()
+  cellArray.SetCells(view.numberOfCells, numpy_to_vtk(cells.astype(np.int64), deep=1, array_type=vtk.VTK_ID_TYPE))
+  lines.SetLines(cellArray)
+
+  pointData = polyData.GetPointData()
+  for i in range(pointData.GetNumberOfArrays()):
+    array = pointData.GetArray(i)
+    if array is None:
+      continue
+    reordered = numpy_to_vtk(np.ascontiguousarray(vtk_to_numpy(array)[order]), deep=1, array_type=array.GetDataType())
+    reordered.SetName(array.GetName())
+    lines.GetPointData().AddArray(reordered)
+  return lines
+
+
+def arrivalTimes(voronoiDiagram, sourceSeedIds, radiusArrayName='Radius', costFunction='1/R'):
+  """The Voronoi diagram with the arrival times (EIKONAL_SOLUTION_ARRAY_NAME) of a fast marching
+  from the source seeds (a vtkIdList of Voronoi point ids), as in vtkvmtkPolyDataCenterlines."""
+  costFunctionCalculator = vtk.vtkArrayCalculator()
+  costFunctionCalculator.SetInputData(voronoiDiagram)
+  costFunctionCalculator.SetAttributeTypeToPointData()
+  costFunctionCalculator.AddScalarVariable('R', radiusArrayName, 0)
+  costFunctionCalculator.SetFunction(costFunction)
+  costFunctionCalculator.SetResultArrayName(COST_FUNCTION_ARRAY_NAME)
+
+  fastMarching = computationalGeometry().vtkvmtkNonManifoldFastMarching()
+  fastMarching.SetInputConnection(costFunctionCalculator.GetOutputPort())
+  fastMarching.SetCostFunctionArrayName(COST_FUNCTION_ARRAY_NAME)
+  fastMarching.SetSolutionArrayName(EIKONAL_SOLUTION_ARRAY_NAME)
+  fastMarching.SeedsBoundaryConditionsOn()
+  fastMarching.SetSeeds(sourceSeedIds)
+  fastMarching.Update()
+
+  times = vtk.vtkPolyData()
+  times.ShallowCopy(fastMarching.GetOutput())
+  return times
+
+
+def backtraceCenterlines(arrivalTimes, sourceSeedIds, targetSeedIds, radiusArrayName='Radius', resamplingStepLength=0.0):
+  """Centerlines from the source to every target seed (Voronoi point ids), traced down the arrival
+  times of arrivalTimes(). One line per target, in the order of targetSeedIds, each starting at the
+  source, with the radius as the first point data array."""
+  backtracing = computationalGeometry().vtkvmtkSteepestDescentLineTracer()
+  backtracing.SetInputData(arrivalTimes)
+  backtracing.SetDataArrayName(radiusArrayName)
+  backtracing.SetDescentArrayName(EIKONAL_SOLUTION_ARRAY_NAME)
+  backtracing.SetEdgeArrayName(EDGE_ARRAY_NAME)
+  backtracing.SetEdgePCoordArrayName(EDGE_PCOORD_ARRAY_NAME)
+  backtracing.SetSeeds(targetSeedIds)
+  backtracing.MergePathsOff()
+  backtracing.StopOnTargetsOn()
+  backtracing.SetTargets(sourceSeedIds)
+  backtracing.Update()
+
+  # the lines are traced from the targets to the source, the metrics expect them to start at the source
+  lines = reversedLines(backtracing.GetOutput())
+
+  if resamplingStepLength > 0:
+    resampling = vtk.vtkSplineFilter()
+    resampling.SetInputData(lines)
+    resampling.SetSubdivideToLength()
+    resampling.SetLength(resamplingStepLength)
+    resampling.Update()
+    lines = resampling.GetOutput()
+
+  return mergeCenterlines([lines], radiusArrayName)
+
+
+class CenterlineRetargeter(object):
+  """Keeps the Voronoi diagram of a centerline run and the arrival times from its source,
+  so the centerline to another target only needs a steepest descent backtrace.
+
+  This repeats the steps of vtkvmtkPolyDataCenterlines after the Voronoi diagram: the fast
+  marching from the source runs once in the constructor, every centerline() call only traces.
+
+  voronoiDiagram: the second output of CenterlineComputationLogic.computeCenterlines
+  sourcePoint: a point inside the airway at the source (the seed), the Voronoi point closest to it is the source
+  """
+
+  def __init__(self, voronoiDiagram, sourcePoint, radiusArrayName='Radius', costFunction='1/R', resamplingStepLength=0.0):
+    self.radiusArrayName = radiusArrayName
+    self.resamplingStepLength = resamplingStepLength
+    self.sourcePoint = tuple(sourcePoint)
+
+    self.locator = vtk.vtkPointLocator()
+    self.locator.SetDataSet(voronoiDiagram)
+    self.locator.BuildLocator()
+    self.sourceSeedIds = idList([self.locator.FindClosestPoint(self.sourcePoint)])
+
+    # the Voronoi diagram with the arrival times from the source
+    self.arrivalTimes = arrivalTimes(voronoiDiagram, self.sourceSeedIds, radiusArrayName, costFunction)
+
+  def centerline(self, targetPoint):
+    """Returns the centerline from the source to the Voronoi point closest to targetPoint,
+    as a vtkPolyData with one line and the radius as the first point data array."""
+    targetSeedIds = idList([self.locator.FindClosestPoint(tuple(targetPoint))])
+    return backtraceCenterlines(self.arrivalTimes, self.sourceSeedIds, targetSeedIds, self.radiusArrayName, self.resamplingStepLength)
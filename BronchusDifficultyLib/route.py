@@ -0,0 +1,55 @@
+import heapq
+
+import numpy as np
+
+#
+# Shortest route through the lines of a network
+#
+
+def routePointIds(view, startPoint, endPoint):
+  """Point ids of the shortest path along the lines of a CenterlinePointView, from the point
+  closest to startPoint to the point closest to endPoint.
+
+  Lines are connected where they share point ids, so coincident end points of the segments of a
+  vtkvmtkPolyDataNetworkExtraction output have to be merged first (vtkCleanPolyData).
+  Returns an empty array if the two points are not connected.
+  """
+  start = view.closestPointId(startPoint)
+  end = view.closestPointId(endPoint)
+
+  # edges between the consecutive points of every line
+  neighbours = [[] for i in range(view.numberOfPoints)]
+  for cellId in range(view.numberOfCells):
+    ids = view.cellPointIds(cellId)
+    if ids.size < 2:
+      continue
+    pts = view.cellPoints(cellId)
+    lengths = np.sqrt(np.sum(np.diff(pts, axis=0)**2, axis=1))
+    for a, b, length in zip(ids[:-1].tolist(), ids[1:].tolist(), lengths.tolist()):
+      neighbours[a].append((b, length))
+      neighbours[b].append((a, length))
+
+  # Dijkstra
+  distances = np.full(view.numberOfPoints, np.inf)
+  previous = np.full(view.numberOfPoints, -1, dtype=np.int64)
+  distances[start] = 0.0
+  queue = [(0.0, start)]
+  while queue:
+    distance, pointId = heapq.heappop(queue)
+    if pointId == end:
+      break
+    if distance > distances[pointId]:
+      continue
+    for neighbour, length in neighbours[pointId]:
+      if distance + length < distances[neighbour]:
+        distances[neighbour] = distance + length
+        previous[neighbour] = pointId
+        heapq.heappush(queue, (distance + length, neighbour))
+
+  if not np.isfinite(distances[end]):
+    return np.zeros(0, dtype=np.int64)
+
+  route = [end]
+  while route[-1] != start:
+    route.append(int(previous[route[-1]]))
+  return np.array(route[::-1], dtype=np.int64)
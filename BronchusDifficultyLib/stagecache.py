@@ -0,0 +1,126 @@
+import hashlib
+import os
+
+import numpy as np
+
+#
+# Content addressed on-disk cache of intermediate vtkPolyData results
+#
+
+class StageCache(object):
+  """Stores the outputs of pipeline stages as binary .vtp files.
+
+  Keys are chained: the key of a stage is the hash of the key of its input, the stage name and
+  its parameters, and the first key is the hash of the input mesh itself (polyDataHash). When the
+  files in the cache directory exceed maxBytes, the least recently used ones are removed.
+  """
+
+  def __init__(self, directory, maxBytes=2*1024**3):
+    self.directory = directory
+    self.maxBytes = maxBytes
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+
+  @staticmethod
+  def polyDataHash(polyData):
+    """sha1 of the points and polygons of a vtkPolyData."""
+    from vtk.util.numpy_support import vtk_to_numpy
+
+    arrays = []
+    if polyData.GetPoints() is not None:
+      arrays.append(vtk_to_numpy(polyData.GetPoints().GetData()))
+    polys = polyData.GetPolys()
+    if hasattr(polys, 'GetOffsetsArray'):
+      arrays.append(vtk_to_numpy(polys.GetOffsetsArray()))
+      arrays.append(vtk_to_numpy(polys.GetConnectivityArray()))
+    else:
+      arrays.append(vtk_to_numpy(polys.GetData()))
+
+    sha = hashlib.sha1()
+    for array in arrays:
+      array = np.ascontiguousarray(array)
+      sha.update(("%s%s" % (array.dtype.str, array.shape)).encode())
+      sha.update(array.data)
+    return sha.hexdigest()
+
+  @staticmethod
+  def keyValue(value):
+    """Hashable description of a stage parameter (vtkIdList, vtkPoints, sequences or plain values)."""
+    if hasattr(value, 'GetNumberOfIds'):
+      return tuple(value.GetId(i) for i in range(value.GetNumberOfIds()))
+    if hasattr(value, 'GetNumberOfPoints') and hasattr(value, 'GetPoint'):
+      return tuple(tuple(value.GetPoint(i)) for i in range(value.GetNumberOfPoints()))
+    if isinstance(value, (list, tuple, np.ndarray)):
+      return tuple(StageCache.keyValue(item) for item in value)
+    if isinstance(value, np.generic):
+      return value.item()
+    return value
+
+  @staticmethod
+  def key(inputKey, stage, *args, **parameters):
+    """Key of a stage output, derived from the key of its input, its name and its parameters."""
+    args = tuple(StageCache.keyValue(arg) for arg in args)
+    parameters = sorted((name, StageCache.keyValue(value)) for name, value in parameters.items())
+    description = repr((inputKey, stage, args, parameters))
+    return hashlib.sha1(description.encode()).hexdigest()
+
+  def _fileName(self, key, index):
+    return os.path.join(self.directory, "%s-%d.vtp" % (key, index))
+
+  def load(self, key, numberOfOutputs=1):
+    """The list of vtkPolyData stored under key, or None if any of them is missing."""
+    import vtk
+
+    fileNames = [self._fileName(key, i) for i in range(numberOfOutputs)]
+    if not all(os.path.isfile(fileName) for fileName in fileNames):
+      return None
+
+    outputs = []
+    for fileName in fileNames:
+      reader = vtk.vtkXMLPolyDataReader()
+      reader.SetFileName(fileName)
+      reader.Update()
+      if reader.GetErrorCode() != 0:
+        return None
+      outputs.append(reader.GetOutput())
+      # mark as recently used
+      os.utime(fileName, None)
+    return outputs
+
+  def store(self, key, outputs):
+    """Writes the list of vtkPolyData under key and evicts old entries if the cache is too large."""
+    import vtk
+
+    for i, polyData in enumerate(outputs):
+      fileName = self._fileName(key, i)
+      # write next to the final file first, so an interrupted write never looks like a cache hit
+      partialFileName = fileName + ".partial"
+      writer = vtk.vtkXMLPolyDataWriter()
+      writer.SetFileName(partialFileName)
+      writer.SetInputData(polyData)
+      writer.SetDataModeToBinary()
+      writer.Write()
+      os.replace(partialFileName, fileName)
+    self.evict()
+
+  def evict(self):
+    """Removes the least recently used files until the cache fits into maxBytes."""
+    entries = []
+    for fileName in os.listdir(self.directory):
+      if not fileName.endswith(".vtp"):
+        continue
+      path = os.path.join(self.directory, fileName)
+      status = os.stat(path)
+      entries.append((status.st_mtime, status.st_size, path))
+
+    totalBytes = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+      if totalBytes <= self.maxBytes:
+        break
+      os.remove(path)
+      totalBytes -= size
+
+  def clear(self):
+    for fileName in os.listdir(self.directory):
+      if fileName.endswith(".vtp") or fileName.endswith(".partial"):
+        os.remove(os.path.join(self.directory, fileName))
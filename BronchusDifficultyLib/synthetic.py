@@ -0,0 +1,212 @@
+import math
+
+import numpy as np
+
+#
+# Synthetic airway trees with known radius, curvature and torsion
+#
+
+def rotate(vectors, axis, angles):
+  """Rotates each vector about the unit axis by its angle (Rodrigues), vectors (3,) or (n, 3), angles (n,)."""
+  vectors = np.asarray(vectors, dtype=np.float64)
+  angles = np.asarray(angles, dtype=np.float64)[:, np.newaxis]
+  axial = np.dot(vectors, axis)[..., np.newaxis] * axis if vectors.ndim > 1 else np.dot(vectors, axis) * axis
+  return axial + np.cos(angles) * (vectors - axial) + np.sin(angles) * np.cross(axis, vectors)
+
+
+def helixSegment(start, tangent, normal, length, spacing, curvature=0.0, torsion=0.0):
+  """Points of a curve with constant curvature (1/mm) and torsion (1/mm), evaluated in closed form.
+
+  start: first point, tangent and normal: unit Frenet vectors at the start
+  Returns (points, tangents, normals), the points spaced `spacing` mm along the curve; the last
+  point is at `length` mm.
+  """
+  start = np.asarray(start, dtype=np.float64)
+  tangent = np.asarray(tangent, dtype=np.float64)
+  normal = np.asarray(normal, dtype=np.float64)
+  numberOfSteps = max(1, int(round(length / spacing)))
+  s = np.linspace(0.0, length, numberOfSteps + 1)
+
+  omega = math.sqrt(curvature**2 + torsion**2)
+  if omega == 0.0:
+    points = start + np.outer(s, tangent)
+    return (points, np.repeat(tangent[np.newaxis, :], s.size, axis=0), np.repeat(normal[np.newaxis, :], s.size, axis=0))
+
+  # the Frenet frame rotates about the Darboux vector, the tangent integrates to a helix around it
+  binormal = np.cross(tangent, normal)
+  axis = (torsion * tangent + curvature * binormal) / omega
+  axial = np.dot(tangent, axis) * axis
+  radial = tangent - axial
+  points = (start + np.outer(s, axial) + np.outer(np.sin(omega * s) / omega, radial)
+            + np.outer((1.0 - np.cos(omega * s)) / omega, np.cross(axis, tangent)))
+  tangents = rotate(np.repeat(tangent[np.newaxis, :], s.size, axis=0), axis, omega * s)
+  normals = rotate(np.repeat(normal[np.newaxis, :], s.size, axis=0), axis, omega * s)
+  return (points, tangents, normals)
+
+
+class SyntheticBranch(object):
+  """One tube of a SyntheticAirwayTree, with its analytic radius, curvature and torsion."""
+
+  def __init__(self, branchId, parent, generation, points, tangents, normals, radius, curvature, torsion):
+    self.branchId = branchId
+    self.parent = parent
+    self.children = []
+    self.generation = generation
+    self.points = points
+    self.tangents = tangents
+    self.normals = normals
+    self.radius = radius
+    self.curvature = curvature
+    self.torsion = torsion
+
+
+class SyntheticAirwayTree(object):
+  """A binary tree of tubes starting with a straight trachea along -z.
+
+  Every branch splits into two children that leave at +/- branchAngle (degrees) from its end
+  direction, in a branching plane that turns by 90 degrees from one generation to the next.
+  Children are lengthRatio times as long and radiusRatio times as wide as their parent and
+  follow a helix of the given curvature and torsion (1/mm); the trachea is always straight.
+
+  centerlinePolyData() gives the centerlines in the layout of vtkvmtkPolyDataCenterlines (one line
+  per leaf from the top of the trachea, every line with its own copy of the shared points),
+  surfacePolyData() the closed surface of the tube union.
+  """
+
+  def __init__(self, generations=4, tracheaLength=100.0, tracheaRadius=8.0, lengthRatio=0.8, radiusRatio=0.79,
+               branchAngle=35.0, curvature=0.0, torsion=0.0, pointSpacing=0.5):
+    self.generations = generations
+    self.pointSpacing = pointSpacing
+    self.branches = []
+
+    points, tangents, normals = helixSegment([0.0, 0.0, 0.0], [0.0, 0.0, -1.0], [1.0, 0.0, 0.0], tracheaLength, pointSpacing)
+    self._addBranch(-1, 0, points, tangents, normals, tracheaRadius, 0.0, 0.0)
+
+    angle = math.radians(branchAngle)
+    queue = [0]
+    while queue:
+      parent = self.branches[queue.pop(0)]
+      if parent.generation + 1 >= generations:
+        continue
+      tangent, normal = parent.tangents[-1], parent.normals[-1]
+      # children turn about the parent's normal and get a normal in the branching plane,
+      # so the next branching plane is turned by 90 degrees
+      planeNormal = normal
+      length = np.linalg.norm(np.diff(parent.points, axis=0), axis=1).sum() * lengthRatio
+      for sign in [1.0, -1.0]:
+        childTangent = rotate(tangent, planeNormal / np.linalg.norm(planeNormal), [sign * angle])[0]
+        childNormal = np.cross(childTangent, planeNormal)
+        childNormal /= np.linalg.norm(childNormal)
+        points, tangents, normals = helixSegment(parent.points[-1], childTangent, childNormal, length, pointSpacing, curvature, torsion)
+        child = self._addBranch(parent.branchId, parent.generation + 1, points, tangents, normals, parent.radius * radiusRatio, curvature, torsion)
+        queue.append(child.branchId)
+
+  def _addBranch(self, parent, generation, points, tangents, normals, radius, curvature, torsion):
+    branch = SyntheticBranch(len(self.branches), parent, generation, points, tangents, normals, radius, curvature, torsion)
+    self.branches.append(branch)
+    if parent >= 0:
+      self.branches[parent].children.append(branch.branchId)
+    return branch
+
+  @property
+  def leaves(self):
+    return [branch for branch in self.branches if not branch.children]
+
+  def pathBranches(self, leaf):
+    """Branches from the trachea to the given leaf."""
+    path = [leaf]
+    while path[-1].parent >= 0:
+      path.append(self.branches[path[-1].parent])
+    return path[::-1]
+
+  def lines(self):
+    """(points, radius, branchIds, tangents) of every centerline from the top of the trachea to a leaf.
+    The first point of every child is the last point of its parent, so it is left out."""
+    lines = []
+    for leaf in self.leaves:
+      path = self.pathBranches(leaf)
+      pieces = [(branch, slice(0 if i == 0 else 1, None)) for i, branch in enumerate(path)]
+      points = np.concatenate([branch.points[part] for branch, part in pieces])
+      tangents = np.concatenate([branch.tangents[part] for branch, part in pieces])
+      branchIds = np.concatenate([np.full(branch.points[part].shape[0], branch.branchId) for branch, part in pieces])
+      radius = np.array([self.branches[branchId].radius for branchId in branchIds])
+      lines.append((points, radius, branchIds, tangents))
+    return lines
+
+  def centerlinePolyData(self):
+    """Centerlines with the point data arrays 'Radius' (first, as in the vmtk output), 'BranchId',
+    'AnalyticCurvature' (1/mm) and 'AnalyticTangent'."""
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk
+
+    lines = self.lines()
+    points = np.concatenate([line[0] for line in lines])
+    arrays = [('Radius', np.concatenate([line[1] for line in lines])),
+              ('BranchId', np.concatenate([line[2] for line in lines]).astype(np.float64)),
+              ('AnalyticCurvature', np.array([self.branches[int(branchId)].curvature for branchId in np.concatenate([line[2] for line in lines])])),
+              ('AnalyticTangent', np.concatenate([line[3] for line in lines]))]
+
+    polyData = vtk.vtkPolyData()
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_to_vtk(np.ascontiguousarray(points), deep=1))
+    polyData.SetPoints(vtkPoints)
+
+    cellArray = vtk.vtkCellArray()
+    pointId = 0
+    for line in lines:
+      numberOfPoints = line[0].shape[0]
+      cellArray.InsertNextCell(numberOfPoints)
+      for i in range(numberOfPoints):
+        cellArray.InsertCellPoint(pointId + i)
+      pointId += numberOfPoints
+    polyData.SetLines(cellArray)
+
+    for name, values in arrays:
+      array = numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+      array.SetName(name)
+      polyData.GetPointData().AddArray(array)
+    return polyData
+
+  def surfacePolyData(self, voxelSize=0.5):
+    """Closed triangulated surface of the union of balls along all branches (a polyball),
+    extracted from its sampled distance field."""
+    import vtk
+    from vtk.util.numpy_support import numpy_to_vtk
+
+    centers = np.concatenate([branch.points for branch in self.branches])
+    radii = np.concatenate([np.full(branch.points.shape[0], branch.radius) for branch in self.branches])
+
+    margin = radii.max() + 2 * voxelSize
+    origin = centers.min(axis=0) - margin
+    dimensions = np.ceil((centers.max(axis=0) + margin - origin) / voxelSize).astype(int) + 1
+
+    # signed distance to the polyball, only evaluated in the box around each ball
+    distance = np.full(dimensions[::-1], margin, dtype=np.float32)
+    for center, radius in zip(centers, radii):
+      low = np.maximum(np.floor((center - radius - 2 * voxelSize - origin) / voxelSize).astype(int), 0)
+      high = np.minimum(np.ceil((center + radius + 2 * voxelSize - origin) / voxelSize).astype(int) + 1, dimensions)
+      x = origin[0] + voxelSize * np.arange(low[0], high[0])
+      y = origin[1] + voxelSize * np.arange(low[1], high[1])
+      z = origin[2] + voxelSize * np.arange(low[2], high[2])
+      ballDistance = np.sqrt((z[:, None, None] - center[2])**2 + (y[None, :, None] - center[1])**2 + (x[None, None, :] - center[0])**2) - radius
+      box = distance[low[2]:high[2], low[1]:high[1], low[0]:high[0]]
+      np.minimum(box, ballDistance, out=box)
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(*[int(d) for d in dimensions])
+    image.SetSpacing(voxelSize, voxelSize, voxelSize)
+    image.SetOrigin(*origin)
+    image.GetPointData().SetScalars(numpy_to_vtk(distance.ravel(), deep=1))
+
+    contour = vtk.vtkMarchingCubes()
+    contour.SetInputData(image)
+    contour.SetValue(0, 0.0)
+    contour.ComputeNormalsOff()
+
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputConnection(contour.GetOutputPort())
+    triangles.Update()
+
+    surface = vtk.vtkPolyData()
+    surface.ShallowCopy(triangles.GetOutput())
+    return surface
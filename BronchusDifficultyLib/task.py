@@ -0,0 +1,79 @@
+import queue
+import sys
+import threading
+import traceback
+
+#
+# Long computations on a worker thread, reported back through a queue
+#
+
+class TaskCancelled(Exception):
+  """Raised inside the worker at the next stage boundary after BackgroundTask.cancel()."""
+
+
+class BackgroundTask(object):
+  """Runs function(task) on a worker thread.
+
+  The function reports its progress with setStage() and setProgress() and calls checkCancelled()
+  between its stages. The owner thread calls poll() (e.g. from a timer) to receive the reports as
+  tupels ('progress', stage, fraction), then exactly one of ('done', result), ('cancelled',) or
+  ('error', exception, formattedTraceback). Nothing but these reports crosses the threads, so all
+  scene updates are left to the owner.
+  """
+
+  def __init__(self, function):
+    self.function = function
+    self.stage = ''
+    self._queue = queue.Queue()
+    self._cancelled = threading.Event()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+
+  @property
+  def running(self):
+    return self._thread.is_alive()
+
+  def cancel(self):
+    self._cancelled.set()
+
+  @property
+  def cancelled(self):
+    return self._cancelled.is_set()
+
+  def checkCancelled(self):
+    if self._cancelled.is_set():
+      raise TaskCancelled()
+
+  def setStage(self, stage):
+    self.checkCancelled()
+    self.stage = stage
+    self._queue.put(('progress', stage, 0.0))
+
+  def setProgress(self, fraction):
+    self._queue.put(('progress', self.stage, fraction))
+
+  def vtkProgressObserver(self, caller, event):
+    """Observer for the ProgressEvent of VTK filters."""
+    self.setProgress(caller.GetProgress())
+
+  def poll(self):
+    """All reports since the last call, oldest first."""
+    reports = []
+    while True:
+      try:
+        reports.append(self._queue.get_nowait())
+      except queue.Empty:
+        return reports
+
+  def _run(self):
+    try:
+      result = self.function(self)
+    except TaskCancelled:
+      self._queue.put(('cancelled',))
+    except Exception as e:
+      self._queue.put(('error', e, ''.join(traceback.format_exception(*sys.exc_info()))))
+    else:
+      self._queue.put(('done', result))
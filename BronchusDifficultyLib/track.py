@@ -0,0 +1,131 @@
+import numpy as np
+
+from .arclength import cumulativeArcLength, cumulativeMetricIntegral
+from .locator import CenterlineLocator
+from .pointview import CenterlinePointView
+from .pipeline import METRIC_NAMES
+
+#
+# A centerline in slider order with aligned point, arc length and metric arrays
+#
+
+class CenterlineTrack(object):
+  """The points of a centerline in the order the sliders traverse them, with aligned arrays.
+
+  Index i holds point id numberOfPoints - i, so the track runs from the last point id down to 1;
+  index 0 has no point of its own and repeats index 1.
+
+  pointIds, points, arcLength: arrays by index
+  values(name): the metric by point id as stored (a view of the point data array or a memory-mapped
+  metric store column, never copied)
+  alignedValues(name), metricIntegral(name): the metric and its cumulative integral by index, built on first use
+
+  A track observes the ModifiedEvent of its polydata and is no longer valid once it fired.
+  """
+
+  def __init__(self, points, metricNames, metricColumn, metricRange=None):
+    """points: (n, 3) by point id; metricColumn(name): array of a metric by point id;
+    metricRange(name): optional (min, max) of a metric, computed from the values otherwise."""
+    self.numberOfPoints = points.shape[0]
+    self.pointIds = self.numberOfPoints - np.arange(self.numberOfPoints)
+    if self.numberOfPoints > 1:
+      self.pointIds[0] = self.pointIds[1]
+    self.points = np.asarray(points[self.pointIds], dtype=np.float64)
+    self.arcLength = cumulativeArcLength(self.points)
+    self.metricNames = list(metricNames)
+    self._metricColumn = metricColumn
+    self._metricRange = metricRange
+    self._values = {}
+    self._alignedValues = {}
+    self._metricIntegrals = {}
+    self._locator = None
+    self.polyData = None
+    self._observerTag = None
+    self.valid = True
+
+  @classmethod
+  def fromPolyData(cls, polyData):
+    """Track of the points and single component point data arrays of a centerline, read without copying them."""
+    from vtk.util.numpy_support import vtk_to_numpy
+
+    pointData = polyData.GetPointData()
+    metricNames = []
+    arrays = {}
+    for i in range(pointData.GetNumberOfArrays()):
+      array = pointData.GetArray(i)
+      if array is not None and array.GetNumberOfComponents() == 1:
+        metricNames.append(array.GetName())
+        arrays[array.GetName()] = vtk_to_numpy(array)
+    return cls(CenterlinePointView.fromPolyData(polyData).points, metricNames, arrays.__getitem__)
+
+  @classmethod
+  def fromMetricStore(cls, store):
+    """Track of the points and metric columns of a metricstore.MetricStore."""
+    track = cls(store.points, store.metricNames, store.column, store.range)
+    track.metricStore = store
+    return track
+
+  def observe(self, polyData):
+    """Invalidates the track when polyData is modified."""
+    self.release()
+    self.polyData = polyData
+    self._observerTag = polyData.AddObserver('ModifiedEvent', self.onPolyDataModified)
+
+  def release(self):
+    if self._observerTag is not None:
+      self.polyData.RemoveObserver(self._observerTag)
+      self._observerTag = None
+
+  def onPolyDataModified(self, caller, event):
+    self.valid = False
+
+  def defaultMetricName(self):
+    """The first computed difficulty metric, the radius if there is none."""
+    for name in METRIC_NAMES:
+      if name in self.metricNames:
+        return name
+    return 'Radius'
+
+  def values(self, name):
+    if name not in self._values:
+      self._values[name] = self._metricColumn(name)
+    return self._values[name]
+
+  def range(self, name):
+    """(min, max) of the values of a metric, nan ignored."""
+    if self._metricRange is not None:
+      return self._metricRange(name)
+    values = self.values(name)
+    return (float(np.nanmin(values)), float(np.nanmax(values)))
+
+  def alignedValues(self, name):
+    """The metric by index; point ids without a value (nan or past the end of the array) are 0."""
+    if name not in self._alignedValues:
+      values = self.values(name)
+      aligned = np.zeros(self.numberOfPoints)
+      inRange = self.pointIds < len(values)
+      aligned[inRange] = values[self.pointIds[inRange]]
+      aligned[np.isnan(aligned)] = 0.0
+      self._alignedValues[name] = aligned
+    return self._alignedValues[name]
+
+  def metricIntegral(self, name):
+    """Cumulative trapezoidal integral of the metric along the track (metric * mm) by index."""
+    if name not in self._metricIntegrals:
+      self._metricIntegrals[name] = cumulativeMetricIntegral(self.points, self.alignedValues(name))
+    return self._metricIntegrals[name]
+
+  @property
+  def locator(self):
+    """CenterlineLocator of the points from index 1 on."""
+    if self._locator is None:
+      self._locator = CenterlineLocator(self.points[1:])
+    return self._locator
+
+  def closestIndex(self, point):
+    """Index of the point closest to the given [x, y, z] coordinates."""
+    return 1 + self.locator.closestPointId(point)
+
+  def closestIndices(self, points):
+    """The same for an (m, 3) array of points, in one query."""
+    return 1 + self.locator.closestPointIds(points)
@@ -0,0 +1,43 @@
+import functools
+import importlib
+
+#
+# The vmtk python modules, resolved on first use
+#
+
+# Slicer (SlicerVMTK extension) puts the vmtk libraries on the path as vtkvmtk<Library>Python,
+# the conda and pip vmtk packages ship them as vmtk.vtkvmtk<Library>Python, older ones only as vmtk.vtkvmtk
+MODULE_NAMES = ('vtkvmtk%sPython', 'vmtk.vtkvmtk%sPython')
+FALLBACK_MODULE_NAME = 'vmtk.vtkvmtk'
+
+
+@functools.lru_cache(maxsize=None)
+def vmtkModule(library):
+  """The module of a vmtk library ('ComputationalGeometry', 'Misc', ...), imported once per process.
+  Raises ImportError if vmtk is not available."""
+  for pattern in MODULE_NAMES:
+    try:
+      return importlib.import_module(pattern % library)
+    except ImportError:
+      pass
+  try:
+    return importlib.import_module(FALLBACK_MODULE_NAME)
+  except ImportError:
+    raise ImportError("Unable to import the vmtk library " + library + ": run with Slicer and the SlicerVMTK extension, or install the vmtk package")
+
+
+def computationalGeometry():
+  return vmtkModule('ComputationalGeometry')
+
+
+def misc():
+  return vmtkModule('Misc')
+
+
+def vmtkAvailable():
+  try:
+    computationalGeometry()
+    misc()
+  except ImportError:
+    return False
+  return True
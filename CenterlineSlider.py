@@ -6,6 +6,9 @@ import logging
 import numpy as np
 import time
 
+from BronchusDifficultyLib.metricstore import MetricStore
+from BronchusDifficultyLib.track import CenterlineTrack
+
 # try:
 #   from pysinewave import SineWave
 # except: 
@@ -50,6 +53,14 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     # Flythough variables
     self.transform = None
     self.path = None
+    # CenterlineTrack of each centerline node (and metric store), see getCenterlineTrack
+    self.centerlineTracks = {}
+    self.pathTrack = None
+    self.distanceTrack = None
+    # nearest centerline index, metric and pitch of every path point, parallel to self.path
+    self.pathCenterlineIds = None
+    self.pathOriginalMetrics = None
+    self.pathSonifiedMetrics = None
     self.camera = None
     self.skip = 0
     self.timer = qt.QTimer()
@@ -145,6 +156,21 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.parent.connect('mrmlSceneChanged(vtkMRMLScene*)',
                         self.seedFiducialsNodeSelector, 'setMRMLScene(vtkMRMLScene*)')
 
+    # (Optional) metric store written next to raw_data.txt by the centerline computation
+    self.metricStorePathLineEdit = ctk.ctkPathLineEdit()
+    self.metricStorePathLineEdit.objectName = 'metricStorePathLineEdit'
+    self.metricStorePathLineEdit.toolTip = "Select the metric store (.bdm) of the centerline. Its metrics are read from disk on demand."
+    self.metricStorePathLineEdit.filters = ctk.ctkPathLineEdit.Files
+    self.metricStorePathLineEdit.nameFilters = ["Metric store (*.bdm)"]
+    pathFormLayout.addRow("Metric store (optional):", self.metricStorePathLineEdit)
+
+    # Metric selector, filled when the path is created
+    self.metricComboBox = qt.QComboBox()
+    self.metricComboBox.objectName = 'metricComboBox'
+    self.metricComboBox.toolTip = "Select the metric to display and play audio from."
+    pathFormLayout.addRow("Metric:", self.metricComboBox)
+    self.metricComboBox.connect('currentIndexChanged(int)', self.onMetricComboBoxChanged)
+
     # CreatePath button
     self.createPathButton = qt.QPushButton("Create path")
     self.createPathButton.toolTip = "Create the path."
@@ -375,6 +401,16 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.endMetricTextbox.setFixedWidth(100)
     distanceFormLayout.addRow("Endpoint metric:", self.endMetricTextbox)
 
+    self.meanMetricTextbox = qt.QLineEdit()
+    self.meanMetricTextbox.setReadOnly(True)
+    self.meanMetricTextbox.setFixedWidth(100)
+    distanceFormLayout.addRow("Mean metric:", self.meanMetricTextbox)
+
+    self.integratedMetricTextbox = qt.QLineEdit()
+    self.integratedMetricTextbox.setReadOnly(True)
+    self.integratedMetricTextbox.setFixedWidth(100)
+    distanceFormLayout.addRow("Integrated metric (metric * mm):", self.integratedMetricTextbox)
+
     # Output Directory selector
     self.distanceOutputDirectory = ''
     self.distanceOutputDirectoryButton = qt.QPushButton('Select Output Directory')
@@ -415,6 +451,11 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.textNode.SetEncoding(3)
     slicer.mrmlScene.AddNode(self.textNode)
 
+  def cleanup(self):
+    for track in self.centerlineTracks.values():
+      track.release()
+    self.centerlineTracks = {}
+
   # ---------- Functions for distance between 2 points ---------- #
 
   def onDistanceOutputDirectoryClicked(self):
@@ -422,42 +463,25 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.distanceOutputDirectory = fileDialog.getExistingDirectory( None, 'Select Output Directory', self.distanceOutputDirectory )
 
   def onSaveDistanceButtonClicked(self):
-
-    print("here")
-
-    from sys import platform
-
     if self.distanceOutputDirectory != '':
-      cumulativeDistance = 0.0
-      dir = self.distanceOutputDirectory
-      print("dir: ", dir)
-
-      distanceOutputFilename = self.distanceOutputFilenameTextbox.text
-
-      if platform == 'win32':
-        fileName = dir + "\\" + distanceOutputFilename + ".txt"
-      else:
-        fileName = dir + "/" + distanceOutputFilename + ".txt"
+      fileName = os.path.join(self.distanceOutputDirectory, self.distanceOutputFilenameTextbox.text + ".txt")
 
-      with open(fileName,"w") as f:
-        print("f: ", f)
-        for i in range(int(self.startFrameSlider.value), int(self.endFrameSlider.value)+1):
-          thisDistance = np.linalg.norm(np.array(self.centerlinePts[i])-np.array(self.centerlinePts[i-1]))
-          cumulativeDistance += thisDistance
-          f.write(str(i) + ',' + str(thisDistance) + ',' + str(cumulativeDistance) + ',' + str(round(self.distanceMetricArray[self.numPtsOnCenterline - int(i)],2)) + '\n')
+      # one row per slider index from start to end: index, step length, distance from the start, metric
+      startID = int(self.startFrameSlider.value)
+      endID = int(self.endFrameSlider.value)
+      ids = np.arange(startID, endID+1)
+      arcLength = self.distanceTrack.arcLength
+      rows = np.column_stack((ids, arcLength[ids] - arcLength[ids-1], arcLength[ids] - arcLength[startID-1],
+                              np.round(self.distanceTrack.alignedValues(self.distanceMetricName)[ids], 2)))
+      np.savetxt(fileName, rows, fmt=['%d', '%.10g', '%.10g', '%.10g'], delimiter=',')
 
   def onComputeDistanceButtonClicked(self):
     centerline = self.centerlineNodeSelector.currentNode()
-    self.numPtsOnCenterline = centerline.GetPolyData().GetPointData().GetNumberOfTuples()
+    self.distanceTrack = self.getCenterlineTrack(centerline)
 
     # Add color display to centerline
-    import vtk.util.numpy_support as VN
-    vtkMetricArray = centerline.GetPolyData().GetPointData().GetArray(3)
-    activeScalarName = centerline.GetPolyData().GetPointData().GetArrayName(3)
-    if vtkMetricArray is None:
-      vtkMetricArray = centerline.GetPolyData().GetPointData().GetArray('Radius')
-      activeScalarName = 'Radius'
-    self.distanceMetricArray = VN.vtk_to_numpy(vtkMetricArray)
+    activeScalarName = self.distanceTrack.defaultMetricName()
+    self.distanceMetricName = activeScalarName
     print("current active scalar: ", activeScalarName)
 
     # Display metric array colortable on centerline
@@ -485,24 +509,15 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.endpointNode = self.endFiducialsNodeSelector.currentNode()
     self.endpointNode.GetNthFiducialPosition(0,endCoordinates)
 
-    self.centerlinePts = []
-    for i in range(self.numPtsOnCenterline):
-      pt = [0,0,0]
-      centerline.GetPolyData().GetPoint((self.numPtsOnCenterline-i), pt)
-      self.centerlinePts.append(pt)
-
-    startPtOnCenterline = self.findClosestPointOnCenterline(startCoordinates)
-    endPtOnCenterline = self.findClosestPointOnCenterline(endCoordinates)
-
-    startPtOnCenterlineID = self.centerlinePts.index(startPtOnCenterline)
-    endPtOnCenterlineID = self.centerlinePts.index(endPtOnCenterline)
+    startPtOnCenterlineID = self.distanceTrack.closestIndex(startCoordinates)
+    endPtOnCenterlineID = self.distanceTrack.closestIndex(endCoordinates)
 
     # Calculate distance on the curve between the start and end points
     self.computeDistance(startPtOnCenterlineID, endPtOnCenterlineID)
 
     # Update frame slider ranges
-    self.startFrameSlider.maximum = centerline.GetPolyData().GetPointData().GetNumberOfTuples()
-    self.endFrameSlider.maximum = centerline.GetPolyData().GetPointData().GetNumberOfTuples()
+    self.startFrameSlider.maximum = self.distanceTrack.numberOfPoints
+    self.endFrameSlider.maximum = self.distanceTrack.numberOfPoints
     self.startFrameSlider.minimum = 2
     self.endFrameSlider.minimum = 2
 
@@ -513,23 +528,32 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.endFrameSlider.connect('valueChanged(double)', self.endFrameSliderValueChanged)
 
   def startFrameSliderValueChanged(self, newValue):
-    pt = self.centerlinePts[int(newValue)]
+    pt = self.distanceTrack.points[int(newValue)]
     self.startpointNode.SetNthFiducialPosition(0, pt[0], pt[1], pt[2])
     self.computeDistance(newValue, self.endFrameSlider.value)
-    self.startMetricTextbox.setText(round(self.distanceMetricArray[self.numPtsOnCenterline - int(newValue)],2))
+    self.startMetricTextbox.setText(round(self.distanceTrack.alignedValues(self.distanceMetricName)[int(newValue)],2))
 
   def endFrameSliderValueChanged(self, newValue):
-    pt = self.centerlinePts[int(newValue)]
+    pt = self.distanceTrack.points[int(newValue)]
     self.endpointNode.SetNthFiducialPosition(0, pt[0], pt[1], pt[2])
     self.computeDistance(self.startFrameSlider.value, newValue)
-    self.endMetricTextbox.setText(round(self.distanceMetricArray[self.numPtsOnCenterline - int(newValue)],2))
+    self.endMetricTextbox.setText(round(self.distanceTrack.alignedValues(self.distanceMetricName)[int(newValue)],2))
 
   def computeDistance(self, startID, endID):
-    # Calculate distance on the curve between the start and end points
-    cumulativeDistance = 0.0
-    for i in range(int(startID), int(endID)+1):
-      cumulativeDistance += np.linalg.norm(np.array(self.centerlinePts[i])-np.array(self.centerlinePts[i-1]))
-    self.distanceTextbox.setText(round(cumulativeDistance,2))
+    # Calculate distance on the curve between the start and end points, from the step into the start point
+    # to the end point, and the mean and integral of the metric over it
+    startID = max(int(startID), 1)
+    endID = int(endID)
+    if endID < startID:
+      (distance, integral) = (0.0, 0.0)
+    else:
+      distance = self.distanceTrack.arcLength[endID] - self.distanceTrack.arcLength[startID-1]
+      metricIntegral = self.distanceTrack.metricIntegral(self.distanceMetricName)
+      integral = metricIntegral[endID] - metricIntegral[startID-1]
+    meanMetric = integral / distance if distance > 0 else self.distanceTrack.alignedValues(self.distanceMetricName)[startID]
+    self.distanceTextbox.setText(round(distance,2))
+    self.meanMetricTextbox.setText(round(meanMetric,2))
+    self.integratedMetricTextbox.setText(round(integral,2))
 
       
   # ------------------------------------------------------------- #
@@ -578,85 +602,90 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.IGTActive = True
 
 
-  def findClosestPointOnCenterline(self, point):
-    # given a point in [x, y, z] format and an array of all points on the centerline, return the pt on the centerline that is closest to that point
-    min_dist = float("inf")
-    current_point = self.centerlinePts[0]
-    closest = current_point
+  def getCenterlineTrack(self, centerlineNode, metricStore=None):
+    # One CenterlineTrack per centerline node (and metric store), shared by the path, the fly-throughs and the
+    # distance tool; rebuilt only after its polydata was modified or replaced
+    polyData = centerlineNode.GetPolyData()
+    key = (centerlineNode.GetID(),) if metricStore is None else (centerlineNode.GetID(), metricStore.fileName, os.path.getmtime(metricStore.fileName))
+    track = self.centerlineTracks.get(key)
+    if track is None or not track.valid or track.polyData is not polyData:
+      if track is not None:
+        track.release()
+      if metricStore is not None:
+        track = CenterlineTrack.fromMetricStore(metricStore)
+      else:
+        track = CenterlineTrack.fromPolyData(polyData)
+      track.observe(polyData)
+      self.centerlineTracks[key] = track
+    return track
 
-    for i in range(1, len(self.centerlinePts)):
-      current_point = self.centerlinePts[i]
-      dist = np.linalg.norm(np.array(point)-np.array(current_point))
-      if dist < min_dist: 
-        closest = current_point
-        min_dist = dist
-    return closest
+  def findClosestPointIdOnCenterline(self, point):
+    # given a point in [x, y, z] format, return the index on the path track of the pt on the centerline that is closest to that point
+    return self.pathTrack.closestIndex(point)
+
+  def findClosestPointIdsOnCenterline(self, points):
+    # the same for an (n, 3) array of points, in one query
+    return self.pathTrack.closestIndices(points)
+
+  def findClosestPointOnCenterline(self, point):
+    # given a point in [x, y, z] format, return the pt on the centerline that is closest to that point
+    return self.pathTrack.points[self.findClosestPointIdOnCenterline(point)]
 
 
   def onCreatePathButtonClicked(self):
     """Connected to 'create path' button. It allows to:
       - compute the path
       - create the associated model"""
-    from vtk.util import numpy_support as VN
-
     seedCoordinates = [0,0,0]
     seedNode = self.seedFiducialsNodeSelector.currentNode()
     seedNode.GetNthFiducialPosition(0,seedCoordinates)
     centerline = self.inputModelNodeSelector.currentNode()
-    #global numPtsOnCenterline
-    self.numPtsOnCenterline = centerline.GetPolyData().GetPointData().GetNumberOfTuples()
-
-    #global centerlinePts
-    self.centerlinePts = []
-    for i in range(self.numPtsOnCenterline):
-      pt = [0,0,0]
-      centerline.GetPolyData().GetPoint((self.numPtsOnCenterline-i), pt)
-      self.centerlinePts.append(pt)
+    numberOfPoints = centerline.GetPolyData().GetNumberOfPoints()
+
+    # The metric store, if one is given, provides the points and the metrics as memory-mapped columns
+    metricStore = None
+    metricStorePath = self.metricStorePathLineEdit.currentPath
+    if metricStorePath:
+      try:
+        metricStore = MetricStore(metricStorePath)
+      except (IOError, ValueError) as e:
+        slicer.util.errorDisplay("Unable to open the metric store: " + str(e))
+        return
+      if metricStore.numberOfPoints != numberOfPoints:
+        slicer.util.errorDisplay("The metric store has " + str(metricStore.numberOfPoints) + " points, the centerline "
+                                 + str(numberOfPoints) + ". Select the metric store written with this centerline.")
+        return
+    self.pathTrack = self.getCenterlineTrack(centerline, metricStore)
 
     # Find point on centerline closest to the seed point
-    closestPt = self.findClosestPointOnCenterline(seedCoordinates)
-    closestPtID = self.centerlinePts.index(closestPt)
+    closestPtID = self.findClosestPointIdOnCenterline(seedCoordinates)
     # print("closestPt", closestPt)
     # print("closestPtID", closestPtID)
 
-    # Determine the scalar array to display and play audio from
-    vtkMetricArray = centerline.GetPolyData().GetPointData().GetArray(3)
-    activeScalarName = centerline.GetPolyData().GetPointData().GetArrayName(3)
-    if vtkMetricArray is None:
-      vtkMetricArray = centerline.GetPolyData().GetPointData().GetArray('Radius')
-      activeScalarName = 'Radius'
+    # Determine the scalar arrays to display and play audio from, the first difficulty metric by default
+    metricNames = self.pathTrack.metricNames
+    activeScalarName = self.pathTrack.defaultMetricName()
+    self.metricComboBox.blockSignals(True)
+    self.metricComboBox.clear()
+    self.metricComboBox.addItems(metricNames)
+    self.metricComboBox.currentIndex = metricNames.index(activeScalarName) if activeScalarName in metricNames else 0
+    self.metricComboBox.blockSignals(False)
 
     # Display metric array colortable on centerline
-    display = slicer.vtkMRMLModelDisplayNode()
-    slicer.mrmlScene.AddNode( display )
-    display.SetLineWidth(4)
-    self.inputModelNodeSelector.currentNode().SetAndObserveDisplayNodeID( display.GetID() )
-    display.SetActiveScalarName(activeScalarName)
-    if activeScalarName == 'Radius' or activeScalarName == 'GlobalRelativeAngle':
-      display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileHotToColdRainbow.txt')
-    else:
-      display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
-    display.SetScalarVisibility(True)
+    self.metricDisplayNode = slicer.vtkMRMLModelDisplayNode()
+    slicer.mrmlScene.AddNode( self.metricDisplayNode )
+    self.metricDisplayNode.SetLineWidth(4)
+    self.inputModelNodeSelector.currentNode().SetAndObserveDisplayNodeID( self.metricDisplayNode.GetID() )
+    self.metricDisplayNode.SetScalarVisibility(True)
+    self.setSonifiedMetric(self.metricComboBox.currentText)
 
     # If optional bronchus model was included as input, display the model at low opacity
     if self.optionalModelNodeSelector.currentNode() is not None:
       bronchusDisplay = self.optionalModelNodeSelector.currentNode().GetDisplayNode()
       bronchusDisplay.SetOpacity(0.4)
 
-    #global metricArray 
-    self.metricArray = VN.vtk_to_numpy(vtkMetricArray)
-
-    if activeScalarName == 'Radius':
-      self.metricArray = np.array([(11-i) for i in self.metricArray])
-
-    global maxMetric, minMetric
-    #(maxMetric, minMetric) = self.getMaxAndMinMetrics(self.metricArray)
-    (maxMetric, minMetric) = self.getMaxAndMinMetrics()
-    self.originalMetricArray = self.metricArray
-    self.metricArray = np.interp(self.metricArray, (minMetric, maxMetric), (-12,12))
-
     # Update frame slider range
-    self.frameSlider.maximum = centerline.GetPolyData().GetPointData().GetNumberOfTuples()
+    self.frameSlider.maximum = self.pathTrack.numberOfPoints
     # Change slider position to the pt ID of the selected point on the centerline
     self.frameSlider.value = closestPtID
     self.frameSlider.connect('valueChanged(double)', self.frameSliderValueChanged)
@@ -665,11 +694,53 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     # self.sinewave.play()
 
 
-  # def getMaxAndMinMetrics(self, metricArray):
-  def getMaxAndMinMetrics(self):
-    maxMetric = np.max(self.metricArray)
-    minMetric = np.min(self.metricArray)
-    return (maxMetric, minMetric)
+  def onMetricComboBoxChanged(self, index):
+    if index >= 0 and getattr(self, 'metricDisplayNode', None) is not None:
+      self.setSonifiedMetric(self.metricComboBox.currentText)
+
+
+  def setSonifiedMetric(self, name):
+    """Selects the metric to display and play audio from. The values stay where they are (a column of
+    the metric store or the point data array), single values are converted when they are played."""
+    self.metricValues = self.pathTrack.values(name)
+    (minMetric, maxMetric) = self.pathTrack.range(name)
+    self.invertMetric = (name == 'Radius')
+    if self.invertMetric:
+      (minMetric, maxMetric) = (11-maxMetric, 11-minMetric)
+    self.metricRange = (minMetric, maxMetric)
+
+    # Only the centerline has the metric as point data, the store is not shown as colors
+    if self.inputModelNodeSelector.currentNode().GetPolyData().GetPointData().GetArray(name) is not None:
+      self.metricDisplayNode.SetActiveScalarName(name)
+    if name == 'Radius' or name == 'GlobalRelativeAngle':
+      self.metricDisplayNode.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileHotToColdRainbow.txt')
+    else:
+      self.metricDisplayNode.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
+
+    self.updatePathMetrics()
+
+
+  def getOriginalMetricValues(self, indices):
+    # metric at indices of the path track, radius turned into 11 - radius; points without a value (nan in the store) count as 0
+    pointIds = self.pathTrack.pointIds[np.asarray(indices, dtype=np.int64)]
+    values = np.zeros(pointIds.shape)
+    inRange = pointIds < len(self.metricValues)
+    values[inRange] = self.metricValues[pointIds[inRange]]
+    values[np.isnan(values)] = 0.0
+    return 11-values if self.invertMetric else values
+
+
+  def getSonifiedMetricValues(self, indices):
+    # metric at indices of the path track mapped to the pitch range
+    return np.interp(self.getOriginalMetricValues(indices), self.metricRange, (-12,12))
+
+
+  def getOriginalMetricValue(self, index):
+    return float(self.getOriginalMetricValues([index])[0])
+
+
+  def getSonifiedMetricValue(self, index):
+    return float(self.getSonifiedMetricValues([index])[0])
 
 
   # def playSound(self, metricVal):
@@ -681,12 +752,12 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
   def frameSliderValueChanged(self, newValue):
     # print ("frameSliderValueChanged:", newValue)
 
-    newMetricVal = self.metricArray[self.numPtsOnCenterline-int(newValue)]
+    newMetricVal = self.getSonifiedMetricValue(int(newValue))
     # print("newMetricVal: ", newMetricVal)
     # self.playSound(newMetricVal)
     self.sendTextNode(newMetricVal)
 
-    pt = self.centerlinePts[int(newValue)]
+    pt = self.pathTrack.points[int(newValue)]
     # print("pt: ", pt)
     markupsNode = slicer.util.getNode(slicer.modules.markups.logic().GetActiveListID())
     
@@ -721,7 +792,7 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
 
   def flyToNext(self):
     currentPoint = self.frameSlider.value
-    if currentPoint < (self.numPtsOnCenterline-1):
+    if currentPoint < (self.pathTrack.numberOfPoints-1):
       self.frameSlider.value = currentPoint + 1
     else:
       self.timer.stop()
@@ -803,6 +874,7 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     self.transform = model.transform
     self.pathPlaneNormal = model.planeNormal
     self.path = result.path
+    self.updatePathMetrics()
 
     # Enable / Disable flythrough button
     self.endoscopyFlythroughCollapsibleButton.enabled = len(result.path) > 0
@@ -811,6 +883,19 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     fiducialsNode.RemoveAllMarkups()
 
 
+  def updatePathMetrics(self):
+    """Looks up the nearest centerline index, the metric value and the pitch of every endoscopy path
+    point at once, so that flying through only indexes these arrays. Needs the path (Create path)
+    of the centerline; without it the fly-through is silent."""
+    if self.path is None or getattr(self, 'metricValues', None) is None:
+      self.pathCenterlineIds = self.pathOriginalMetrics = self.pathSonifiedMetrics = None
+      return
+    self.pathCenterlineIds = self.findClosestPointIdsOnCenterline(self.path)
+    originalMetrics = self.getOriginalMetricValues(self.pathCenterlineIds)
+    self.pathOriginalMetrics = np.round(originalMetrics, 2)
+    self.pathSonifiedMetrics = np.interp(originalMetrics, self.metricRange, (-12,12))
+
+
   def endoscopyFrameSliderValueChanged(self, newValue):
     #print "frameSliderValueChanged:", newValue
     self.flyTo(newValue)
@@ -831,27 +916,22 @@ class CenterlineSliderWidget(ScriptedLoadableModuleWidget):
     pathPointIndex = int(pathPointIndex)
     cameraPosition = self.path[pathPointIndex]
 
-    # # New: Play audio given the camera position
-    print("Camera position: ", cameraPosition)
-    closestPt = self.findClosestPointOnCenterline(cameraPosition)
-    print("Closest pt index: ", closestPt)
-    closestPtID = self.centerlinePts.index(closestPt)
-    print("Closest pt index: ", closestPtID)
-    newMetricVal = self.metricArray[self.numPtsOnCenterline-int(closestPtID)]
-    print("newMetricVal: ", newMetricVal)
-    # originalMetricVal is the non-interpolated metric to display on the screen
-    originalMetricVal = round(self.originalMetricArray[self.numPtsOnCenterline-int(closestPtID)], 2)
-    print("originalMetricVal: ", originalMetricVal)
-    # self.playSound(newMetricVal)
-    self.sendTextNode(newMetricVal)
-
-    # Print the pt index and metric value in a vtkCornerAnnotation
-    view = slicer.app.layoutManager().threeDWidget(0).threeDView()
-    view.cornerAnnotation().SetText(vtk.vtkCornerAnnotation.UpperRight, "Point ID: " + str(closestPtID) + "\nMetric Value: " + str(originalMetricVal))
-    view.cornerAnnotation().GetTextProperty().SetColor(0,0,0)
-    view.cornerAnnotation().SetMaximumFontSize(15)
-    view.cornerAnnotation().SetMinimumFontSize(15)
-    view.forceRender()
+    # # New: Play audio given the camera position, looked up when the path was created
+    if self.pathCenterlineIds is not None:
+      closestPtID = int(self.pathCenterlineIds[pathPointIndex])
+      newMetricVal = self.pathSonifiedMetrics[pathPointIndex]
+      # originalMetricVal is the non-interpolated metric to display on the screen
+      originalMetricVal = self.pathOriginalMetrics[pathPointIndex]
+      # self.playSound(newMetricVal)
+      self.sendTextNode(newMetricVal)
+
+      # Print the pt index and metric value in a vtkCornerAnnotation
+      view = slicer.app.layoutManager().threeDWidget(0).threeDView()
+      view.cornerAnnotation().SetText(vtk.vtkCornerAnnotation.UpperRight, "Point ID: " + str(closestPtID) + "\nMetric Value: " + str(originalMetricVal))
+      view.cornerAnnotation().GetTextProperty().SetColor(0,0,0)
+      view.cornerAnnotation().SetMaximumFontSize(15)
+      view.cornerAnnotation().SetMinimumFontSize(15)
+      view.forceRender()
 
     wasModified = self.cameraNode.StartModify()
 
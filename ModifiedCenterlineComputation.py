@@ -3,13 +3,24 @@ import os
 import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
-from vtk.util.numpy_support import vtk_to_numpy
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 import logging
 import numpy as np
 
+from BronchusDifficultyLib import StageCache
+from BronchusDifficultyLib.logic import CenterlineComputationLogic
+from BronchusDifficultyLib.decimation import NetworkCostModel
+from BronchusDifficultyLib.pipeline import DifficultyOptions, computeDifficultyMetrics, runCenterlineJob, writeMetricStore, writeMinMax, writeRawData
+from BronchusDifficultyLib.metricstore import metricStoreFileName
+from BronchusDifficultyLib.task import BackgroundTask
+from BronchusDifficultyLib.profiling import StageProfiler
+
 # python includes
 import math
 
+# debug output of the computation, shown when "Verbose output" is checked
+verboseLog = logging.getLogger("BronchusDifficulty")
+
 #
 # Centerline Computation using VMTK based Tools
 #
@@ -40,6 +51,21 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
     # the pointer to the logic
     self.logic = CenterlineComputationLogic()
 
+    # the calibration of the network time budget is kept across sessions
+    self.networkCostFileName = os.path.join(slicer.app.temporaryPath, "BronchusDifficultyNetworkCost.json")
+    self.logic.networkCostModel = NetworkCostModel.load(self.networkCostFileName)
+
+    # prepared model and network of the last run, with the key they were computed for
+    self.previewState = None
+
+    # the computation running on the worker thread and the inputs it was started with
+    self.task = None
+    self.taskJob = None
+
+    # arrival times of the last pathfinding run, to follow the ROI fiducial without recomputing the Voronoi diagram
+    self.retargetState = None
+    self.roiObservation = None
+
     if not parent:
       # after setup, be ready for events
       self.parent.show()
@@ -131,17 +157,81 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
     self.colorByCumulativeIndexCheckbox.toolTip = "Toggle whether or not to overlay a colormap of the cumulative difficulty index onto the centerline."
     inputsFormLayout.addRow("Color by Cumulative Difficulty Index (CDI): ", self.colorByCumulativeIndexCheckbox)
 
-    # Modify range of points used to calculate local curvature
-    self.localCurvatureRangeTextbox = qt.QLineEdit("30")
+    # Resample every centerline branch to a fixed step length
+    self.resamplingStepTextbox = qt.QLineEdit("0.0")
+    self.resamplingStepTextbox.setReadOnly(False)
+    self.resamplingStepTextbox.setFixedWidth(40)
+    self.resamplingStepTextbox.toolTip = "Distance in mm between the centerline points. 0 keeps the points produced by the centerline extraction."
+    inputsFormLayout.addRow("Centerline resampling step (mm):", self.resamplingStepTextbox)
+
+    # Split the centerline targets across worker processes
+    self.centerlineWorkersTextbox = qt.QLineEdit("1")
+    self.centerlineWorkersTextbox.setReadOnly(False)
+    self.centerlineWorkersTextbox.setFixedWidth(40)
+    self.centerlineWorkersTextbox.toolTip = "Number of processes computing the centerlines, each one to a part of the endpoints. 1 computes all centerlines in Slicer."
+    inputsFormLayout.addRow("Centerline worker processes:", self.centerlineWorkersTextbox)
+
+    # Decimate the model for the network extraction to a triangle budget, or to the triangles it handles in a time budget
+    self.decimationTrianglesTextbox = qt.QLineEdit("20000")
+    self.decimationTrianglesTextbox.setReadOnly(False)
+    self.decimationTrianglesTextbox.setFixedWidth(60)
+    self.decimationTrianglesTextbox.toolTip = "Number of triangles the model is decimated to for the network extraction (preview). Smaller models are not decimated."
+    inputsFormLayout.addRow("Network triangle budget:", self.decimationTrianglesTextbox)
+
+    self.decimationTimeBudgetTextbox = qt.QLineEdit("0.0")
+    self.decimationTimeBudgetTextbox.setReadOnly(False)
+    self.decimationTimeBudgetTextbox.setFixedWidth(40)
+    self.decimationTimeBudgetTextbox.toolTip = "Time in seconds the network extraction (preview) should take, estimated from the earlier runs. 0 uses the triangle budget."
+    inputsFormLayout.addRow("Network time budget (s):", self.decimationTimeBudgetTextbox)
+
+    # Keep the intermediate models on disk so that repeated runs on the same model skip to the metrics
+    self.useStageCacheCheckbox = qt.QCheckBox()
+    self.useStageCacheCheckbox.checked = True
+    self.useStageCacheCheckbox.toolTip = "Reuse the prepared model, network and centerlines of earlier runs with the same model, seed and parameters."
+    inputsFormLayout.addRow("Cache intermediate results: ", self.useStageCacheCheckbox)
+
+    # In pathfinding mode, update the path while the ROI fiducial is moved
+    self.followRoiCheckbox = qt.QCheckBox()
+    self.followRoiCheckbox.checked = True
+    self.followRoiCheckbox.toolTip = "After Start in pathfinding mode, recompute the path and its metrics whenever the ROI fiducial is moved."
+    inputsFormLayout.addRow("Follow ROI fiducial: ", self.followRoiCheckbox)
+
+    # In pathfinding mode, compute the centerline on the part of the surface around the route to the ROI only
+    self.cropToRouteCheckbox = qt.QCheckBox()
+    self.cropToRouteCheckbox.checked = True
+    self.cropToRouteCheckbox.toolTip = "In pathfinding mode, crop the model to a tube around the network route from the seed to the ROI before computing the centerline. Not available while the ROI fiducial is followed, the moved ROI may lie outside of the tube."
+    inputsFormLayout.addRow("Crop to route to ROI: ", self.cropToRouteCheckbox)
+    # following the ROI traces paths through the whole airway, which the cropped model does not have
+    self.followRoiCheckbox.connect('toggled(bool)', self.onFollowRoiToggled)
+    self.onFollowRoiToggled(self.followRoiCheckbox.checked)
+
+    # Record the time and memory of every stage, written to profile.json and profile.trace.json in the output directory
+    self.profileCheckbox = qt.QCheckBox()
+    self.profileCheckbox.toolTip = "Record wall time, CPU time, peak memory and point counts of every stage. They are logged and written to the output directory (profile.json, and profile.trace.json for chrome://tracing)."
+    inputsFormLayout.addRow("Profile stages: ", self.profileCheckbox)
+
+    self.verboseCheckbox = qt.QCheckBox()
+    self.verboseCheckbox.toolTip = "Log the intermediate values of the computation."
+    inputsFormLayout.addRow("Verbose output: ", self.verboseCheckbox)
+
+    # Modify range used to calculate local curvature
+    self.localCurvatureRangeTextbox = qt.QLineEdit("3.0")
     self.localCurvatureRangeTextbox.setReadOnly(False)
     self.localCurvatureRangeTextbox.setFixedWidth(40)
-    inputsFormLayout.addRow("# points for LC calculation: +/-", self.localCurvatureRangeTextbox)
+    inputsFormLayout.addRow("LC calculation range (mm): +/-", self.localCurvatureRangeTextbox)
 
-    # Modify range of points used to calculate rate of curvature
-    self.curvatureRateRangeTextbox = qt.QLineEdit("200")
+    # Additional local curvature ranges, computed in the same pass for comparison
+    self.localCurvatureScalesTextbox = qt.QLineEdit("")
+    self.localCurvatureScalesTextbox.setReadOnly(False)
+    self.localCurvatureScalesTextbox.setFixedWidth(120)
+    self.localCurvatureScalesTextbox.toolTip = "Comma separated list of extra +/- ranges in mm (e.g. 1,2,5). Each one adds a \"Local Curvature (+/-N mm)\" array to the centerline."
+    inputsFormLayout.addRow("Compare LC at ranges (mm): +/-", self.localCurvatureScalesTextbox)
+
+    # Modify range used to calculate rate of curvature
+    self.curvatureRateRangeTextbox = qt.QLineEdit("20.0")
     self.curvatureRateRangeTextbox.setReadOnly(False)
     self.curvatureRateRangeTextbox.setFixedWidth(40)
-    inputsFormLayout.addRow("# points for RoC calculation: +/-", self.curvatureRateRangeTextbox)
+    inputsFormLayout.addRow("RoC calculation range (mm): +/-", self.curvatureRateRangeTextbox)
 
     # # Allow the user to input scalar multiplier values for the threshold, default to 1.0 for all of them
     # textLine = qt.QLabel()
@@ -322,6 +412,24 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
     self.previewButton.connect("clicked()", self.onPreviewButtonClicked)
     self.startButton.connect("clicked()", self.onStartButtonClicked)
 
+    # The computation runs on a worker thread, its progress is shown here and it can be cancelled between its stages
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.visible = False
+    self.layout.addWidget(self.progressBar)
+    self.cancelButton = qt.QPushButton("Cancel")
+    self.cancelButton.toolTip = "Stop the computation after its current stage."
+    self.cancelButton.enabled = False
+    self.layout.addWidget(self.cancelButton)
+    self.cancelButton.connect("clicked()", self.onCancelButtonClicked)
+    self.taskTimer = qt.QTimer()
+    self.taskTimer.setInterval(100)
+    self.taskTimer.connect("timeout()", self.onTaskTimer)
+    # the path to a dragged ROI is traced at most every 100 ms, to its latest position
+    self.roiTimer = qt.QTimer()
+    self.roiTimer.setSingleShot(True)
+    self.roiTimer.setInterval(100)
+    self.roiTimer.connect("timeout()", self.onRoiTimer)
+
     self.inputModelNodeSelector.setMRMLScene(slicer.mrmlScene)
     self.seedFiducialsNodeSelector.setMRMLScene(slicer.mrmlScene)
     self.roiFiducialsNodeSelector.setMRMLScene(slicer.mrmlScene)
@@ -336,36 +444,117 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
   def onMRMLSceneChanged(self):
     logging.debug("onMRMLSceneChanged")
 
+  def cleanup(self):
+    self.removeRoiObservation()
+    if self.task is not None:
+      self.task.cancel()
+      self.taskTimer.stop()
+
   def onOutputDirectoryClicked(self):
     fileDialog = qt.QFileDialog()
     self.outputDirectory = fileDialog.getExistingDirectory( None, 'Select Output Directory', self.outputDirectory )
 
   def onStartButtonClicked(self):
-    qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
     # this is no preview
     self.start(False)
-    qt.QApplication.restoreOverrideCursor()
 
   def onPreviewButtonClicked(self):
-      # calculate the preview
+      # calculate the preview, the startButton is activated once it is done
       self.start(True)
-      # activate startButton
-      self.startButton.enabled = True
-
-  def findClosestPointOnCenterline(self, point, allPts):
-    # given a point in [x, y, z] format and a numpy array of all points on the centerline, return the pt on the centerline that is closest to that point
-    min_dist = float("inf")
-    current_point = allPts[0]
-    # current_point = np.array([float(s) for s in (str( allPts[0] ).replace(' ','')[1:-1]).split(',')])
-    print("current pt: ", current_point)
-    for current_point in allPts:
-      dist = np.linalg.norm(point-current_point)
-      if dist < min_dist: new_closest = current_point
-    return current_point
+
+  def addPlaneMarker(self, curr_pt, normal_vector):
+    # create a plane markup through curr_pt with the given normal vector
+    verboseLog.debug("New plane rotation reference plane")
+
+    d = -np.dot(curr_pt, normal_vector)
+
+    # Create 2 new points on the plane based on the coordinates of the original point
+    plane_pt_1z = (-normal_vector[0]*(curr_pt[0] + 50) - normal_vector[1]*curr_pt[1])*1./normal_vector[2]
+    plane_pt1 = np.array([curr_pt[0]+50, curr_pt[1], plane_pt_1z])
+
+    plane_pt_2z = (-normal_vector[0]*(curr_pt[0] - 50) - normal_vector[1]*curr_pt[1])*1./normal_vector[2]
+    plane_pt2 = np.array([curr_pt[0]-50, curr_pt[1], plane_pt_2z])
+
+    planeModelNode = slicer.mrmlScene.CreateNodeByClass("vtkMRMLMarkupsPlaneNode")
+    planeModelNode.UnRegister(None)
+    planeModelNode.SetOrigin(curr_pt)
+
+    plane_pt1_vtk = vtk.vtkVector3d()
+    plane_pt1_vtk.SetX(plane_pt1[0])
+    plane_pt1_vtk.SetY(plane_pt1[1])
+    plane_pt1_vtk.SetZ(plane_pt1[2])
+
+    plane_pt2_vtk = vtk.vtkVector3d()
+    plane_pt2_vtk.SetX(plane_pt2[0])
+    plane_pt2_vtk.SetY(plane_pt2[1])
+    plane_pt2_vtk.SetZ(plane_pt2[2])
+
+
+    ctrlpt_1 = planeModelNode.AddControlPoint(plane_pt1_vtk)
+    ctrlpt_2 = planeModelNode.AddControlPoint(plane_pt2_vtk)
+
+    #planeModelNode.SetHideFromEditors(False)
+    #slicer.mrmlScene.AddNode(planeModelNode)
+
+    verboseLog.debug("curr_pt: %s, normal vector: %s, plane_pt1: %s, plane_pt2: %s", curr_pt, normal_vector, plane_pt1, plane_pt2)
+
+    return planeModelNode
+
+  def getPreviewStateKey(self, modelNode, seedsNode, seedCoordinates, decimation):
+    # everything the prepared model and the network depend on: the input model and its content, the seed and the stage parameters
+    # (with a time budget the decimation parameters hold the triangle target the network cost model resolves it to)
+    stageParameters = [self.logic.stageParameters(stage) for stage in ('prepareModel', 'openSurfaceAtPoint', 'extractNetwork')]
+    stageParameters.append(self.logic.stageParameters('decimateSurface', **decimation))
+    return (modelNode.GetID(), modelNode.GetPolyData().GetMTime(), seedsNode.GetID(), tuple(seedCoordinates), repr(stageParameters))
+
+  def observeRoiNode(self, roiNode):
+    self.removeRoiObservation()
+    tag = roiNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onRoiPointModified)
+    self.roiObservation = (roiNode, tag)
+
+  def onFollowRoiToggled(self, checked):
+    self.cropToRouteCheckbox.enabled = not checked
+
+  def removeRoiObservation(self):
+    self.roiTimer.stop()
+    if self.roiObservation is not None:
+      roiNode, tag = self.roiObservation
+      roiNode.RemoveObserver(tag)
+      self.roiObservation = None
+
+  def onRoiPointModified(self, caller, event):
+    # a drag sends many events, they are coalesced into one update with the position when the timer fires
+    if self.retargetState is not None and not self.roiTimer.isActive():
+      self.roiTimer.start()
+
+  def onRoiTimer(self):
+    # trace the path to the moved ROI through the arrival times of the last run and recompute its metrics
+    if self.retargetState is None or self.roiObservation is None:
+      return
+    roiNode = self.roiObservation[0]
+    if roiNode.GetNumberOfFiducials() == 0:
+      return
+    roiCoordinates = [0, 0, 0]
+    roiNode.GetNthFiducialPosition(0, roiCoordinates)
+
+    centerline = self.retargetState['retargeter'].centerline(roiCoordinates)
+    if centerline.GetNumberOfPoints() < 2:
+      return
+    difficulty = computeDifficultyMetrics(centerline, self.retargetState['options'], self.retargetState['metrics'])
+    difficulty.addToPolyData(centerline, self.retargetState['metrics'])
+    self.retargetState['outputModelNode'].SetAndObservePolyData(centerline)
 
   def start(self, preview=False):
     logging.debug("Starting Centerline Computation..")
 
+    if self.task is not None:
+      logging.error("The centerline computation is already running")
+      return False
+
+    # the arrival times of an earlier pathfinding run belong to its model and seed
+    self.removeRoiObservation()
+    self.retargetState = None
+
     # Determine scalar multiplier values from user input
     # radiusScalar = float(self.radiusScalarTextbox.text)
     # localCurvatureScalar = float(self.localCurvatureScalarTextbox.text)
@@ -374,8 +563,12 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
 
     outputFilename = self.outputFilenameTextbox.text
     minMaxOutputFilename = self.minMaxOutputFilenameTextbox.text
-    localCurveRangeVal = int(self.localCurvatureRangeTextbox.text)
-    curvatureRateRangeVal = int(self.curvatureRateRangeTextbox.text)
+    resamplingStepLength = float(self.resamplingStepTextbox.text)
+    self.logic.numberOfWorkers = max(1, int(self.centerlineWorkersTextbox.text))
+    localCurveRangeVal = float(self.localCurvatureRangeTextbox.text)
+    curvatureRateRangeVal = float(self.curvatureRateRangeTextbox.text)
+    localCurveScaleVals = [float(scale) for scale in self.localCurvatureScalesTextbox.text.split(',') if scale.strip()]
+    decimation = {'targetTriangles': int(self.decimationTrianglesTextbox.text), 'timeBudget': float(self.decimationTimeBudgetTextbox.text)}
 
     # first we need the nodes
     currentModelNode = self.inputModelNodeSelector.currentNode()
@@ -414,699 +607,215 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       currentEndPointsMarkupsNode = slicer.mrmlScene.GetNodeByID(slicer.modules.markups.logic().AddNewFiducialNode("Centerline endpoints"))
       self.outputEndPointsNodeSelector.setCurrentNode(currentEndPointsMarkupsNode)
 
-    # the output models
-    preparedModel = vtk.vtkPolyData()
-    print("preparedModel: ", preparedModel)
-    model = vtk.vtkPolyData()
-    network = vtk.vtkPolyData()
-    voronoi = vtk.vtkPolyData()
-    if pathfindingMode:
-      pathfinding_network = vtk.vtkPolyData()
-      pathfinding_voronoi = vtk.vtkPolyData()
-
     currentCoordinatesRAS = [0, 0, 0]
 
     # grab the current coordinates
     currentSeedsNode.GetNthFiducialPosition(0,currentCoordinatesRAS)
 
-    # prepare the model
-    preparedModel.DeepCopy(self.logic.prepareModel(currentModelNode.GetPolyData()))
-
-    # decimate the model (only for network extraction)
-    model.DeepCopy(self.logic.decimateSurface(preparedModel))
-
-    # open the model at the seed (only for network extraction)
-    model.DeepCopy(self.logic.openSurfaceAtPoint(model, currentCoordinatesRAS))
-
-    # extract Network
-    network.DeepCopy(self.logic.extractNetwork(model))
+    currentCoordinatesROI = None
+    if pathfindingMode:
+      # Only compute the centerline from the seed to the indicated ROI point
+      currentCoordinatesROI = [0, 0, 0]
+      currentRoiNode.GetNthFiducialPosition(0,currentCoordinatesROI)
+      verboseLog.debug("ROI: %s", currentCoordinatesROI)
+
+    # record the time and memory of every stage of this run
+    self.logic.profiler = StageProfiler() if self.profileCheckbox.isChecked() else None
+    verboseLog.setLevel(logging.DEBUG if self.verboseCheckbox.isChecked() else logging.INFO)
+
+    if self.useStageCacheCheckbox.isChecked():
+      if self.logic.stageCache is None:
+        self.logic.stageCache = StageCache(os.path.join(slicer.app.temporaryPath, "BronchusDifficultyStageCache"))
+    else:
+      self.logic.stageCache = None
+
+    # Only the metrics needed for the selected colormaps are computed, the total and cumulative indices need all of them
+    requestedMetrics = []
+    if self.colorByLocalCurvatureCheckbox.isChecked(): requestedMetrics.append("Local Curvature")
+    if self.colorByGlobalRelativeAngleCheckbox.isChecked(): requestedMetrics.append("GlobalRelativeAngle")
+    if self.colorByPlaneRotationCheckbox.isChecked(): requestedMetrics.append("PlaneRotation")
+    if self.colorByCurvatureRateCheckbox.isChecked(): requestedMetrics.append("Curvature Rate")
+    if self.colorByTotalIndexCheckbox.isChecked(): requestedMetrics.append("Total Difficulty Index")
+    if self.colorByCumulativeIndexCheckbox.isChecked(): requestedMetrics.append("Cumulative Difficulty Index")
+    # the colormaps selected now: the checkboxes can change while the worker runs, finishStart only uses this copy
+    colorBy = (["Radius"] if self.colorByRadiusCheckbox.isChecked() else []) + requestedMetrics
+
+    difficultyOptions = DifficultyOptions(resamplingStepLength=resamplingStepLength, localCurvatureRange=localCurveRangeVal,
+                                          localCurvatureScales=localCurveScaleVals, curvatureRateRange=curvatureRateRangeVal)
+
+    # everything the computation needs is read from the GUI and the scene here, the worker thread does not touch either
+    job = {'preview': preview, 'pathfindingMode': pathfindingMode,
+           'inputPolyData': currentModelNode.GetPolyData(), 'modelNode': currentModelNode, 'roiNode': currentRoiNode,
+           'outputModelNode': currentOutputModelNode, 'endPointsMarkupsNode': currentEndPointsMarkupsNode, 'voronoiModelNode': currentVoronoiModelNode,
+           'seedCoordinates': currentCoordinatesRAS, 'roiCoordinates': currentCoordinatesROI,
+           'previewStateKey': self.getPreviewStateKey(currentModelNode, currentSeedsNode, currentCoordinatesRAS, decimation), 'previewState': self.previewState,
+           'cropToRoute': self.cropToRouteCheckbox.isChecked() and not self.followRoiCheckbox.isChecked(), 'followRoi': self.followRoiCheckbox.isChecked(),
+           'resamplingStepLength': resamplingStepLength, 'decimation': decimation, 'difficultyOptions': difficultyOptions, 'requestedMetrics': requestedMetrics, 'colorBy': colorBy,
+           'outputFilename': outputFilename, 'minMaxOutputFilename': minMaxOutputFilename}
+
+    self.task = BackgroundTask(lambda task: self.computeStart(job, task))
+    self.taskJob = job
+    self.logic.progressObserver = self.task.vtkProgressObserver
+    self.setTaskRunning(True)
+    self.task.start()
+    self.taskTimer.start()
 
-    #
-    #
-    # not preview mode: real computation!
-
-    # # Computation of the centerline path between the start point and the ROI, if in pathfindingMode
-    # if not preview and pathfindingMode:
-    #   # clip surface at endpoints identified by the network extraction
-    #   tupel = self.logic.clipSurfaceAtEndPoints(network, currentModelNode.GetPolyData())
-    #   clippedSurface = tupel[0]
-
-    #   # Write over endpoints array with ONLY the starting point and the indicated ROI point
-    #   # Grab the coordinates of the ROI
-    #   currentCoordinatesROI = [0, 0, 0]
-    #   currentRoiNode.GetNthFiducialPosition(0,currentCoordinatesROI)
-    #   print (currentCoordinatesROI)
-    #   endpoints = vtk.vtkPoints()
-    #   endpoints.InsertPoint(0, currentCoordinatesRAS) # Seed point
-    #   endpoints.InsertPoint(1, currentCoordinatesROI) # Endpoint (ROIs)
-    #   print(endpoints)
-
-    #   # now find the one endpoint which is closest to the seed and use it as the source point for centerline computation
-    #   # all other endpoints are the target points
-    #   sourcePoint = [0, 0, 0]
-    #   distancesToSeed = []
-    #   targetPoints = []
-
-    #   # we now need to loop through the endpoints two times
-    #   # first loop is to detect the endpoint resulting in the tiny hole we poked in the surface
-    #   # this is very close to our seed but not the correct sourcePoint
-    #   for i in range(endpoints.GetNumberOfPoints()):
-    #     currentPoint = endpoints.GetPoint(i)
-    #     # get the euclidean distance
-    #     currentDistanceToSeed = math.sqrt(math.pow((currentPoint[0] - currentCoordinatesRAS[0]), 2) +
-    #                                        math.pow((currentPoint[1] - currentCoordinatesRAS[1]), 2) +
-    #                                        math.pow((currentPoint[2] - currentCoordinatesRAS[2]), 2))
-
-    #     targetPoints.append(currentPoint)
-    #     distancesToSeed.append(currentDistanceToSeed)
-
-      
-    #   # now find the sourcepoint
-    #   sourcePointIndex = distancesToSeed.index(min(distancesToSeed))
-    #   # .. and remove it after saving it as the sourcePoint
-    #   sourcePoint = targetPoints[sourcePointIndex]
-    #   distancesToSeed.pop(sourcePointIndex)
-    #   targetPoints.pop(sourcePointIndex)
-
-    #   # again, at this point we have a) the sourcePoint and b) a list of real targetPoints
-    #   # now create the sourceIdList and targetIdList for the actual centerline computation
-    #   sourceIdList = vtk.vtkIdList()
-    #   targetIdList = vtk.vtkIdList()
-
-    #   pointLocator = vtk.vtkPointLocator()
-    #   pointLocator.SetDataSet(preparedModel)
-    #   pointLocator.BuildLocator()
-
-    #   # locate the source on the surface
-    #   sourceId = pointLocator.FindClosestPoint(sourcePoint)
-    #   sourceIdList.InsertNextId(sourceId)
-
-    #   currentEndPointsMarkupsNode.GetDisplayNode().SetTextScale(0)
-    #   currentEndPointsMarkupsNode.RemoveAllMarkups()
-    #   currentEndPointsMarkupsNode.AddFiducialFromArray(sourcePoint)
-
-    #   # Calculate centroid of the model 
-    #   from vtk.util.numpy_support import vtk_to_numpy
-    #   centroid = np.average(vtk_to_numpy(preparedModel.GetPoints().GetData()), axis=0)
-
-    #   # locate the endpoints on the surface
-    #   for p in targetPoints:
-    #     # fid = currentEndPointsMarkupsNode.AddFiducialFromArray(p)
-    #     # currentEndPointsMarkupsNode.SetNthFiducialSelected(fid,False)
-    #     # id = pointLocator.FindClosestPoint(p)
-    #     # targetIdList.InsertNextId(id)
-
-    #     # Calculate vector of each endpoint to the centroid
-    #     pointVector = centroid - p
-    #     unitVector = pointVector / np.linalg.norm(pointVector)
-    #     pNew = p + unitVector
-
-    #     fid = currentEndPointsMarkupsNode.AddFiducialFromArray(pNew)
-    #     currentEndPointsMarkupsNode.SetNthFiducialSelected(fid,False)
-    #     id = pointLocator.FindClosestPoint(pNew)
-    #     targetIdList.InsertNextId(id)
-
-    #   pathfinding_tupel = self.logic.computeCenterlines(preparedModel, sourceIdList, targetIdList)
-    #   pathfinding_network.DeepCopy(pathfinding_tupel[0])
-    #   pathfinding_voronoi.DeepCopy(pathfinding_tupel[1])
-
-    #   pathfinding_pts = vtk_to_numpy(pathfinding_network.GetPoints().GetData())
+    return True
 
+  def setTaskRunning(self, running):
+    if running:
+      self.startButtonWasEnabled = self.startButton.enabled
+    self.previewButton.enabled = not running
+    self.startButton.enabled = not running and self.startButtonWasEnabled
+    self.cancelButton.enabled = running
+    self.progressBar.visible = running
+    self.progressBar.value = 0
+
+  def onCancelButtonClicked(self):
+    if self.task is not None:
+      # the worker stops at the beginning of its next stage
+      self.task.cancel()
+      self.progressBar.format = "Cancelling..."
+
+  def onTaskTimer(self):
+    # forward the reports of the worker thread, the scene is only updated here on the main thread
+    for report in self.task.poll():
+      if report[0] == 'progress':
+        stage, fraction = report[1], report[2]
+        self.progressBar.format = stage + " %p%"
+        self.progressBar.value = int(100 * fraction)
+        continue
+
+      self.taskTimer.stop()
+      self.logic.progressObserver = None
+      job = self.taskJob
+      self.task = None
+      self.taskJob = None
+      self.setTaskRunning(False)
+
+      if report[0] == 'done':
+        self.logic.networkCostModel.save(self.networkCostFileName)
+        self.finishStart(job, report[1])
+        if job['preview']:
+          # activate startButton
+          self.startButton.enabled = True
+      elif report[0] == 'cancelled':
+        logging.info("Centerline computation cancelled")
+      else:
+        logging.error("Centerline computation failed:\n" + report[2])
+      return
+
+  def computeStart(self, job, task):
+    # runs on the worker thread: no access to the GUI or the scene, all inputs are in job
+    # returns the results the scene is updated with in finishStart
+    return runCenterlineJob(self.logic, job, task)
+
+  def finishStart(self, job, result):
+    # runs on the main thread once computeStart is done: puts the results into the scene
+    preview = job['preview']
+    pathfindingMode = job['pathfindingMode']
+    currentModelNode = job['modelNode']
+    currentRoiNode = job['roiNode']
+    currentOutputModelNode = job['outputModelNode']
+    currentEndPointsMarkupsNode = job['endPointsMarkupsNode']
+    currentVoronoiModelNode = job['voronoiModelNode']
+    outputFilename = job['outputFilename']
+    minMaxOutputFilename = job['minMaxOutputFilename']
+    colorBy = job['colorBy']
+    network = result['network']
+    voronoi = result['voronoi']
+
+    if 'previewState' in result:
+      self.previewState = result['previewState']
 
     if not preview:
-      # here we start the actual centerline computation which is mathematically more robust and accurate but takes longer than the network extraction
-
-      # clip surface at endpoints identified by the network extraction
-      tupel = self.logic.clipSurfaceAtEndPoints(network, currentModelNode.GetPolyData())
-      clippedSurface = tupel[0]
-      endpoints = tupel[1]
-
-      if pathfindingMode:
-        # Write over endpoints array with ONLY the starting point and the indicated ROI point
-        # Grab the coordinates of the ROI
-        currentCoordinatesROI = [0, 0, 0]
-        currentRoiNode.GetNthFiducialPosition(0,currentCoordinatesROI)
-        print (currentCoordinatesROI)
-        endpoints = vtk.vtkPoints()
-        endpoints.InsertPoint(0, currentCoordinatesRAS) # Seed point
-        endpoints.InsertPoint(1, currentCoordinatesROI) # Endpoint (ROIs)
-        print(endpoints)
-
-      # now find the one endpoint which is closest to the seed and use it as the source point for centerline computation
-      # all other endpoints are the target points
-      sourcePoint = [0, 0, 0]
-      distancesToSeed = []
-      targetPoints = []
-
-      # we now need to loop through the endpoints two times
-      # first loop is to detect the endpoint resulting in the tiny hole we poked in the surface
-      # this is very close to our seed but not the correct sourcePoint
-      for i in range(endpoints.GetNumberOfPoints()):
-        currentPoint = endpoints.GetPoint(i)
-        # get the euclidean distance
-        currentDistanceToSeed = math.sqrt(math.pow((currentPoint[0] - currentCoordinatesRAS[0]), 2) +
-                                           math.pow((currentPoint[1] - currentCoordinatesRAS[1]), 2) +
-                                           math.pow((currentPoint[2] - currentCoordinatesRAS[2]), 2))
-
-        targetPoints.append(currentPoint)
-        distancesToSeed.append(currentDistanceToSeed)
-
-      # now we have a list of distances with the corresponding points
-      # the index with the most minimal distance is the holePoint, we want to ignore it
-      # the index with the second minimal distance is the point closest to the seed, we want to set it as sourcepoint
-      # all other points are the targetpoints
-      
-   #    # get the index of the holePoint, which we want to remove from our endPoints
-   #    holePointIndex = distancesToSeed.index(min(distancesToSeed))
-   #    # .. and remove it
-      
-      # # Sometimes not skipping the first point is neccessary for the start point to be correct
-   #    if self.removeFirstPointCheckbox.isChecked():
-   #      distancesToSeed.pop(holePointIndex)
-   #      targetPoints.pop(holePointIndex)
-      
-      # now find the sourcepoint
-      sourcePointIndex = distancesToSeed.index(min(distancesToSeed))
-      # .. and remove it after saving it as the sourcePoint
-      sourcePoint = targetPoints[sourcePointIndex]
-      distancesToSeed.pop(sourcePointIndex)
-      targetPoints.pop(sourcePointIndex)
-
-      # again, at this point we have a) the sourcePoint and b) a list of real targetPoints
-      # now create the sourceIdList and targetIdList for the actual centerline computation
-      sourceIdList = vtk.vtkIdList()
-      targetIdList = vtk.vtkIdList()
-      print("SourceIDList: ", sourceIdList)
-      print("TargetIDList: ", targetIdList)
-
-      pointLocator = vtk.vtkPointLocator()
-      pointLocator.SetDataSet(preparedModel)
-      pointLocator.BuildLocator()
-
-      # locate the source on the surface
-      sourceId = pointLocator.FindClosestPoint(sourcePoint)
-      sourceIdList.InsertNextId(sourceId)
-
       currentEndPointsMarkupsNode.GetDisplayNode().SetTextScale(0)
       currentEndPointsMarkupsNode.RemoveAllMarkups()
-      currentEndPointsMarkupsNode.AddFiducialFromArray(sourcePoint)
-
-      # Calculate centroid of the model 
-      from vtk.util.numpy_support import vtk_to_numpy
-      centroid = np.average(vtk_to_numpy(preparedModel.GetPoints().GetData()), axis=0)
-
-      # locate the endpoints on the surface
-      for p in targetPoints:
-        # fid = currentEndPointsMarkupsNode.AddFiducialFromArray(p)
-        # currentEndPointsMarkupsNode.SetNthFiducialSelected(fid,False)
-        # id = pointLocator.FindClosestPoint(p)
-        # targetIdList.InsertNextId(id)
-
-        # Calculate vector of each endpoint to the centroid
-        pointVector = centroid - p
-        unitVector = pointVector / np.linalg.norm(pointVector)
-        pNew = p + unitVector
+      currentEndPointsMarkupsNode.AddFiducialFromArray(result['sourcePoint'])
 
+      for pNew in result['targetPoints']:
         fid = currentEndPointsMarkupsNode.AddFiducialFromArray(pNew)
         currentEndPointsMarkupsNode.SetNthFiducialSelected(fid,False)
-        id = pointLocator.FindClosestPoint(pNew)
-        targetIdList.InsertNextId(id)
-
-      tupel = self.logic.computeCenterlines(preparedModel, sourceIdList, targetIdList)
-      print (tupel)
-      network.DeepCopy(tupel[0])
-      print (network)
-      voronoi.DeepCopy(tupel[1])
-      
-      # NEW - debugging
-      allPts = vtk_to_numpy(network.GetPoints().GetData())
-      print("allPts: ", allPts)
-      print("num allPts: ", len(allPts))
-
-      # test findClosestPointOnCenterline function:
-      test_point = np.array([0,0,0])
-      closestpt = self.findClosestPointOnCenterline(test_point, allPts)
-      print("THE CLOSEST PT IS: ", closestpt)
-
-      # Get the list of radius for all points
-      # The list is a concatenation of all cell points
-      j = 0
-      point_data = network.GetPointData()
-      radius_array = point_data.GetArray(0)
-
-      # Convert point_data to numpy array
-      network_array = vtk_to_numpy(network.GetPoints().GetData())
-
-      # Generate local curvature array
-      localcurvature_array = vtk.vtkDoubleArray()
-      localcurvature_array.SetName("Local Curvature")
-      localcurvature_array.SetNumberOfValues(radius_array.GetMaxId())
-      print ("radius array Max id: ", radius_array.GetMaxId())
-
-      # Generate global relative angle array
-      globalrelativeangle_array = vtk.vtkDoubleArray()
-      globalrelativeangle_array.SetName("GlobalRelativeAngle")
-      globalrelativeangle_array.SetNumberOfValues(radius_array.GetMaxId())
-
-      # Generate plane rotation array
-      planerotation_array = vtk.vtkDoubleArray()
-      planerotation_array.SetName("PlaneRotation")
-      planerotation_array.SetNumberOfValues(radius_array.GetMaxId())
-
-      # Generate curvature rate array
-      curvaturerate_array = vtk.vtkDoubleArray()
-      curvaturerate_array.SetName("Curvature Rate")
-      curvaturerate_array.SetNumberOfValues(radius_array.GetMaxId())
-
-      # Calculate trachea reference vector (for GlobalRelativeAngle and PlaneRotation calculations)
-      trachea_cell = network.GetCell(0)
-      trachea_cell_ids = trachea_cell.GetPointIds()
-      trachea_cell_points = trachea_cell.GetPoints()
-      num_pts = trachea_cell.GetNumberOfPoints()
-      print("num_pts in trachea_cell: ", num_pts)
-      trachea_start = np.array([float(s) for s in (str( trachea_cell_points.GetPoint(400) ).replace(' ','')[1:-1]).split(',')])
-      # trachea_end = np.array([float(s) for s in (str( trachea_cell_points.GetPoint(num_pts-20) ).replace(' ','')[1:-1]).split(',')])
-      trachea_end = np.array([float(s) for s in (str( trachea_cell_points.GetPoint(500) ).replace(' ','')[1:-1]).split(',')])
-      trachea_vector = (trachea_end - trachea_start)/np.linalg.norm(trachea_end - trachea_start)
-      print ("trachea_vector: ", trachea_vector)
-
-      # Determine the initial reference vector for PlaneRotation calculations
-      trachea_cell_ids = trachea_cell.GetPointIds()
-      trachea_cell_points = trachea_cell.GetPoints()
-      num_pts = trachea_cell.GetNumberOfPoints()
-      reference_start = np.array([float(s) for s in (str( trachea_cell_points.GetPoint(600) ).replace(' ','')[1:-1]).split(',')])
-      reference_end = np.array([float(s) for s in (str( trachea_cell_points.GetPoint(700) ).replace(' ','')[1:-1]).split(',')])
-      reference_vector = (reference_end - reference_start)/np.linalg.norm(reference_end - reference_start)
-      print("reference vector: ", reference_vector)
-      # before: 600-800
-
-      newPlane = False
+
+      difficulty = result['difficulty']
+
+      if 'retargeter' in result:
+        self.retargetState = {'retargeter': result['retargeter'], 'outputModelNode': currentOutputModelNode,
+                              'options': job['difficultyOptions'], 'metrics': job['requestedMetrics']}
+        self.observeRoiNode(currentRoiNode)
+
+      networkView = difficulty.view
+      metricEngine = difficulty.engine
+      verboseLog.debug("num allPts: %d", networkView.numberOfPoints)
+      verboseLog.debug("point spacing (mm): %s", difficulty.arcLengthIndex.spacing)
+      verboseLog.debug("airway tree branches: %d", difficulty.tree.numberOfBranches)
+      verboseLog.debug("trachea_vector: %s", difficulty.tracheaVector)
+      verboseLog.debug("reference vector: %s", difficulty.referenceVector)
+
+      # Insert fiducial point where radius first equals the radius of the bronchoscope to indicate the limit of the bronchoscope's path
+      if difficulty.radiusLimitPoint is not None:
+        scene = slicer.mrmlScene
+        radiusFiducial = scene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", scene.GenerateUniqueName("Bronchoscope Limit"))
+        radiusFiducial.CreateDefaultDisplayNodes()
+        radiusFiducial.GetDisplayNode().SetSelectedColor(1,0,0)  # red
+        radiusFiducial.GetDisplayNode().SetSliceProjection(True)
+        radiusFiducial.GetDisplayNode().SetGlyphScale(1.2)
+        # radiusFiducial.AddControlPoint(vtk.vtkVector3d(0,0,0)," ")  # do not show any visible label
+        radiusFiducial.AddControlPoint(vtk.vtkVector3d(difficulty.radiusLimitPoint),"Bronchoscope exceeds bronchus radius")  # do not show any visible label
+        radiusFiducial.SetNthControlPointLocked(0, True)
+
+      # Add each plane rotation reference plane to the scene as a model
+      if "PlaneRotation" in colorBy:
+        for curr_pt, normal_vector in difficulty.planes:
+          self.addPlaneMarker(curr_pt, normal_vector)
 
       # Track min and max values of each metric
-      min_radius = float("inf")
-      max_radius = 0.0
-      min_localcurv = float("inf")
-      max_localcurv = 0.0
-      min_globalangle = float("inf")
-      max_globalangle = 0.0
-      min_curvrate = float("inf")
-      max_curvrate = 0.0
-      min_planerotation = float("inf")
-      max_planerotation = 0.0
-
-      for i in range(radius_array.GetMaxId()):
-        curr = radius_array.GetValue(i)
-        if curr > max_radius: max_radius = curr
-        elif curr < min_radius: min_radius = curr
-      print ("Min radius: ", min_radius)
-      print ("Max radius: ", max_radius)
-
-      # For curvature rate calculations
-      highest = 0.0
-      curvature_rate = 0.0
-      saved_curvature_rate = 0.0
-
-      # For plane rotation calculations
-      threshold_pass_count = 0
-      firstPlane = True
-
-      # To remove points with radius smaller than the bronchscope radius
-      # bronchoscope_radius = 0.3
-      bronchoscope_radius = 0.0
-      setRadiusLimitFiducial = True
-      scene = slicer.mrmlScene
-
-      pointIds = vtk.vtkIdList()
-      network.GetLines().GetCell(0, pointIds)
-      print(pointIds)
-
-      for i in range( network.GetNumberOfCells() ):
-        # Iterate through each cell
-        cell = network.GetCell(i)
-        cell_ids = cell.GetPointIds()
-        cell_points = cell.GetPoints()
-    
-        if cell.GetNumberOfPoints() > 100:
-          for j in range( cell.GetNumberOfPoints() ):
-            pt_id = cell_ids.GetId(j)
-            pt_r = radius_array.GetValue( pt_id )
-            pt_coordinates = network.GetPoint( pt_id )
-
-            # Insert fiducial point where radius first equals the radius of the bronchoscope to indicate the limit of the bronchoscope's path
-            if pt_r < 4.0 and setRadiusLimitFiducial and pt_id > 100:
-              radiusFiducial = scene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode", scene.GenerateUniqueName("Bronchoscope Limit"))
-              radiusFiducial.CreateDefaultDisplayNodes()
-              radiusFiducial.GetDisplayNode().SetSelectedColor(1,0,0)  # red
-              radiusFiducial.GetDisplayNode().SetSliceProjection(True)
-              radiusFiducial.GetDisplayNode().SetGlyphScale(1.2)
-              # radiusFiducial.AddControlPoint(vtk.vtkVector3d(0,0,0)," ")  # do not show any visible label
-              radiusFiducial.AddControlPoint(vtk.vtkVector3d(pt_coordinates),"Bronchoscope exceeds bronchus radius")  # do not show any visible label
-              radiusFiducial.SetNthControlPointLocked(0, True)
-              setRadiusLimitFiducial = False
-
-            if self.colorByLocalCurvatureCheckbox.isChecked() or self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-              # Calculate curvature here
-              # if j >= 50 and j < (cell.GetNumberOfPoints() - 50):
-              if pt_id >= localCurveRangeVal and pt_id < (localcurvature_array.GetMaxId()-localCurveRangeVal):
-                curr_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j) ).replace(' ','')[1:-1]).split(',')])
-                prev_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j-localCurveRangeVal) ).replace(' ','')[1:-1]).split(',')])
-                next_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j+localCurveRangeVal) ).replace(' ','')[1:-1]).split(',')])
-
-                # Triangle Lengths
-                a = np.linalg.norm(next_pt - prev_pt) #a = c-b
-                b = np.linalg.norm(next_pt - curr_pt) #b = c-a
-                c = np.linalg.norm(prev_pt - curr_pt) #c = b-a
-                s = (a + b + c)/2.0
-
-                R = a*b*c / 4 / np.sqrt(s * (s - a) * (s - b) * (s - c))
-                local_curvature = 1.0/R * 2550
-
-                # Track min and max values
-                if local_curvature > max_localcurv and not np.isnan(local_curvature) and not local_curvature > 10000: max_localcurv = local_curvature
-                elif local_curvature < min_localcurv and not np.isnan(local_curvature) and not local_curvature < -10000: min_localcurv = local_curvature
-
-                #if localcurvature_array.GetValue(pt_id) == 0.0:
-                if pt_id <= localcurvature_array.GetMaxId() and not np.isnan(local_curvature):
-                  localcurvature_array.SetValue(pt_id, local_curvature)
-
-              if 0 <= pt_id <= (localCurveRangeVal+1) or (localcurvature_array.GetMaxId()-localCurveRangeVal) <= pt_id <= localcurvature_array.GetMaxId():
-                localcurvature_array.SetValue(pt_id, 0.0)
-
-                #else:
-                  #localcurvature_array.SetValue(pt_id, 0.0)
-
-                # to fix value errors for the first and last 30 pts
-                # if 0 <= j < 50:
-                #   localcurvature_array.SetValue(pt_id, 0.0)
-                # if (cell.GetNumberOfPoints()-50) <= j < cell.GetNumberOfPoints():
-                #   localcurvature_array.SetValue(pt_id, 0.0)
-
-            if self.colorByGlobalRelativeAngleCheckbox.isChecked() or self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-              # Calculate global relative angle here 
-              if j > 0 and j < cell.GetNumberOfPoints():
-                # Find the vector of that point to the 10th point ahead of it
-                if j < (cell.GetNumberOfPoints() - 10):
-                  curr_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j) ).replace(' ','')[1:-1]).split(',')])
-                  next_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j+10) ).replace(' ','')[1:-1]).split(',')])
-                  direction = (next_pt - curr_pt)/np.linalg.norm(next_pt - curr_pt)
-
-                # Determine similarity to trachea_vector via dot product:
-                globalrelativeangle_similiarity = np.arccos(np.dot(direction, trachea_vector))
-                #globalrelativeangle_similiarity = np.dot(direction, trachea_vector)
-
-                # Track min and max values
-                if globalrelativeangle_similiarity > max_globalangle: max_globalangle = globalrelativeangle_similiarity
-                elif globalrelativeangle_similiarity < min_globalangle: min_globalangle = globalrelativeangle_similiarity
-
-                # Add similiarity metric to global relative angle array
-                #if globalrelativeangle_array.GetValue(pt_id) == 0.0:
-                if pt_id <= globalrelativeangle_array.GetMaxId():
-                    if not np.isnan(globalrelativeangle_similiarity):
-                        globalrelativeangle_array.SetValue(pt_id, globalrelativeangle_similiarity)
-                    else: 
-                        globalrelativeangle_array.SetValue(pt_id, 0.0)
-                  #print (globalrelativeangle_similiarity)
-
-              if 0 <= pt_id <= 11 or (globalrelativeangle_array.GetMaxId()-10) <= pt_id <= globalrelativeangle_array.GetMaxId():
-                globalrelativeangle_array.SetValue(pt_id, 0.0)
-
-
-            if self.colorByPlaneRotationCheckbox.isChecked() or self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-
-              # Solve for the current vector (15 points ahead of the current point)
-              if j >= 15 and j < (cell.GetNumberOfPoints() - 15):
-                # Find the vector of that point to the 10th point ahead of it
-                prev_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j-15) ).replace(' ','')[1:-1]).split(',')])
-                curr_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j) ).replace(' ','')[1:-1]).split(',')])
-                next_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j+15) ).replace(' ','')[1:-1]).split(',')])
-                current_vector = (next_pt - prev_pt)/np.linalg.norm(next_pt - prev_pt)
-
-                # Take the cross product of the two reference vectors (trachea vector & current vector) to identify the vector that is normal to the plane defined by the reference vectors
-                # The cross product of a and b is a vector perpendicular to both a and b. 
-                if firstPlane:
-                  normal_vector = 100*np.cross(trachea_vector, reference_vector)
-                  firstPlane = False
-                  print("normal_vector (1): ", normal_vector)
-              
-                elif newPlane: # Not first plane -- recalculate the normal vector
-                  normal_vector = 100*np.cross(current_vector, reference_vector)
-                  print("normal_vector (1): ", normal_vector)
-
-                # Solve for the angle between the plane and the current vector
-                planerotation_angle = np.arcsin((np.dot(normal_vector, current_vector))/(np.linalg.norm(normal_vector)*np.linalg.norm(current_vector)))
-
-                # Add the plane to the scene as a model if the plane changes
-                #if newPlane or firstPlane:
-                if newPlane or firstPlane:
-                  if self.colorByPlaneRotationCheckbox.isChecked():
-
-                    print("NEW PLANE!!")
-
-                    d = -np.dot(curr_pt, normal_vector)
-
-                    # Create 2 new points on the plane based on the coordinates of the original point
-                    plane_pt_1z = (-normal_vector[0]*(curr_pt[0] + 50) - normal_vector[1]*curr_pt[1])*1./normal_vector[2]
-                    plane_pt1 = np.array([curr_pt[0]+50, curr_pt[1], plane_pt_1z])
-
-                    plane_pt_2z = (-normal_vector[0]*(curr_pt[0] - 50) - normal_vector[1]*curr_pt[1])*1./normal_vector[2]
-                    plane_pt2 = np.array([curr_pt[0]-50, curr_pt[1], plane_pt_2z])
-
-                    planeModelNode = slicer.mrmlScene.CreateNodeByClass("vtkMRMLMarkupsPlaneNode")
-                    planeModelNode.UnRegister(None)
-                    planeModelNode.SetOrigin(curr_pt)
-
-                    plane_pt1_vtk = vtk.vtkVector3d()
-                    plane_pt1_vtk.SetX(plane_pt1[0])
-                    plane_pt1_vtk.SetY(plane_pt1[1])
-                    plane_pt1_vtk.SetZ(plane_pt1[2])
-
-                    plane_pt2_vtk = vtk.vtkVector3d()
-                    plane_pt2_vtk.SetX(plane_pt2[0])
-                    plane_pt2_vtk.SetY(plane_pt2[1])
-                    plane_pt2_vtk.SetZ(plane_pt2[2])
-
-                    print("plane pt 1 vtk: ", plane_pt1_vtk)
-                    print("plane pt 2 vtk: ", plane_pt2_vtk)
-                    
-                    ctrlpt_1 = planeModelNode.AddControlPoint(plane_pt1_vtk)
-                    ctrlpt_2 = planeModelNode.AddControlPoint(plane_pt2_vtk)
-
-                    #planeModelNode.SetHideFromEditors(False)
-                    #slicer.mrmlScene.AddNode(planeModelNode)
-
-                    print("planeModel: ", planeModelNode)
-                    print("curr_pt: ", curr_pt)
-                    print("normal vector: ", normal_vector)
-                    print("plane_pt1: ", plane_pt1)
-                    print("plane_pt2: ", plane_pt2)
-
-                    newPlane = False
-
-                    firstPlane = False
-
-                # If the angle between the plane and the current vector reaches a threshold (+/- 0.5?), increment the threshold counter
-                if planerotation_angle >= 0.75 or planerotation_angle <= -0.75:
-                  threshold_pass_count += 1
-                  newPlane = False
-                  # Once the threshold has been passed 100 times in a row, update reference vector
-                  # if threshold_pass_count >= 100:
-                  if threshold_pass_count >= 100:
-                    reference_vector = current_vector
-                    threshold_pass_count = 0
-                    newPlane = True
-                    print("PASSED THE THRESHOLD")
-                else:
-                  threshold_pass_count = 0
-                  newPlane = False
-
-                # Track min and max values
-                if planerotation_angle > max_planerotation and not np.isnan(planerotation_angle): max_planerotation = planerotation_angle
-                elif planerotation_angle < min_planerotation and not np.isnan(planerotation_angle): min_planerotation = planerotation_angle
-
-                # Add plane rotation value to the array
-                if pt_id <= planerotation_array.GetMaxId():
-                  if not planerotation_angle > 1.58 and not planerotation_angle < -1.58:
-                    planerotation_array.SetValue(pt_id, np.abs(planerotation_angle))
-                  else:
-                    planerotation_array.SetValue(pt_id, 0.0)
-
-              if 0 <= pt_id <= 15 or (planerotation_array.GetMaxId()-15) <= pt_id <= planerotation_array.GetMaxId():
-                planerotation_array.SetValue(pt_id, 0.0)
-
-
-            if self.colorByCurvatureRateCheckbox.isChecked() or self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-              # Calculate rate of curvature, or overall angle change within a certain amount of distance
-
-              #if j >= 200 and j < (cell.GetNumberOfPoints() - 200):
-              if pt_id >= curvatureRateRangeVal and pt_id < (curvaturerate_array.GetMaxId()-curvatureRateRangeVal):
-                curr_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j) ).replace(' ','')[1:-1]).split(',')])
-                prev_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j-150) ).replace(' ','')[1:-1]).split(',')])
-                next_pt = np.array([float(s) for s in (str( cell_points.GetPoint(j+150) ).replace(' ','')[1:-1]).split(',')])
-
-                # Triangle Lengths
-                a = np.linalg.norm(next_pt - prev_pt) #a = c-b
-                b = np.linalg.norm(next_pt - curr_pt) #b = c-a
-                c = np.linalg.norm(prev_pt - curr_pt) #c = b-a
-                s = (a + b + c)/2.0
-
-                R = a*b*c / 4 / np.sqrt(s * (s - a) * (s - b) * (s - c))
-                curvature_rate = 1.0/R * 2550
-
-                if pt_id <= (curvaturerate_array.GetMaxId()-curvatureRateRangeVal):
-                  saved_curvature_rate = curvature_rate
-                  #print ("saved_curvature_rate: ", saved_curvature_rate)
-
-                if pt_id <= curvaturerate_array.GetMaxId() and not np.isnan(curvature_rate):
-                  curvaturerate_array.SetValue(pt_id, curvature_rate)
-
-                # Track min and max values
-                if curvature_rate > max_curvrate: max_curvrate = curvature_rate
-                elif curvature_rate < min_curvrate: min_curvrate = curvature_rate
-
-              elif pt_id < curvaturerate_array.GetMaxId():
-                curvaturerate_array.SetValue(pt_id, saved_curvature_rate)
-
-              if 0 <= pt_id <= curvatureRateRangeVal:
-                curvaturerate_array.SetValue(pt_id, 0.0)
-
-              if ((curvaturerate_array.GetMaxId()-curvatureRateRangeVal) <= pt_id <= curvaturerate_array.GetMaxId()):
-                curvaturerate_array.SetValue(pt_id, 0.0)
-
-      if self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-
-        # Scale all vtk centerline arrays to 0 to 1 by converting to a numpy array
-        # Normalization/Interpolation step 
-        # radius_array = np.interp(vtk_to_numpy(radius_array), (min_radius, max_radius), (0,1))
-        # localcurvature_array = np.interp(vtk_to_numpy(localcurvature_array), (min_localcurv, max_localcurv), (0,1))
-        # globalrelativeangle_array = np.interp(vtk_to_numpy(globalrelativeangle_array), (min_globalangle, max_globalangle), (0,1))
-        # curvaturerate_array = np.interp(vtk_to_numpy(curvaturerate_array), (min_curvrate, max_curvrate), (0,1))
-
-        # NO INTERPOLATION, just conversion to numpy
-        radius_array = vtk_to_numpy(radius_array)
-        localcurvature_array = vtk_to_numpy(localcurvature_array)
-        globalrelativeangle_array = vtk_to_numpy(globalrelativeangle_array)
-        curvaturerate_array = vtk_to_numpy(curvaturerate_array)
-        planerotation_array = vtk_to_numpy(planerotation_array)
-
-        # Remove excess points from the arrays that would prevent broadcasting them together
-        minLength = np.min([len(radius_array), len(localcurvature_array), len(globalrelativeangle_array), len(curvaturerate_array), len(planerotation_array)])
-        print(minLength)
-        radius_array = radius_array[:minLength]
-        localcurvature_array = localcurvature_array[:minLength]
-        globalrelativeangle_array = globalrelativeangle_array[:minLength]
-        curvaturerate_array = curvaturerate_array[:minLength]
-        planerotation_array = planerotation_array[:minLength]
-
-        totalindex_array = []
-        for i in range(minLength):
-          # Tuning of curvature parameters occurs here -- modify the scalar multiplier to affect the weight of each parameter
-          # totalindex_array.append(1.0*(100-radius_array[i]) + 1.0*localcurvature_array[i] + 1.0*(100-globalrelativeangle_array[i]) + 1.0*curvaturerate_array[i])
-          # totalindex_array.append(radiusScalar*(1-radius_array[i]) + localCurvatureScalar*localcurvature_array[i] + globalAngleScalar*(1-globalrelativeangle_array[i]) + curvatureRateScalar*curvaturerate_array[i])
-          # totalindex_array.append(0.5*radiusScalar*(10-radius_array[i]) + 0.02*localCurvatureScalar*localcurvature_array[i] + 2.5*globalAngleScalar*(1-globalrelativeangle_array[i]) + 0.04*curvatureRateScalar*curvaturerate_array[i])
-          totalindex_array.append(0.01*i + 0.25*(11-radius_array[i]) + 0.04*(11-radius_array[i])*localcurvature_array[i] + 2.5*(1-globalrelativeangle_array[i]) + 0.04*curvaturerate_array[i] + 10*np.abs(planerotation_array[i]))
-
-
-        # Convert all numpy arrays back to vtkdoublearrays
-        from vtk.util.numpy_support import numpy_to_vtk
-        radius_array = numpy_to_vtk(radius_array)
-        localcurvature_array = numpy_to_vtk(localcurvature_array)
-        globalrelativeangle_array = numpy_to_vtk(globalrelativeangle_array)
-        planerotation_array = numpy_to_vtk(planerotation_array)
-        curvaturerate_array = numpy_to_vtk(curvaturerate_array)
-        totalindex_array = numpy_to_vtk(totalindex_array)
-
-        # for k in range(totalindex_array.GetMaxId()):
-        #   print (totalindex_array.GetValue(k))
-
-        # Generate total index array label
-        totalindex_array.SetName("Total Difficulty Index")
-
-
-      if self.colorByCumulativeIndexCheckbox.isChecked():
-        # Define cumulative index vtkdoublearray
-        cumulativeindex_array = vtk.vtkDoubleArray()
-        cumulativeindex_array.SetName("Cumulative Difficulty Index")
-        cumulativeindex_array.SetNumberOfValues(radius_array.GetMaxId())
-
-        for i in range( network.GetNumberOfCells() ):
-          # Iterate through each cell
-          cell = network.GetCell(i)
-          cell_ids = cell.GetPointIds()
-          cell_points = cell.GetPoints()
-      
-          cumulativeIndex = 0.0
-          highest = 45.0
-
-          # Define a threshold value that the Total Difficulty Index must meet in order to be included in the Cumulative Difficulty Index
-          thresholdForInclusion = 0.0
-
-          if cell.GetNumberOfPoints() > 100:
-            for j in range( cell.GetNumberOfPoints() ):
-              pt_id = cell_ids.GetId(j)        
-
-              # Option 1: Add every "difficulty" metric down a branch
-              if 0 <= pt_id and pt_id < cumulativeindex_array.GetNumberOfValues():
-                currentDifficultyIndex = totalindex_array.GetValue(pt_id)
-                if currentDifficultyIndex > thresholdForInclusion and not np.isnan(currentDifficultyIndex):
-                    cumulativeIndex += currentDifficultyIndex
-                cumulativeindex_array.SetValue(pt_id, cumulativeIndex)
-                print (cumulativeIndex)
-
-              # Option 2: Save the highest difficulty metric on the branch so far
-              # if 0 <= pt_id and pt_id < cumulativeindex_array.GetNumberOfValues():
-              #   curr = totalindex_array.GetValue(pt_id)
-              #   if curr > highest: highest = curr
-              #   cumulativeindex_array.SetValue(pt_id, highest)
-
-
-      # Set all pt values in all arrays to 0.0 IF the radius is smaller than the radius of the bronchoscope
-      for i in range( network.GetNumberOfCells() ):
-        # Iterate through each cell
-        cell = network.GetCell(i)
-        cell_ids = cell.GetPointIds()
-        cell_points = cell.GetPoints()
-        for j in range( cell.GetNumberOfPoints() ):
-          pt_id = cell_ids.GetId(j)
-
-          if 0 <= pt_id and pt_id < radius_array.GetNumberOfValues()-1:
-            pt_r = radius_array.GetValue( pt_id )
-            if pt_r < bronchoscope_radius:
-              radius_array.SetValue(pt_id, 0.0)
-              if self.colorByLocalCurvatureCheckbox.isChecked():
-                localcurvature_array.SetValue(pt_id, 0.0)
-              if self.colorByGlobalRelativeAngleCheckbox.isChecked():
-                globalrelativeangle_array.SetValue(pt_id, 0.0)
-              if self.colorByPlaneRotationCheckbox.isChecked():
-                planerotation_array.SetValue(pt_id, 0.0)
-              if self.colorByCurvatureRateCheckbox.isChecked():
-                curvaturerate_array.SetValue(pt_id, 0.0)
-              if self.colorByTotalIndexCheckbox.isChecked():
-                totalindex_array.SetValue(pt_id, 0.0)
-              if self.colorByCumulativeIndexCheckbox.isChecked():
-                cumulativeindex_array.SetValue(pt_id, 0.0)
-
-            
-      if self.colorByRadiusCheckbox.isChecked():
+      min_radius, max_radius = difficulty.ranges["Radius"]
+      min_localcurv, max_localcurv = difficulty.ranges["Local Curvature"]
+      min_globalangle, max_globalangle = difficulty.ranges["GlobalRelativeAngle"]
+      min_planerotation, max_planerotation = difficulty.ranges["PlaneRotation"]
+      min_curvrate, max_curvrate = difficulty.ranges["Curvature Rate"]
+      verboseLog.debug("Min radius: %s", min_radius)
+      verboseLog.debug("Max radius: %s", max_radius)
+      for scale, values, min_localcurvscale, max_localcurvscale in difficulty.localCurvatureScales:
+        verboseLog.debug("Local curvature +/-%s min: %s max: %s", scale, min_localcurvscale, max_localcurvscale)
+
+      # Generate the metric arrays
+      radius_array = numpy_to_vtk(difficulty.radius, deep=1)
+      localcurvature_array = difficulty.vtkArray("Local Curvature")
+      localcurvaturescale_arrays = difficulty.localCurvatureScaleArrays()
+      globalrelativeangle_array = difficulty.vtkArray("GlobalRelativeAngle")
+      planerotation_array = difficulty.vtkArray("PlaneRotation")
+      curvaturerate_array = difficulty.vtkArray("Curvature Rate")
+      if "Total Difficulty Index" in colorBy or "Cumulative Difficulty Index" in colorBy:
+        totalindex_array = difficulty.vtkArray("Total Difficulty Index")
+      if "Cumulative Difficulty Index" in colorBy:
+        cumulativeindex_array = difficulty.vtkArray("Cumulative Difficulty Index")
+
+      if "Radius" in colorBy:
         self.minRadiusTextbox.setText(min_radius)
 
-      if self.colorByLocalCurvatureCheckbox.isChecked():
+      if "Local Curvature" in colorBy:
         network.GetPointData().AddArray(localcurvature_array)
         self.maxLocalCurvTextbox.setText(max_localcurv)
 
-      if self.colorByGlobalRelativeAngleCheckbox.isChecked():
+      for localcurvaturescale_array in localcurvaturescale_arrays:
+        network.GetPointData().AddArray(localcurvaturescale_array)
+
+      if "GlobalRelativeAngle" in colorBy:
         network.GetPointData().AddArray(globalrelativeangle_array)
         self.minAngleTextbox.setText(min_globalangle)
 
-      if self.colorByPlaneRotationCheckbox.isChecked():
+      if "PlaneRotation" in colorBy:
         network.GetPointData().AddArray(planerotation_array)
         self.maxPlaneRotationTextbox.setText(max_planerotation)
         self.minPlaneRotationTextbox.setText(min_planerotation)
 
-      if self.colorByCurvatureRateCheckbox.isChecked():
+      if "Curvature Rate" in colorBy:
         network.GetPointData().AddArray(curvaturerate_array)
         self.maxCurvRateTextbox.setText(round(np.amax(curvaturerate_array),2))
 
-      if self.colorByTotalIndexCheckbox.isChecked():
+      if "Total Difficulty Index" in colorBy:
         network.GetPointData().AddArray(totalindex_array)
         self.maxTotalDifficultyIndexTextbox.setText(round(np.amax(totalindex_array),2))
 
@@ -1117,7 +826,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
         self.minPlaneRotationTextbox.setText(min_planerotation)
         self.maxCurvRateTextbox.setText(max_curvrate)
 
-      if self.colorByCumulativeIndexCheckbox.isChecked():
+      if "Cumulative Difficulty Index" in colorBy:
         network.GetPointData().AddArray(cumulativeindex_array)
         self.maxCumulativeIndexTextbox.setText(round(np.amax(cumulativeindex_array),2))
         self.maxTotalDifficultyIndexTextbox.setText(round(np.amax(totalindex_array),2))
@@ -1133,113 +842,19 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       slicer.network = network
 
 
-      # Write the points for each path to a file
-      from sys import platform
+      # Write the points of every branch to the raw data file, and the minimum and maximum metric values to another file
       if self.outputDirectory != '':
-        for i in range( network.GetNumberOfCells() ):
-          # Iterate through each cell
-          cell = network.GetCell(i)
-          cell_ids = cell.GetPointIds()
-          cell_points = cell.GetPoints()
-
-          if cell.GetNumberOfPoints() > 100:
-            dir = self.outputDirectory
-
-            # if the OS is Windows
-            if platform == 'win32':
-                if outputFilename == '':
-                  outputFilename = "\\raw_data.txt"
-                else:
-                  outputFilename = "\\" + outputFilename + ".txt"
-            # else if the OS is Linux or Mac
-            else:
-                if outputFilename == '':
-                  outputFilename = "/raw_data.txt"
-                else:
-                  outputFilename = "/" + outputFilename + ".txt"
-
-            if not os.path.exists(dir):
-              os.makedirs(dir)
-            with open(dir + outputFilename,"w") as f:
-          
-              for j in range( cell.GetNumberOfPoints() ):
-                pt_str = str( cell_points.GetPoint(j) ).replace(' ','')[1:-1]
-                pt_id = cell_ids.GetId(j)
-                if 0 <= pt_id and pt_id < radius_array.GetNumberOfValues()-1:
-                  pt_write = radius_array.GetValue( pt_id )
-
-                  if self.colorByLocalCurvatureCheckbox.isChecked():
-                    pt_write = localcurvature_array.GetValue(pt_id)
-                  if self.colorByGlobalRelativeAngleCheckbox.isChecked():
-                    pt_write = globalrelativeangle_array.GetValue(pt_id)
-                  if self.colorByPlaneRotationCheckbox.isChecked():
-                    pt_write = planerotation_array.GetValue(pt_id)
-                  if self.colorByCurvatureRateCheckbox.isChecked():
-                    pt_write = curvaturerate_array.GetValue(pt_id)
-                  if self.colorByTotalIndexCheckbox.isChecked():
-                    pt_1 = radius_array.GetValue(pt_id)
-                    pt_2 = localcurvature_array.GetValue(pt_id)
-                    pt_3 = globalrelativeangle_array.GetValue(pt_id)
-                    pt_4 = planerotation_array.GetValue(pt_id)
-                    pt_5 = curvaturerate_array.GetValue(pt_id)
-                    pt_6 = totalindex_array.GetValue(pt_id)
-                    
-                    if pt_1 == 0.0: 
-                      pt_1 = float("NaN")
-                    if pt_2 == 0.0: 
-                      pt_2 = float("NaN")
-                    if pt_3 == 0.0: 
-                      pt_3 = float("NaN")
-                    if pt_4 == 0.0: 
-                      pt_4 = float("NaN")
-                    if pt_5 == 0.0: 
-                      pt_5 = float("NaN")
-
-                    pt_write = str(pt_1) + ',' + str(pt_2) + ',' + str(pt_3) + ',' + str(pt_4) + ',' + str(pt_5) + ',' + str(pt_6)
-
-                  if self.colorByCumulativeIndexCheckbox.isChecked():
-                    pt_1 = radius_array.GetValue(pt_id)
-                    pt_2 = localcurvature_array.GetValue(pt_id)
-                    pt_3 = globalrelativeangle_array.GetValue(pt_id)
-                    pt_4 = planerotation_array.GetValue(pt_id)
-                    pt_5 = curvaturerate_array.GetValue(pt_id)
-                    pt_6 = totalindex_array.GetValue(pt_id)
-                    pt_7 = cumulativeindex_array.GetValue(pt_id)
-                    
-                    if pt_1 == 0.0: 
-                      pt_1 = float("NaN")
-                    if pt_2 == 0.0: 
-                      pt_2 = float("NaN")
-                    if pt_3 == 0.0: 
-                      pt_3 = float("NaN")
-                    if pt_4 == 0.0: 
-                      pt_4 = float("NaN")
-                    if pt_5 == 0.0: 
-                      pt_5 = float("NaN")
-
-                    pt_write = str(pt_1) + ',' + str(pt_2) + ',' + str(pt_3) + ',' + str(pt_4) + ',' + str(pt_5) + ',' + str(pt_6) + ',' + str(pt_7)
-
-                  f.write( str(pt_id) + ',' + pt_str + ',' + str( pt_write ) + '\n' )
-
-      # Write minimum and maximum metric values to another file
-      if self.outputDirectory != '' and minMaxOutputFilename != '':
-        if self.colorByTotalIndexCheckbox.isChecked() or self.colorByCumulativeIndexCheckbox.isChecked():
-          if platform == 'win32':
-            minMaxOutputFilename = "\\" + minMaxOutputFilename + ".txt"
-          else: # else if the OS is Linux or Mac
-            minMaxOutputFilename = "/" + minMaxOutputFilename + ".txt"
-
-          with open(dir + minMaxOutputFilename,"w") as f:
-            f.write ("max radius" + ',' + str(max_radius) + '\n')
-            f.write ("min radius" + ',' + str(min_radius) + '\n')
-            f.write ("max local curvature" + ',' + str(max_localcurv) + '\n')
-            f.write ("min local curvature" + ',' + str(min_localcurv) + '\n')
-            f.write ("max global relative angle" + ',' + str(max_globalangle) + '\n')
-            f.write ("min global relative angle" + ',' + str(min_globalangle) + '\n')
-            f.write ("max plane rotation" + ',' + str(max_planerotation) + '\n')
-            f.write ("min plane rotation" + ',' + str(min_planerotation) + '\n')
-            f.write ("max curvature rate" + ',' + str(max_curvrate) + '\n')
-            f.write ("min curvature rate" + ',' + str(min_curvrate) + '\n')
+        if not os.path.exists(self.outputDirectory):
+          os.makedirs(self.outputDirectory)
+        rawDataFileName = os.path.join(self.outputDirectory, (outputFilename or "raw_data") + ".txt")
+        with self.logic.profilerStage("writeRawData", network):
+          writeRawData(rawDataFileName, difficulty)
+        # the same columns in binary, for CenterlineSlider
+        with self.logic.profilerStage("writeMetricStore", network):
+          writeMetricStore(metricStoreFileName(rawDataFileName), difficulty)
+
+        if minMaxOutputFilename != '' and ("Total Difficulty Index" in colorBy or "Cumulative Difficulty Index" in colorBy):
+          writeMinMax(os.path.join(self.outputDirectory, minMaxOutputFilename + ".txt"), difficulty)
 
     # ---------------------------------- Color Table Node ------------------------------------------
 
@@ -1255,7 +870,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
         slicer.mrmlScene.AddNode(colorNode)
 
         # Specify colormap based on selected metric
-        if self.colorByRadiusCheckbox.isChecked(): # MINIMUM IS RED, MAXIMUM IS BLUE
+        if "Radius" in colorBy: # MINIMUM IS RED, MAXIMUM IS BLUE
             colorTableRangeMaximum = max_radius
             colorTableRangeMinimum = min_radius
             colorMap = colorNode.GetColorTransferFunction()
@@ -1265,7 +880,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
             colorMap.AddRGBPoint((colorTableRangeMaximum+colorTableRangeMinimum)/2.0, 1.0, 1.0, 0.0)
             colorMap.AddRGBPoint(colorTableRangeMaximum, 0.0, 0.0, 1.0)
             colorMapTitle = "Radius (mm)"
-        elif self.colorByLocalCurvatureCheckbox.isChecked(): # MINIMUM IS BLUE, MAXIMUM IS RED
+        elif "Local Curvature" in colorBy: # MINIMUM IS BLUE, MAXIMUM IS RED
             colorTableRangeMaximum = max_localcurv
             colorTableRangeMinimum = min_localcurv
             colorMap = colorNode.GetColorTransferFunction()
@@ -1275,7 +890,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
             colorMap.AddRGBPoint((colorTableRangeMaximum+colorTableRangeMinimum)/2.0, 1.0, 1.0, 0.0)
             colorMap.AddRGBPoint(colorTableRangeMaximum, 1.0, 0.0, 0.0)
             colorMapTitle = "Local Curvature (1/mm)"
-        elif self.colorByGlobalRelativeAngleCheckbox.isChecked(): # MINIMUM IS BLUE, MAXIMUM IS RED
+        elif "GlobalRelativeAngle" in colorBy: # MINIMUM IS BLUE, MAXIMUM IS RED
             colorTableRangeMaximum = max_globalangle
             colorTableRangeMinimum = min_globalangle
             colorMap = colorNode.GetColorTransferFunction()
@@ -1285,7 +900,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
             colorMap.AddRGBPoint((colorTableRangeMaximum+colorTableRangeMinimum)/2.0, 1.0, 1.0, 0.0)
             colorMap.AddRGBPoint(colorTableRangeMaximum, 1.0, 0.0, 0.0)
             colorMapTitle = "Global Relative Angle (rad)"
-        elif self.colorByPlaneRotationCheckbox.isChecked(): # MINIMUM IS BLUE, MAXIMUM IS RED
+        elif "PlaneRotation" in colorBy: # MINIMUM IS BLUE, MAXIMUM IS RED
             colorTableRangeMaximum = max_planerotation
             colorTableRangeMinimum = min_planerotation
             colorMap = colorNode.GetColorTransferFunction()
@@ -1295,7 +910,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
             colorMap.AddRGBPoint((colorTableRangeMaximum+colorTableRangeMinimum)/2.0, 1.0, 1.0, 0.0)
             colorMap.AddRGBPoint(colorTableRangeMaximum, 1.0, 0.0, 0.0)
             colorMapTitle = "Plane Rotation (rad)"
-        elif self.colorByCurvatureRateCheckbox.isChecked():
+        elif "Curvature Rate" in colorBy:
             colorTableRangeMaximum = max_curvrate
             colorTableRangeMinimum = min_curvrate
             colorMap = colorNode.GetColorTransferFunction()
@@ -1317,7 +932,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
 
     # ----------------------------------------------------------------------------
 
-    if self.colorByRadiusCheckbox.isChecked():
+    if "Radius" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1330,7 +945,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileHotToColdRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByLocalCurvatureCheckbox.isChecked():
+    elif "Local Curvature" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1343,7 +958,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByGlobalRelativeAngleCheckbox.isChecked():
+    elif "GlobalRelativeAngle" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1356,7 +971,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByPlaneRotationCheckbox.isChecked():
+    elif "PlaneRotation" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1369,7 +984,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByCurvatureRateCheckbox.isChecked():
+    elif "Curvature Rate" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1382,7 +997,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByTotalIndexCheckbox.isChecked():
+    elif "Total Difficulty Index" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1395,7 +1010,7 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       display.SetAndObserveColorNodeID('vtkMRMLColorTableNodeFileColdToHotRainbow.txt')
       display.SetScalarVisibility(True)
 
-    elif self.colorByCumulativeIndexCheckbox.isChecked():
+    elif "Cumulative Difficulty Index" in colorBy:
       # https://gist.github.com/ungi/c1c448fa51cc458d3da75f5e5c73c74c
       slicer.mrmlScene.AddNode(currentOutputModelNode)
       currentOutputModelNode.SetName('OutputModelNode')
@@ -1442,291 +1057,19 @@ class ModifiedCenterlineComputationWidget(ScriptedLoadableModuleWidget):
       currentVoronoiModelDisplayNode.SetVisibility(1)
       currentVoronoiModelDisplayNode.SetOpacity(0.5)
 
+    profiler = self.logic.profiler
+    if profiler is not None:
+      logging.info("Centerline computation stages:\n" + profiler.summary())
+      if self.outputDirectory != '':
+        if not os.path.exists(self.outputDirectory):
+          os.makedirs(self.outputDirectory)
+        profiler.writeJson(os.path.join(self.outputDirectory, "profile.json"))
+        profiler.writeChromeTrace(os.path.join(self.outputDirectory, "profile.trace.json"))
+
     logging.debug("End of Centerline Computation..")
 
     return True
 
-class CenterlineComputationLogic(object):
-    '''
-    classdocs
-    '''
-
-
-    def __init__(self):
-        '''
-        Constructor
-        '''
-
-    def prepareModel(self, polyData):
-        '''
-        '''
-        # import the vmtk libraries
-        try:
-            import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
-            import vtkvmtkMiscPython as vtkvmtkMisc
-        except ImportError:
-            logging.error("Unable to import the SlicerVmtk libraries")
-
-        capDisplacement = 0.0
-
-        surfaceCleaner = vtk.vtkCleanPolyData()
-        surfaceCleaner.SetInputData(polyData)
-        surfaceCleaner.Update()
-
-        surfaceTriangulator = vtk.vtkTriangleFilter()
-        surfaceTriangulator.SetInputData(surfaceCleaner.GetOutput())
-        surfaceTriangulator.PassLinesOff()
-        surfaceTriangulator.PassVertsOff()
-        surfaceTriangulator.Update()
-
-        # new steps for preparation to avoid problems because of slim models (f.e. at stenosis)
-        subdiv = vtk.vtkLinearSubdivisionFilter()
-        subdiv.SetInputData(surfaceTriangulator.GetOutput())
-        subdiv.SetNumberOfSubdivisions(1)
-        subdiv.Update()
-
-        smooth = vtk.vtkWindowedSincPolyDataFilter()
-        smooth.SetInputData(subdiv.GetOutput())
-        smooth.SetNumberOfIterations(20)
-        smooth.SetPassBand(0.1)
-        smooth.SetBoundarySmoothing(1)
-        smooth.Update()
-
-        normals = vtk.vtkPolyDataNormals()
-        normals.SetInputData(smooth.GetOutput())
-        normals.SetAutoOrientNormals(1)
-        normals.SetFlipNormals(0)
-        normals.SetConsistency(1)
-        normals.SplittingOff()
-        normals.Update()
-
-        surfaceCapper = vtkvmtkComputationalGeometry.vtkvmtkCapPolyData()
-        surfaceCapper.SetInputData(normals.GetOutput())
-        surfaceCapper.SetDisplacement(capDisplacement)
-        surfaceCapper.SetInPlaneDisplacement(capDisplacement)
-        surfaceCapper.Update()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(surfaceCapper.GetOutput())
-
-        return outPolyData
-
-
-    def decimateSurface(self, polyData):
-        '''
-        '''
-
-        decimationFilter = vtk.vtkDecimatePro()
-        decimationFilter.SetInputData(polyData)
-        decimationFilter.SetTargetReduction(0.99)
-        decimationFilter.SetBoundaryVertexDeletion(0)
-        decimationFilter.PreserveTopologyOn()
-        decimationFilter.Update()
-
-        cleaner = vtk.vtkCleanPolyData()
-        cleaner.SetInputData(decimationFilter.GetOutput())
-        cleaner.Update()
-
-        triangleFilter = vtk.vtkTriangleFilter()
-        triangleFilter.SetInputData(cleaner.GetOutput())
-        triangleFilter.Update()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(triangleFilter.GetOutput())
-
-        return outPolyData
-
-
-    def openSurfaceAtPoint(self, polyData, seed):
-        '''
-        Returns a new surface with an opening at the given seed.
-        '''
-
-        someradius = 1.0
-
-        pointLocator = vtk.vtkPointLocator()
-        pointLocator.SetDataSet(polyData)
-        pointLocator.BuildLocator()
-
-        # find the closest point next to the seed on the surface
-        # id = pointLocator.FindClosestPoint(int(seed[0]),int(seed[1]),int(seed[2]))
-        id = pointLocator.FindClosestPoint(seed)
-
-        # the seed is now guaranteed on the surface
-        seed = polyData.GetPoint(id)
-
-        sphere = vtk.vtkSphere()
-        sphere.SetCenter(seed[0], seed[1], seed[2])
-        sphere.SetRadius(someradius)
-
-        clip = vtk.vtkClipPolyData()
-        clip.SetInputData(polyData)
-        clip.SetClipFunction(sphere)
-        clip.Update()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(clip.GetOutput())
-
-        return outPolyData
-
-
-
-    def extractNetwork(self, polyData):
-        '''
-        Returns the network of the given surface.
-        '''
-        # import the vmtk libraries
-        try:
-            import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
-            import vtkvmtkMiscPython as vtkvmtkMisc
-        except ImportError:
-            logging.error("Unable to import the SlicerVmtk libraries")
-
-        radiusArrayName = 'Radius'
-        topologyArrayName = 'Topology'
-        marksArrayName = 'Marks'
-
-        networkExtraction = vtkvmtkMisc.vtkvmtkPolyDataNetworkExtraction()
-        networkExtraction.SetInputData(polyData)
-        networkExtraction.SetAdvancementRatio(1.05)
-        networkExtraction.SetRadiusArrayName(radiusArrayName)
-        networkExtraction.SetTopologyArrayName(topologyArrayName)
-        networkExtraction.SetMarksArrayName(marksArrayName)
-        networkExtraction.Update()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(networkExtraction.GetOutput())
-
-        return outPolyData
-
-
-    def clipSurfaceAtEndPoints(self, networkPolyData, surfacePolyData):
-        '''
-        Clips the surfacePolyData on the endpoints identified using the networkPolyData.
-
-        Returns a tupel of the form [clippedPolyData, endpointsPoints]
-        '''
-        # import the vmtk libraries
-        try:
-            import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
-            import vtkvmtkMiscPython as vtkvmtkMisc
-        except ImportError:
-            logging.error("Unable to import the SlicerVmtk libraries")
-
-        cleaner = vtk.vtkCleanPolyData()
-        cleaner.SetInputData(networkPolyData)
-        cleaner.Update()
-        network = cleaner.GetOutput()
-        network.BuildCells()
-        network.BuildLinks(0)
-        endpointIds = vtk.vtkIdList()
-
-        radiusArray = network.GetPointData().GetArray('Radius')
-
-        endpoints = vtk.vtkPolyData()
-        endpointsPoints = vtk.vtkPoints()
-        endpointsRadius = vtk.vtkDoubleArray()
-        endpointsRadius.SetName('Radius')
-        endpoints.SetPoints(endpointsPoints)
-        endpoints.GetPointData().AddArray(endpointsRadius)
-
-        radiusFactor = 1.2
-        minRadius = 0.01
-
-        for i in range(network.GetNumberOfCells()):
-            numberOfCellPoints = network.GetCell(i).GetNumberOfPoints()
-            pointId0 = network.GetCell(i).GetPointId(0)
-            pointId1 = network.GetCell(i).GetPointId(numberOfCellPoints - 1)
-
-            pointCells = vtk.vtkIdList()
-            network.GetPointCells(pointId0, pointCells)
-            numberOfEndpoints = endpointIds.GetNumberOfIds()
-            if pointCells.GetNumberOfIds() == 1:
-                pointId = endpointIds.InsertUniqueId(pointId0)
-                if pointId == numberOfEndpoints:
-                    point = network.GetPoint(pointId0)
-                    radius = radiusArray.GetValue(pointId0)
-                    radius = max(radius, minRadius)
-                    endpointsPoints.InsertNextPoint(point)
-                    endpointsRadius.InsertNextValue(radiusFactor * radius)
-
-            pointCells = vtk.vtkIdList()
-            network.GetPointCells(pointId1, pointCells)
-            numberOfEndpoints = endpointIds.GetNumberOfIds()
-            if pointCells.GetNumberOfIds() == 1:
-                pointId = endpointIds.InsertUniqueId(pointId1)
-                if pointId == numberOfEndpoints:
-                    point = network.GetPoint(pointId1)
-                    radius = radiusArray.GetValue(pointId1)
-                    radius = max(radius, minRadius)
-                    endpointsPoints.InsertNextPoint(point)
-                    endpointsRadius.InsertNextValue(radiusFactor * radius)
-
-        polyBall = vtkvmtkComputationalGeometry.vtkvmtkPolyBall()
-        #polyBall.SetInputData(endpoints)
-        polyBall.SetInput(endpoints)
-        polyBall.SetPolyBallRadiusArrayName('Radius')
-
-        clipper = vtk.vtkClipPolyData()
-        clipper.SetInputData(surfacePolyData)
-        clipper.SetClipFunction(polyBall)
-        clipper.Update()
-
-        connectivityFilter = vtk.vtkPolyDataConnectivityFilter()
-        connectivityFilter.SetInputData(clipper.GetOutput())
-        connectivityFilter.ColorRegionsOff()
-        connectivityFilter.SetExtractionModeToLargestRegion()
-        connectivityFilter.Update()
-
-        clippedSurface = connectivityFilter.GetOutput()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(clippedSurface)
-
-        return [outPolyData, endpointsPoints]
-
-
-    def computeCenterlines(self, polyData, inletSeedIds, outletSeedIds):
-        '''
-        Returns a tupel of two vtkPolyData objects.
-        The first are the centerlines, the second is the corresponding Voronoi diagram.
-        '''
-        # import the vmtk libraries
-        try:
-            import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
-            import vtkvmtkMiscPython as vtkvmtkMisc
-        except ImportError:
-            logging.error("Unable to import the SlicerVmtk libraries")
-
-        flipNormals = 0
-        radiusArrayName = 'Radius'
-        costFunction = '1/R'
-
-
-        centerlineFilter = vtkvmtkComputationalGeometry.vtkvmtkPolyDataCenterlines()
-        centerlineFilter.SetInputData(polyData)
-        centerlineFilter.SetSourceSeedIds(inletSeedIds)
-        centerlineFilter.SetTargetSeedIds(outletSeedIds)
-        centerlineFilter.SetRadiusArrayName(radiusArrayName)
-        centerlineFilter.SetCostFunction(costFunction)
-        centerlineFilter.SetFlipNormals(flipNormals)
-        centerlineFilter.SetAppendEndPointsToCenterlines(0)
-        centerlineFilter.SetSimplifyVoronoi(0)
-        centerlineFilter.SetCenterlineResampling(0)
-        centerlineFilter.SetResamplingStepLength(1.0)
-        centerlineFilter.Update()
-
-        outPolyData = vtk.vtkPolyData()
-        outPolyData.DeepCopy(centerlineFilter.GetOutput())
-
-        outPolyData2 = vtk.vtkPolyData()
-        outPolyData2.DeepCopy(centerlineFilter.GetVoronoiDiagram())
-
-        return [outPolyData, outPolyData2]
-
-
-
-    
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
   implemented as a python class.